@@ -0,0 +1,157 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Record HTTP traffic to the disk, and replay it later without network access.
+
+A cassette is a directory with two files:
+ - index.jsonl: one line per exchange, containing the request key, the response status,
+   headers, cookies, redirect history and the location of the body in bodies.bin
+ - bodies.bin: zlib compressed response bodies, appended after each other"""
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import defaultdict, deque
+from datetime import timedelta
+from typing import Deque, Dict, List
+from urllib.parse import urljoin
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+INDEX_FILENAME = 'index.jsonl'
+BODIES_FILENAME = 'bodies.bin'
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """Raised when replaying, if a request was not recorded in the cassette.
+    Subclass of ConnectionError, so it's handled the same way as a network failure."""
+
+def request_key(method: str, url: str, **kwargs) -> str:
+    """Identify a request by its method, full URL (including query parameters) and body"""
+    prepared = requests.Request(method, url,
+        params=kwargs.get('params'),
+        data=kwargs.get('data'),
+        json=kwargs.get('json')).prepare()
+    body = prepared.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return f'{method} {prepared.url} {hashlib.sha1(body).hexdigest()[:16]}'
+
+class Cassette:
+    def __init__(self, path: str, mode: str):
+        """Open a cassette
+
+        Args:
+            path (str): The directory of the cassette
+            mode (str): 'record' to append new exchanges, 'replay' to serve recorded ones"""
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Invalid cassette mode {mode}')
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Deque[dict]] = defaultdict(deque)
+
+        if mode == 'record':
+            os.makedirs(path, exist_ok=True)
+            self.index_file = open(os.path.join(path, INDEX_FILENAME), 'a', encoding='utf-8')
+            self.bodies_file = open(os.path.join(path, BODIES_FILENAME), 'ab')
+        else:
+            with open(os.path.join(path, INDEX_FILENAME), 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries[entry['key']].append(entry)
+            self.bodies_file = open(os.path.join(path, BODIES_FILENAME), 'rb')
+            print(f'Replaying {sum(map(len, self.entries.values()))} recorded requests from {path}')
+
+    def record(self, key: str, response: requests.Response):
+        """Append a response to the cassette"""
+        body = zlib.compress(response.content)
+        cookies: List[dict] = []
+        for r in [*response.history, response]:
+            cookies.extend([
+                {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path}
+                for c in r.cookies ])
+
+        with self.lock:
+            offset = self.bodies_file.tell()
+            self.bodies_file.write(body)
+            self.bodies_file.flush()
+            entry = {
+                'key': key,
+                'url': response.url,
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': dict(response.headers),
+                'cookies': cookies,
+                'history': [
+                    {'url': r.url, 'status': r.status_code, 'headers': dict(r.headers)}
+                    for r in response.history ],
+                'elapsed': response.elapsed.total_seconds(),
+                'offset': offset,
+                'length': len(body),
+            }
+            self.index_file.write(json.dumps(entry) + '\n')
+            self.index_file.flush()
+
+    def replay(self, key: str, session: requests.Session) -> requests.Response:
+        """Get the next recorded response for a request.
+        Responses of repeated requests are served in the recorded order, and the last one
+        is served again when the recording runs out."""
+        with self.lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise CassetteMiss(f'Request not found in cassette {self.path}: {key}')
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+            self.bodies_file.seek(entry['offset'])
+            body = zlib.decompress(self.bodies_file.read(entry['length']))
+
+        for cookie in entry['cookies']:
+            session.cookies.set(cookie['name'], cookie['value'],
+                domain=cookie['domain'], path=cookie['path'])
+
+        response = build_response(entry['url'], entry['status'], entry['headers'], body)
+        response.reason = entry['reason']
+        response.elapsed = timedelta(seconds=entry['elapsed'])
+        response.history = [ build_response(r['url'], r['status'], r['headers'], b'')
+                            for r in entry['history'] ]
+        return response
+
+    def close(self):
+        if self.mode == 'record':
+            self.index_file.close()
+        self.bodies_file.close()
+
+def build_response(url: str, status: int, headers: dict, body: bytes) -> requests.Response:
+    """Construct a requests Response object without sending a request"""
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response._content_consumed = True
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    if response.is_redirect:
+        # Used by ItchGame.check_redirect_url()
+        response._next = requests.Request('GET', urljoin(url, headers['Location'])).prepare()
+    return response
@@ -0,0 +1,170 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Export of the catalog as flat tables, for analysing it with other tools.
+
+Two tables are written: games (one row per game) and sales (one row per sale, with the ID
+of its game). Each table is written as NDJSON, and as Parquet if pyarrow is installed,
+otherwise as CSV. Rows are written in batches of BATCH_ROWS, so the memory used doesn't
+depend on the size of the catalog."""
+
+import array
+import csv
+import json
+import os
+from typing import Dict, Iterable, List, Tuple
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+BATCH_ROWS = 10000
+
+# Columns of the tables: name and type (int, float, str or bool)
+GAMES_COLUMNS = [
+    ('id', 'int'),
+    ('name', 'str'),
+    ('url', 'str'),
+    ('price', 'float'),
+    ('claimable', 'bool'),
+    ('cover_image', 'str'),
+    ('sale_count', 'int'),
+    ('first_sale_start', 'int'),
+    ('last_sale_end', 'int'),
+]
+SALES_COLUMNS = [
+    ('id', 'int'),
+    ('game_id', 'int'),
+    ('start', 'int'),
+    ('end', 'int'),
+]
+
+# Columns that are never null. They are collected in arrays instead of lists.
+REQUIRED_COLUMNS = ('id', 'game_id', 'start', 'end')
+
+FORMATS = ('auto', 'parquet', 'csv')
+
+class Table:
+    def __init__(self, output_dir: str, name: str, columns: List[Tuple[str, str]], binary_format: str):
+        """A table that is being written
+
+        Args:
+            output_dir (str): The directory of the files
+            name (str): The name of the table, used as the name of the files
+            columns (List[Tuple[str, str]]): The name and the type of the columns
+            binary_format (str): parquet or csv"""
+        self.columns = columns
+        self.names = [ column for column, _ in columns ]
+        self.rows = 0
+        self.paths = [ os.path.join(output_dir, f'{name}.ndjson'), os.path.join(output_dir, f'{name}.{binary_format}') ]
+        self.ndjson = open(f'{self.paths[0]}.tmp', 'w', encoding='utf-8')
+        self.parquet = None
+        self.csv_file = None
+        if binary_format == 'parquet':
+            types = {'int': pyarrow.int64(), 'float': pyarrow.float64(), 'str': pyarrow.string(), 'bool': pyarrow.bool_()}
+            self.schema = pyarrow.schema([ (column, types[type]) for column, type in columns ])
+            self.parquet = pyarrow.parquet.ParquetWriter(f'{self.paths[1]}.tmp', self.schema, compression='zstd')
+        else:
+            self.csv_file = open(f'{self.paths[1]}.tmp', 'w', encoding='utf-8', newline='')
+            self.csv = csv.writer(self.csv_file)
+            self.csv.writerow(self.names)
+        self.clear()
+
+    def clear(self):
+        """Start a new batch"""
+        self.batch = [ array.array('q') if type == 'int' and column in REQUIRED_COLUMNS else []
+            for column, type in self.columns ]
+
+    def append(self, row: tuple):
+        self.ndjson.write(json.dumps(dict(zip(self.names, row))) + '\n')
+        for values, value in zip(self.batch, row):
+            values.append(value)
+        self.rows += 1
+        if len(self.batch[0]) >= BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if len(self.batch[0]) == 0:
+            return
+        if self.parquet is not None:
+            self.parquet.write_batch(pyarrow.record_batch(
+                [ pyarrow.array(values, type=field.type) for values, field in zip(self.batch, self.schema) ],
+                schema=self.schema))
+        else:
+            # Booleans are written as 1 and 0, nulls as empty fields
+            self.csv.writerows(
+                [ int(value) if isinstance(value, bool) else value for value in row ]
+                for row in zip(*self.batch))
+        self.clear()
+
+    def close(self):
+        """Finish the files, and move them to their final location"""
+        self.flush()
+        self.ndjson.close()
+        if self.parquet is not None:
+            self.parquet.close()
+        else:
+            self.csv_file.close()
+        for path in self.paths:
+            os.replace(f'{path}.tmp', path)
+
+def export(games: Iterable[dict], output_dir: str, format: str = 'auto') -> Dict[str, int]:
+    """Write the games and their sales as tables
+
+    Args:
+        games (Iterable[dict]): The serialized games (see ItchGame.serialize())
+        output_dir (str): The directory of the tables
+        format (str): The format of the tables besides NDJSON: parquet, csv, or auto
+            (parquet if pyarrow is installed, otherwise csv)
+
+    Returns:
+        Dict[str, int]: The number of rows in each table"""
+    if format not in FORMATS:
+        raise ValueError(f'Unknown format {format}, expected one of {", ".join(FORMATS)}')
+    if format == 'auto':
+        format = 'csv' if pyarrow is None else 'parquet'
+    if format == 'parquet' and pyarrow is None:
+        raise ValueError('pyarrow is required to export Parquet files')
+    os.makedirs(output_dir, exist_ok=True)
+
+    games_table = Table(output_dir, 'games', GAMES_COLUMNS, format)
+    sales_table = Table(output_dir, 'sales', SALES_COLUMNS, format)
+    for game in games:
+        sales = game['sales']
+        games_table.append((
+            game['id'],
+            game['name'],
+            game['url'],
+            game['price'],
+            game['claimable'],
+            game['cover_image'],
+            len(sales),
+            min((sale['start'] for sale in sales), default=None),
+            max((sale['end'] for sale in sales), default=None),
+        ))
+        for sale in sales:
+            sales_table.append((sale['id'], game['id'], sale['start'], sale['end']))
+    games_table.close()
+    sales_table.close()
+    return {'games': games_table.rows, 'sales': sales_table.rows}
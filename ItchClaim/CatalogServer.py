@@ -0,0 +1,367 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Serves the website and the API generated by generate_web from memory.
+
+Every game is loaded when the server starts. After that, the change feed of the games
+directory (changes.jsonl) is followed, so the games saved by a running refresh_sale_cache
+are reloaded one by one. Responses are cached until the catalog changes or a sale starts
+or ends, and are served with strong ETags, gzip compression and 304 responses."""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from . import ChangeFeed, DiskManager, web
+from .ItchGame import ItchGame
+from .ItchSale import is_active, is_upcoming
+
+# Reload the games found in the change feed for this many seconds,
+# as the files may be written later than the feed (see WriteBuffer)
+PENDING_SECONDS = 60
+# The number of responses cached (different query parameters are cached separately)
+MAX_CACHED_RESPONSES = 1000
+# Don't compress smaller responses
+MIN_GZIP_SIZE = 1024
+
+class ServedCatalog:
+    def __init__(self, games_dir: str):
+        self.games_dir = games_dir
+        self.lock = threading.Lock()
+        # Serialized games by ID
+        self.games: Dict[int, dict] = {}
+        # Incremented on every change
+        self.version = 0
+        self.feed_inode: Optional[int] = None
+        self.feed_offset = 0
+        # Deadline of reloading the games found in the change feed, by ID
+        self.pending: Dict[int, float] = {}
+        # Modification time of the game files, by ID
+        self.mtimes: Dict[int, int] = {}
+
+    def load(self):
+        """Load every game from the disk"""
+        # Every change saved before this point is already on the disk
+        self.poll_feed()
+        self.pending.clear()
+        for game in DiskManager.load_all_games():
+            if 'claimable' not in game.__dict__:
+                game.claimable = None
+            self.games[game.id] = game.serialize()
+
+    def poll(self) -> int:
+        """Reload the games that have changed since the last call
+
+        Returns:
+            int: The number of games changed"""
+        self.poll_feed()
+        now = time()
+        changed = 0
+        for game_id, deadline in list(self.pending.items()):
+            if self.reload_game(game_id):
+                changed += 1
+            if deadline < now:
+                del self.pending[game_id]
+        if changed > 0:
+            with self.lock:
+                self.version += 1
+        return changed
+
+    def poll_feed(self):
+        """Read the IDs added to the change feed since the last call"""
+        path = ChangeFeed.feed_path(self.games_dir)
+        try:
+            with open(path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if inode != self.feed_inode:
+                    # The feed has been started again by generate_web
+                    self.feed_inode = inode
+                    self.feed_offset = 0
+                f.seek(self.feed_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only process complete lines, the last one may still be written
+        data = data[:data.rfind(b'\n') + 1]
+        self.feed_offset += len(data)
+        deadline = time() + PENDING_SECONDS
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'id' in entry:
+                self.pending[entry['id']] = deadline
+
+    def reload_game(self, game_id: int) -> bool:
+        """Load the file of a game again if it has been modified. Returns True if the game has changed."""
+        path = os.path.join(self.games_dir, f'{game_id}.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if mtime == self.mtimes.get(game_id):
+                return False
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        self.mtimes[game_id] = mtime
+        with self.lock:
+            if self.games.get(game_id) == data:
+                return False
+            self.games[game_id] = data
+        return True
+
+    def select(self, list_name: str, query: Dict[str, str]) -> Tuple[List[dict], float]:
+        """Returns the games of a list, filtered by the query parameters, and the time until
+        the list is valid (when a sale starts or ends)
+
+        Args:
+            list_name (str): active, upcoming or all
+            query (Dict[str, str]): Query parameters
+                since: only games with a sale whose ID is greater than this
+                limit: the maximum number of games
+                claimable: true, false or unknown
+                name: only games whose name starts with this (case insensitive)"""
+        with self.lock:
+            games = list(self.games.values())
+        now = time()
+        expires = float('inf')
+        for game in games:
+            for sale in game['sales']:
+                for timestamp in (sale['start'], sale['end']):
+                    if now < timestamp < expires:
+                        expires = timestamp
+
+        if list_name == 'active':
+            games = [ game for game in games if is_active(game['sales'], now) ]
+        elif list_name == 'upcoming':
+            games = [ game for game in games if is_upcoming(game['sales'], now) ]
+        if 'since' in query:
+            since = int(query['since'])
+            games = [ game for game in games if any(sale['id'] > since for sale in game['sales']) ]
+        if 'claimable' in query:
+            claimable = {'true': True, 'false': False, 'unknown': None}[query['claimable'].lower()]
+            games = [ game for game in games if game['claimable'] is claimable ]
+        if 'name' in query:
+            prefix = query['name'].lower()
+            games = [ game for game in games if (game['name'] or '').lower().startswith(prefix) ]
+        games.sort(key=lambda game: (-game['sales'][-1]['id'], game['name']))
+        if 'limit' in query:
+            games = games[:int(query['limit'])]
+        return games, expires
+
+    def get(self, game_id: int) -> Optional[dict]:
+        with self.lock:
+            return self.games.get(game_id)
+
+class CachedResponse:
+    def __init__(self, body: bytes, content_type: str, version: int, expires: float):
+        self.body = body
+        self.content_type = content_type
+        self.version = version
+        self.expires = expires
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.gzip_body = gzip.compress(body, 6) if len(body) >= MIN_GZIP_SIZE else None
+        self.gzip_etag = '"' + hashlib.sha1(body).hexdigest() + '-gzip"'
+
+class CatalogServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, catalog: ServedCatalog):
+        super().__init__(address, CatalogRequestHandler)
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        self.responses: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+        # index.html and index-<n>.html, rendered at once
+        self.index_pages: List[CachedResponse] = []
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def cached_response(self, key: str, render: Callable[[], Tuple[bytes, str, float]]) -> CachedResponse:
+        """Returns the cached response, or renders it if the catalog has changed since then
+
+        Args:
+            key (str): The path and the query string of the request
+            render: Returns the body, the content type, and the time until the response is valid"""
+        version = self.catalog.version
+        with self.lock:
+            response = self.responses.get(key)
+            if response is not None:
+                self.responses.move_to_end(key)
+        if response is not None and response.version == version and response.expires > time():
+            return response
+        body, content_type, expires = render()
+        response = CachedResponse(body, content_type, version, expires)
+        with self.lock:
+            self.responses[key] = response
+            self.responses.move_to_end(key)
+            while len(self.responses) > MAX_CACHED_RESPONSES:
+                self.responses.popitem(last=False)
+        return response
+
+    def index_page(self, page: int) -> Optional[CachedResponse]:
+        """Returns a page of index.html, None if there's no such page"""
+        version = self.catalog.version
+        with self.lock:
+            pages = self.index_pages
+        if len(pages) == 0 or pages[0].version != version or pages[0].expires <= time():
+            active, expires = self.catalog.select('active', {})
+            upcoming, _ = self.catalog.select('upcoming', {})
+            html_pages = web.render_index_pages(
+                [ game_from_dict(game) for game in active ],
+                [ game_from_dict(game) for game in upcoming ],
+                web.read_resume_index(self.catalog.games_dir))
+            pages = [ CachedResponse(html.encode('utf-8'), 'text/html; charset=utf-8', version, expires)
+                for html in html_pages ]
+            with self.lock:
+                self.index_pages = pages
+        return pages[page - 1] if 1 <= page <= len(pages) else None
+
+class CatalogRequestHandler(BaseHTTPRequestHandler):
+    server: CatalogServer
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are sent separately, don't wait for the ACK of the headers
+    disable_nagle_algorithm = True
+
+    ROUTES = [
+        (re.compile(r'^/(?:index\.html)?$'), 'index'),
+        (re.compile(r'^/index-(\d+)\.html$'), 'index'),
+        (re.compile(r'^/api/(active|upcoming|all)\.json$'), 'list'),
+        (re.compile(r'^/data/(\d+)\.json$'), 'game'),
+    ]
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_HEAD(self):
+        self.dispatch(send_body=False)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet, the server is expected to receive a lot of requests
+        pass
+
+    def dispatch(self, send_body: bool = True):
+        self.send_body = send_body
+        url = urlsplit(self.path)
+        self.query = { key: values[0] for key, values in parse_qs(url.query).items() }
+        self.cache_key = f'{url.path}?{url.query}'
+        for pattern, handler in self.ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                try:
+                    return getattr(self, f'handle_{handler}')(*match.groups())
+                except (ValueError, KeyError):
+                    return self.respond_error(400, 'Bad Request')
+        self.respond_error(404, 'Not Found')
+
+    def respond(self, response: CachedResponse):
+        use_gzip = response.gzip_body is not None and 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = response.gzip_etag if use_gzip else response.etag
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            return
+        body = response.gzip_body if use_gzip else response.body
+        self.send_response(200)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.send_body:
+            self.wfile.write(body)
+
+    def respond_error(self, status: int, message: str):
+        body = message.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.send_body:
+            self.wfile.write(body)
+
+    def handle_index(self, page: str = '1'):
+        response = self.server.index_page(int(page))
+        if response is None:
+            return self.respond_error(404, 'Not Found')
+        self.respond(response)
+
+    def handle_list(self, list_name: str):
+        def render():
+            games, expires = self.server.catalog.select(list_name, self.query)
+            if list_name != 'all':
+                games = [ ItchGame.minimize(game) for game in games ]
+            return json.dumps(games).encode('utf-8'), 'application/json', expires
+        self.respond(self.server.cached_response(self.cache_key, render))
+
+    def handle_game(self, game_id: str):
+        game = self.server.catalog.get(int(game_id))
+        if game is None:
+            return self.respond_error(404, 'Not Found')
+        self.respond(self.server.cached_response(self.cache_key,
+            lambda: (json.dumps(game).encode('utf-8'), 'application/json', float('inf'))))
+
+def game_from_dict(data: dict) -> ItchGame:
+    game = ItchGame.from_dict(data)
+    # Prevent cached_property from calling remote API
+    game.claimable = data['claimable']
+    return game
+
+def serve(games_dir: str = 'web/data/', host: str = '127.0.0.1', port: int = 8000, reload_interval: float = 2):
+    """Load the catalog, and serve requests until interrupted.
+    See ItchClaim.serve() for the description of the arguments."""
+    ItchGame.games_dir = games_dir
+    catalog = ServedCatalog(games_dir)
+    catalog.load()
+    server = CatalogServer((host, port), catalog)
+
+    def reload():
+        while True:
+            sleep(reload_interval)
+            changed = catalog.poll()
+            if changed > 0:
+                print(f'Reloaded {changed} changed games')
+    threading.Thread(target=reload, daemon=True).start()
+
+    print(f'Serving {len(catalog.games)} games on {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
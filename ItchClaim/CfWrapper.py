@@ -22,6 +22,10 @@
 
 """FlareSolverr wrapper for requests."""
 
+import re
+import threading
+from time import monotonic, perf_counter, sleep
+from typing import Optional
 from urllib.parse import unquote
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
@@ -29,9 +33,36 @@ import requests
 
 from .flaresolverr import flaresolverr
 
-from . import __version__
+from . import __version__, Deadline, Metrics, Profiler, RetryPolicy
+from .Cassette import Cassette, request_key
 
 CF_ALWAYS_PROTECTED_URL = "https://itch.io/login"
+# The maximum number of requests sent at the same time
+MAX_CONCURRENT_REQUESTS = 8
+
+# Matches the scheme and host of itch.io URLs, capturing the subdomain (if any)
+ITCH_URL_RE = re.compile(r'^https?://(?:([\w-]+)\.)?itch\.io(?=[/?#]|$)')
+# Matches the path prefix used for subdomains when a base URL override is set
+BASE_SUBDOMAIN_RE = re.compile(r'^/~([\w-]+)(?=[/?#]|$)')
+
+# Endpoint classes used in metrics. The first matching pattern is used.
+ENDPOINT_CLASSES = [
+    ('sale', re.compile(r'^https?://itch\.io/s/\d+')),
+    ('sale_feed', re.compile(r'^https?://itch\.io/[\w-]+/newest/on-sale')),
+    ('library', re.compile(r'^https?://itch\.io/my-purchases')),
+    ('login', re.compile(r'^https?://itch\.io/(login|totp)')),
+    ('home', re.compile(r'^https?://itch\.io/?$')),
+    ('game_data', re.compile(r'^https?://[\w-]+\.itch\.io/[\w-]+/data\.json')),
+    ('download', re.compile(r'^https?://[\w-]+\.itch\.io/[\w-]+/(download|file/)')),
+    ('game_page', re.compile(r'^https?://[\w-]+\.itch\.io/')),
+]
+
+def endpoint_class(url: str) -> str:
+    """Categorize an itch.io URL for metrics"""
+    for name, pattern in ENDPOINT_CLASSES:
+        if pattern.match(url):
+            return name
+    return 'other'
 
 
 class CfWrapper:
@@ -42,6 +73,10 @@ class CfWrapper:
     _instance = None
     flaresolverr_initialized = False
     session: requests.Session
+    # Send requests to this server instead of itch.io (e.g. a local stand-in server)
+    base_url: Optional[str] = None
+    # Record or replay every request and response, see Cassette.py
+    cassette: Optional[Cassette] = None
 
     # Singleton pattern implementation
     # https://python-patterns.guide/gang-of-four/singleton/
@@ -57,13 +92,15 @@ class CfWrapper:
 
         self.session = requests.Session()
         self.max_timeout = 120
-
-        # Retry failed requests to handle transient network issues
-        retry_strategy = Retry(
-            total=5,
-            backoff_factor=2,
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        # Limits the number of requests sent at the same time by the worker threads
+        self.concurrency = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+        # Only one thread solves a Cloudflare challenge at a time, the others reuse its cookies
+        self.cf_lock = threading.Lock()
+        self.cf_generation = 0
+
+        # Failed requests are retried by _send_with_retries(), according to RetryPolicy
+        adapter = HTTPAdapter(max_retries=Retry(total=0, raise_on_status=False),
+                              pool_maxsize=MAX_CONCURRENT_REQUESTS)
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
 
@@ -74,15 +111,17 @@ class CfWrapper:
 
     def get(self, url, **kwargs):
         """Send a GET request, handling Cloudflare protection if detected."""
-        return self._request_with_cf_handling(self.session.get, url, **kwargs)
+        return self._request_with_cf_handling('GET', url, **kwargs)
 
     def post(self, url, **kwargs):
         """Send a POST request, handling Cloudflare protection if detected."""
-        return self._request_with_cf_handling(self.session.post, url, **kwargs)
+        return self._request_with_cf_handling('POST', url, **kwargs)
 
     def head(self, url, **kwargs):
         """Send a HEAD request, handling Cloudflare protection if detected."""
-        return self._request_with_cf_handling(self.session.head, url, **kwargs)
+        # Same default as requests.Session.head()
+        kwargs.setdefault('allow_redirects', False)
+        return self._request_with_cf_handling('HEAD', url, **kwargs)
 
     def _detect_cloudflare(self, response: requests.Response) -> bool:
         """Detect if Cloudflare protection is present in the response."""
@@ -91,22 +130,151 @@ class CfWrapper:
             and "<title>Just a moment...</title>" in response.text[:80]
         )
 
-    def _request_with_cf_handling(self, method, url, **kwargs):
-        """A higher-order function to handle Cloudflare protection for a given request method."""
+    def _request_with_cf_handling(self, method: str, url: str, **kwargs):
+        """Send a request with the given HTTP method, handling Cloudflare protection.
+        Records metrics about every request."""
+        endpoint = endpoint_class(url)
+        start = perf_counter()
+        try:
+            response = self._send(method, url, **kwargs)
+        except requests.exceptions.RequestException as ex:
+            Metrics.inc('http_requests_total', endpoint=endpoint, status=type(ex).__name__)
+            raise
+        Metrics.observe('http_request_duration_seconds', perf_counter() - start, endpoint=endpoint)
+        Metrics.inc('http_requests_total', endpoint=endpoint, status=str(response.status_code))
+        if response.status_code == 404:
+            Metrics.inc('http_not_found_total', endpoint=endpoint)
+        if kwargs.get('stream'):
+            size = int(response.headers.get('Content-Length', 0))
+        else:
+            size = len(response.content)
+        Metrics.inc('http_response_bytes_total', size, endpoint=endpoint)
+        return response
+
+    def _send(self, method: str, url: str, **kwargs):
+        """Send a request (or replay a recorded one), solving Cloudflare challenges if needed"""
+        if self.cassette is not None and self.cassette.mode == 'replay':
+            return self.cassette.replay(request_key(method, url, **kwargs), self.session)
+        itch_url = url
+        url = self._to_base_url(url)
+
         # Try sending the request normally first
-        response = method(url, **kwargs)
+        cf_generation = self.cf_generation
+        response = self._send_with_retries(method, url, itch_url, **kwargs)
 
         # If Cloudflare protection is detected, use FlareSolverr to bypass it
         if self._detect_cloudflare(response):
-            self._refresh_cf_cookies()
+            with Profiler.phase('flaresolverr'):
+                self._refresh_cf_cookies(cf_generation)
 
             # Retry the original request with the updated session
-            response = method(url, **kwargs)
+            response = self._send_with_retries(method, url, itch_url, **kwargs)
 
+        self._restore_itch_urls(response)
+        # Streamed responses (file downloads) are not recorded, because it would
+        # require reading the whole body into the memory
+        if self.cassette is not None and not kwargs.get('stream'):
+            self.cassette.record(request_key(method, itch_url, **kwargs), response)
         return response
 
-    def _refresh_cf_cookies(self):
-        """Refresh Cloudflare cookies in session using FlareSolverr."""
+    def _send_with_retries(self, method: str, url: str, itch_url: str, **kwargs):
+        """Send a request, retrying connection errors and 429/5xx responses until the deadline
+        of the request passes or the retry budget of the run runs out.
+        Raises CircuitOpenError without sending the request, if its hosts are failing."""
+        endpoint = endpoint_class(itch_url)
+        breaker = RetryPolicy.breaker_for(itch_url)
+        # Don't let the retries of a request run far past the deadline of the run
+        deadline = monotonic() + min(RetryPolicy.request_deadline,
+                                     max(Deadline.remaining(), RetryPolicy.min_request_deadline))
+        timeout = kwargs.pop('timeout', None)
+        attempt = 0
+        while True:
+            breaker.before_request()
+            remaining = max(deadline - monotonic(), 1)
+            # Don't wait for a response longer than the deadline allows, even if the caller
+            # hasn't set a timeout
+            if timeout is None:
+                attempt_timeout = remaining
+            elif isinstance(timeout, tuple):
+                attempt_timeout = tuple(remaining if t is None else min(t, remaining) for t in timeout)
+            else:
+                attempt_timeout = min(timeout, remaining)
+            response, error = None, None
+            try:
+                with Profiler.phase('network'), self.concurrency:
+                    response = self.session.request(method, url, timeout=attempt_timeout, **kwargs)
+            except requests.exceptions.RequestException as ex:
+                error = ex
+            failed = error is not None or response.status_code in RetryPolicy.RETRY_STATUSES
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if not RetryPolicy.is_retryable(method, response, error):
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            delay = RetryPolicy.backoff(attempt, response)
+            if (attempt > RetryPolicy.max_retries
+                    or monotonic() + delay >= deadline
+                    or not RetryPolicy.budget.take()):
+                if error is not None:
+                    raise error
+                return response
+            Metrics.inc('http_retries_total', endpoint=endpoint)
+            if response is not None:
+                # Return the connection of a streamed response to the pool
+                response.close()
+            sleep(delay)
+
+    def _to_base_url(self, url: str) -> str:
+        """Rewrite an itch.io URL to point to the base URL override, if one is set.
+        Subdomains are mapped to a path prefix, e.g. https://dev.itch.io/game
+        becomes <base_url>/~dev/game"""
+        if self.base_url is None:
+            return url
+        match = ITCH_URL_RE.match(url)
+        if match is None:
+            return url
+        prefix = self.base_url
+        if match.group(1) is not None:
+            prefix += f'/~{match.group(1)}'
+        return prefix + url[match.end():]
+
+    def _from_base_url(self, url: str) -> str:
+        """Inverse of _to_base_url()"""
+        if self.base_url is None or not url.startswith(self.base_url):
+            return url
+        path = url[len(self.base_url):]
+        match = BASE_SUBDOMAIN_RE.match(path)
+        if match is None:
+            return 'https://itch.io' + path
+        return f'https://{match.group(1)}.itch.io' + path[match.end():]
+
+    def _restore_itch_urls(self, response: requests.Response):
+        """Make responses received from the base URL override look like they were sent by
+        itch.io, so URL comparisons and redirect parsing work the same way"""
+        if self.base_url is None:
+            return
+        for r in [*response.history, response]:
+            r.url = self._from_base_url(r.url)
+            if 'Location' in r.headers:
+                r.headers['Location'] = self._from_base_url(r.headers['Location'])
+
+    def _refresh_cf_cookies(self, cf_generation: int = None):
+        """Refresh Cloudflare cookies in session using FlareSolverr.
+
+        Args:
+            cf_generation (int): The value of cf_generation when the request was sent.
+                If the cookies have been refreshed since then by another thread, they are reused."""
+        with self.cf_lock:
+            if cf_generation is not None and cf_generation != self.cf_generation:
+                return
+            self._solve_cf_challenge()
+            self.cf_generation += 1
+
+    def _solve_cf_challenge(self):
         print(
             "Cloudflare protection detected. "
             + "Resolving challenge using FlareSolverr. "
@@ -116,12 +284,13 @@ class CfWrapper:
             "If you encounter issues with FlareSolverr, "
             + "please try launching ItchClaim with '--flaresolverr-log-level DEBUG'.")
 
+        start = perf_counter()
         if not self.flaresolverr_initialized:
             flaresolverr.init()
             self.flaresolverr_initialized = True
 
         cf_challange_data = flaresolverr.V1RequestBase(
-            {"url": CF_ALWAYS_PROTECTED_URL, "maxTimeout": self.max_timeout * 1000}
+            {"url": self._to_base_url(CF_ALWAYS_PROTECTED_URL), "maxTimeout": self.max_timeout * 1000}
         )
         cf_challange = flaresolverr.resolve_challenge(cf_challange_data, "GET")
 
@@ -136,6 +305,8 @@ class CfWrapper:
                 )
                 break
 
+        Metrics.inc('cloudflare_challenges_total')
+        Metrics.observe('cloudflare_solve_duration_seconds', perf_counter() - start)
         print("Cloudflare challenge resolved.")
 
     @property
@@ -0,0 +1,148 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Feed of the games changed since the website was last generated.
+
+save_to_disk() records a line for every game whose saved content has changed. The lines
+are appended to changes.jsonl in the games directory by WriteBuffer.flush(), right before
+it writes the game files. The first line of the feed is a header. If the feed has been
+started by generate_web (the header has a `since` field), it contains every change since
+that run, so later stages only need to process the changed games instead of the whole
+catalog. The `base` field of the header is the hash of the all.json generated by that run."""
+
+import hashlib
+import json
+import os
+import threading
+from time import time
+from typing import Dict, List, Optional, Set, Tuple
+
+FEED_FILENAME = 'changes.jsonl'
+
+# Kinds of changes
+ADDED = 'added'
+NEW_SALE = 'new_sale'
+CLAIMABILITY = 'claimability'
+UPDATED = 'updated'
+# Written by generate_web for games that should be rechecked in the next run
+UNKNOWN_CLAIMABILITY = 'unknown_claimability'
+
+_lock = threading.Lock()
+_run_started = int(time())
+# Lines waiting to be appended to the feed, by games directory
+_pending: Dict[str, List[str]] = {}
+
+def feed_path(games_dir: str) -> str:
+    return os.path.join(games_dir, FEED_FILENAME)
+
+def classify(previous: Optional[dict], current: dict) -> List[str]:
+    """Compare two serialized versions of a game
+
+    Args:
+        previous (dict): The content saved before, None if the game is new
+        current (dict): The new content
+
+    Returns:
+        List[str]: The kinds of changes"""
+    if previous is None:
+        return [ADDED]
+    changes = []
+    previous_sales = { sale['id'] for sale in previous['sales'] }
+    if any(sale['id'] not in previous_sales for sale in current['sales']):
+        changes.append(NEW_SALE)
+    if previous.get('claimable') != current.get('claimable'):
+        changes.append(CLAIMABILITY)
+    if len(changes) == 0:
+        changes.append(UPDATED)
+    return changes
+
+def record(games_dir: str, game_id: int, changes: List[str]):
+    """Add a change to the feed. It's written to the disk by the next flush()."""
+    line = json.dumps({'id': game_id, 'run': _run_started, 'changes': changes}) + '\n'
+    with _lock:
+        _pending.setdefault(games_dir, []).append(line)
+
+def flush():
+    """Append the recorded changes to the feeds. A feed is created if it doesn't exist yet,
+    but it won't be considered complete until generate_web resets it."""
+    with _lock:
+        for games_dir, lines in _pending.items():
+            path = feed_path(games_dir)
+            header = None if os.path.exists(path) else json.dumps({'since': None}) + '\n'
+            with open(path, 'a', encoding='utf-8') as f:
+                if header is not None:
+                    f.write(header)
+                f.writelines(lines)
+        _pending.clear()
+
+def read(games_dir: str) -> Tuple[Optional[dict], List[dict]]:
+    """Returns the header and the entries of the feed. The header is None if there's no feed."""
+    flush()
+    try:
+        with open(feed_path(games_dir), 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None, []
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # The last line may be incomplete, if the process was killed while writing it
+            continue
+    if len(entries) == 0 or 'id' in entries[0]:
+        return None, entries
+    return entries[0], entries[1:]
+
+def changed_ids(games_dir: str) -> Optional[Set[int]]:
+    """Returns the IDs of the games changed since the last generate_web run.
+    Returns None if the feed doesn't contain every change."""
+    header, entries = read(games_dir)
+    if header is None or header.get('since') is None:
+        return None
+    return { entry['id'] for entry in entries }
+
+def file_hash(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def reset(games_dir: str, all_json_path: str, pending_ids: List[int]):
+    """Start a new feed after the website has been generated
+
+    Args:
+        games_dir (str): The games directory
+        all_json_path (str): The path of the generated all.json
+        pending_ids (List[int]): Games to be processed again by the next run"""
+    header = {'since': int(time()), 'base': file_hash(all_json_path)}
+    lines = [ json.dumps(header) + '\n' ]
+    for game_id in pending_ids:
+        lines.append(json.dumps({'id': game_id, 'run': _run_started, 'changes': [UNKNOWN_CLAIMABILITY]}) + '\n')
+    path = feed_path(games_dir)
+    with _lock:
+        # Changes recorded since the games have been loaded aren't on the website yet
+        lines.extend(_pending.pop(games_dir, []))
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(f'{path}.tmp', path)
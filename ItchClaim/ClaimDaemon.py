@@ -0,0 +1,173 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Claims games as soon as their sales start.
+
+The active and upcoming sales are downloaded from the remote cache, and the start of each
+sale is put on a timeline. The daemon sleeps until the next sale starts or the lists have
+to be downloaded again, so no requests are sent between these events."""
+
+import heapq
+import random
+from datetime import datetime
+from time import sleep, time
+from typing import Dict, List, Set, Tuple
+
+from requests.exceptions import RequestException
+
+from . import DiskManager, SingleFlight
+from .ItchGame import ItchGame
+from .ItchSale import ItchSale
+from .ItchUser import ItchUser
+
+# Wake up at least this often, so the timeline is followed after the computer has been suspended
+MAX_SLEEP = 3600
+# Retry failed downloads and claims after this many seconds
+RETRY_DELAY = 300
+
+
+class ClaimDaemon:
+    def __init__(self,
+                user: ItchUser,
+                active_url: str,
+                upcoming_url: str,
+                refresh_interval: float = 3600,
+                jitter: float = 30):
+        """
+        Args:
+            user (ItchUser): The logged in user, who claims the games
+            active_url (str): The URL of the list of active sales
+            upcoming_url (str): The URL of the list of upcoming sales
+            refresh_interval (float): Download the lists again after this many seconds
+            jitter (float): Wait a random number of seconds (up to this value) after a sale
+                starts, so not every user sends requests at the same time"""
+        self.user = user
+        self.active_url = active_url
+        self.upcoming_url = upcoming_url
+        self.refresh_interval = refresh_interval
+        self.jitter = jitter
+        self.games: Dict[int, ItchGame] = {}
+        # Heap of (wake up time, game ID, sale ID)
+        self.timeline: List[Tuple[float, int, int]] = []
+        # (game ID, sale ID) pairs on the timeline
+        self.scheduled: Set[Tuple[int, int]] = set()
+        # ETag and Last-Modified headers of the lists, by URL
+        self.validators: Dict[str, dict] = {}
+        self.next_refresh: float = 0
+
+    def run(self):
+        """Claim games forever"""
+        while True:
+            if time() >= self.next_refresh:
+                self.refresh()
+            self.claim_started_sales()
+            self.sleep_until_next_event()
+
+    def refresh(self):
+        """Download the lists of sales if they have changed, and add the new sales to the timeline"""
+        # Don't reuse data downloaded by the previous refresh
+        SingleFlight.clear_all()
+        games: List[ItchGame] = []
+        # Only saved after every list has been scheduled, otherwise a list downloaded before
+        # a failure would be unchanged on the next refresh, and its sales would never be scheduled
+        validators_by_url: Dict[str, dict] = {}
+        for url in (self.active_url, self.upcoming_url):
+            try:
+                games_raw, validators = DiskManager.download_remote_list(url, self.validators.get(url))
+            except (RequestException, ValueError) as e:
+                print(f'Failed to download the list of sales: {e}')
+                self.next_refresh = time() + min(RETRY_DELAY, self.refresh_interval)
+                return
+            # The sales of an unchanged list are already on the timeline
+            if games_raw is not None:
+                games += DiskManager.games_from_remote_list(games_raw)
+                validators_by_url[url] = validators
+
+        now = time()
+        for game in games:
+            self.games[game.id] = game
+            for sale in game.sales:
+                key = (game.id, sale.id)
+                end = sale.end.timestamp()
+                if end <= now or key in self.scheduled or self.user.is_handled(game.id, sale.id):
+                    continue
+                start = sale.start.timestamp()
+                wake_time = now if start <= now else start + random.uniform(0, self.jitter)
+                heapq.heappush(self.timeline, (wake_time, game.id, sale.id))
+                self.scheduled.add(key)
+        self.validators.update(validators_by_url)
+
+        # Forget the games without sales on the timeline
+        scheduled_games = { game_id for game_id, _ in self.scheduled }
+        self.games = { id: game for id, game in self.games.items() if id in scheduled_games }
+        self.next_refresh = time() + self.refresh_interval
+        if len(games) > 0:
+            print(f'Downloaded {len(games)} games, {len(self.timeline)} sales on the timeline')
+
+    def claim_started_sales(self):
+        """Claim the games of every sale that has started"""
+        while len(self.timeline) > 0 and self.timeline[0][0] <= time():
+            _, game_id, sale_id = heapq.heappop(self.timeline)
+            key = (game_id, sale_id)
+            self.scheduled.discard(key)
+            game = self.games[game_id]
+            sale: ItchSale = next((sale for sale in game.sales if sale.id == sale_id), None)
+            # The sale may have been removed from the list since it was put on the timeline
+            if sale is None or sale.end.timestamp() <= time():
+                continue
+            try:
+                handled = self.claim(game)
+            except RequestException as e:
+                print(f'Failed to claim {game.name} ({game.id}): {e}')
+                handled = False
+            if not handled:
+                # Try again later
+                heapq.heappush(self.timeline, (time() + RETRY_DELAY, game_id, sale_id))
+                self.scheduled.add(key)
+                continue
+            self.user.mark_handled(game_id, sale)
+            self.user.save_session()
+
+    def claim(self, game: ItchGame) -> bool:
+        """Returns False if the game should be claimed again later"""
+        if self.user.owns_game(game):
+            return True
+        # These were calculated before the sale started
+        game.__dict__.pop('active_sale', None)
+        if game.__dict__.get('claimable', None) is None:
+            game.__dict__.pop('claimable', None)
+        if not game.claimable:
+            print(f'Game {game.name} is not claimable (url: {game.url})')
+            return True
+        handled = self.user.claim_game(game)
+        self.user.save_session()
+        return handled
+
+    def sleep_until_next_event(self):
+        wake_time = self.next_refresh
+        if len(self.timeline) > 0 and self.timeline[0][0] < wake_time:
+            wake_time, game_id, _ = self.timeline[0]
+            print(f'Next sale starts at {datetime.fromtimestamp(wake_time):%Y-%m-%d %H:%M:%S} '
+                  f'({self.games[game_id].name})')
+        delay = wake_time - time()
+        if delay > 0:
+            sleep(min(delay, MAX_SLEEP))
@@ -0,0 +1,52 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Wall-clock time budget of the run (--deadline).
+
+Long running loops check expired() before starting a new unit of work, and leave the rest
+of the work to the next run. The most valuable work is done first, so the work that is
+left over is the least important."""
+
+from time import monotonic
+from typing import Optional
+
+from . import Metrics
+
+_deadline: Optional[float] = None
+
+def start(seconds: float):
+    """Start the time budget of the run"""
+    global _deadline
+    _deadline = monotonic() + seconds
+
+def remaining() -> float:
+    """Seconds left from the time budget, infinite if there's no deadline"""
+    if _deadline is None:
+        return float('inf')
+    return _deadline - monotonic()
+
+def expired() -> bool:
+    return remaining() <= 0
+
+def shed(work: str, count: int = 1):
+    """Record work left to the next run because of the deadline"""
+    Metrics.inc('work_shed_total', count, work=work)
@@ -20,19 +20,29 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from time import sleep, time
 import os
 import json
 from bs4 import BeautifulSoup
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, RequestException
 from .flaresolverr.flaresolverr import FlaresolverrException
 from .ItchGame import ItchGame
 from .ItchSale import ItchSale
 from .CfWrapper import CfWrapper
-from . import __version__
+from .SaleJournal import SaleJournal, COMPLETED, NOT_FOUND, FAILED
+from . import __version__, ChangeFeed, Deadline, MemoryReport, Metrics, Profiler, RemoteCatalog, RetryPolicy, SaleIndex, Snapshot, WriteBuffer
+from .RetryPolicy import CircuitOpenError
 
 requests = CfWrapper()
 
+# Wait for the circuit breakers after this many consecutive deferred sale pages
+MAX_DEFERRED_PAGES = 10
+
+SALE_CATEGORIES = ['games', 'tools', 'game-assets', 'comics', 'books', 'physical-games',
+                   'soundtracks', 'game-mods', 'misc']
+
 def get_all_sales(
         start: int,
         max_pages: int = -1,
@@ -45,52 +55,85 @@ def get_all_sales(
         start (int): the ID of the first sale to download
         max_pages (int): the maximum number of pages to download. Set to -1 to download all pages.
         no_fail (bool): set to True to continue execution even if a connection error occurs
-        max_not_found_pages (int): the maximum number of consecutive pages that return 404 before
-            stopping the execution
+        max_not_found_pages (int): the maximum number of consecutive sale IDs that return 404
+            between two existing sales
     """
 
     if max_pages == -1:
         max_pages = 10e7
 
-    page = start - 1
-    games_num = 0
-    page_not_found_num = 0
-    while page < start + max_pages:
-        page += 1
-        try:
-            games_added = get_one_sale(page, force=False)
-            # If games_added is -1 it means that the sale page returned 404
-            if games_added == -1:
-                # Sometimes there are sales even after multiple 404 pages
-                page_not_found_num += 1
-                if page_not_found_num > max_not_found_pages:
+    # Don't download the last sale again, if the sales after it were checked by the previous run
+    frontier = load_sale_frontier()
+    if frontier['last_sale'] == start:
+        start += 1
+
+    journal = SaleJournal(ItchGame.games_dir)
+    try:
+        games_num = 0
+        page = start - 1
+        # Sale pages downloaded while searching for the last sale
+        probed: Dict[int, ItchSale] = {}
+        # The ID of the last existing sale, found by find_last_sale()
+        last_sale: Optional[int] = None
+        last_page_found = start - 1
+        # The number of consecutive sale pages deferred by a circuit breaker
+        deferred_pages = 0
+        while page < start + max_pages:
+            if Deadline.expired():
+                print(f'Deadline reached. Sale pages after {page} are left to the next run')
+                Deadline.shed('sale_page')
+                break
+            page += 1
+            if last_sale is not None and page > last_sale:
+                # The search may have skipped sales in a gap, so every ID of the window
+                # after the last sale is checked before stopping
+                last_sale = find_last_sale(page, max_not_found_pages, probed, frontier['attempts'])
+                if last_sale is None:
                     print('No more sales available at the moment.')
+                    save_sale_frontier(last_page_found, frontier)
                     break
-                else:
+                print(f'Found more sales after sale page {page}. The last sale is {last_sale}')
+                continue
+            if journal.is_completed(page):
+                print(f'Sale page #{page}: already processed according to the journal')
+                last_page_found = page
+                continue
+
+            games_added = download_sale_page(page, journal, no_fail, sale=probed.pop(page, None))
+            deferred_pages = deferred_pages + 1 if games_added == -2 else 0
+            if deferred_pages >= MAX_DEFERRED_PAGES:
+                # Every page seems to depend on the failing hosts, deferring more is pointless
+                wait = max(breaker.wait_time() for breaker in RetryPolicy.breakers.values())
+                print(f'{deferred_pages} sale pages have been deferred in a row. Waiting {wait:.0f} seconds')
+                sleep(max(min(wait, Deadline.remaining()), 0))
+                deferred_pages = 0
+            # If games_added is -1 it means that the sale page returned 404
+            if games_added == -1:
+                if last_sale is not None:
+                    # Sometimes there are sales even after multiple 404 pages
                     print(f'Sale page {page} returned 404 without URL redirection. '
-                        + 'Seems like the end of the sales list. '
-                        + f'({page_not_found_num}/{max_not_found_pages})'
-                    )
+                        + f'Skipping, because sales exist until {last_sale}')
                     continue
-            else:
-                page_not_found_num = 0
+                print(f'Sale page {page} returned 404 without URL redirection. '
+                    + 'Seems like the end of the sales list. Searching for the last sale.')
+                last_sale = find_last_sale(page, max_not_found_pages, probed, frontier['attempts'])
+                if last_sale is None:
+                    print('No more sales available at the moment.')
+                    save_sale_frontier(last_page_found, frontier)
+                    break
+                print(f'Found more sales after sale page {page}. The last sale is {last_sale}')
+                continue
+
+            last_page_found = page
+            if games_added is not None and games_added > 0:
                 games_num += games_added
-        except (ConnectionError) as ex:
-            print(f'A connection error has occurred while parsing sale page {page}. Reason: {ex}')
-            if not no_fail:
-                print('Aborting current sale refresh.')
-                exit(1)
-        except (FlaresolverrException) as ex:
-            print(f'A FlareSolverr error has occurred while parsing sale page {page}. Reason: {ex}')
-            if not no_fail:
-                print('Aborting current sale refresh.')
-                exit(1)
-        #pylint: disable=broad-exception-caught
-        except Exception as ex:
-            print(f'Failed to parse sale page {page}. Reason: {ex}')
+            MemoryReport.tick(f'after sale page {page}')
 
-        with open(os.path.join(ItchGame.games_dir, 'resume_index.txt'), 'w', encoding='utf-8') as f:
-            f.write(str(page - page_not_found_num))
+        # Pages that have failed in this or in previous runs (including the ones deferred by the
+        # circuit breakers). New sales are downloaded first, because they are more valuable.
+        games_num += retry_failed_sales(journal, no_fail)
+    finally:
+        journal.close()
 
     if page >= start + max_pages:
         print(f'Execution stopped because the maximum number of {max_pages} pages was reached')
@@ -100,28 +143,177 @@ def get_all_sales(
     else:
         print(f'Execution finished. Added a total of {games_num} games')
 
-def get_one_sale(page: int, force: bool = True) -> int:
+def download_sale_page(page: int, journal: SaleJournal, no_fail: bool, force: bool = False,
+        sale: ItchSale = None) -> Optional[int]:
+    """Download a sale page with get_one_sale(), and record the result in the journal
+
+    Returns:
+        Optional[int]: The number of games saved, -1 if the sale doesn't exist,
+            -2 if it has been deferred because its hosts are failing,
+            or None if an error has occurred
+    """
+    try:
+        games_added = get_one_sale(page, force=force, sale=sale)
+        journal.record(page, NOT_FOUND if games_added == -1 else COMPLETED)
+        return games_added
+    except CircuitOpenError as ex:
+        # Retried at the end of the run, or by the next run
+        journal.record(page, FAILED)
+        Metrics.inc('sale_pages_deferred_total')
+        print(f'Sale page {page} deferred. Reason: {ex}')
+        return -2
+    except (ConnectionError) as ex:
+        journal.record(page, FAILED)
+        Metrics.inc('sale_pages_total', result='error')
+        print(f'A connection error has occurred while parsing sale page {page}. Reason: {ex}')
+        if not no_fail:
+            print('Aborting current sale refresh.')
+            exit(1)
+    except (FlaresolverrException) as ex:
+        journal.record(page, FAILED)
+        Metrics.inc('sale_pages_total', result='error')
+        print(f'A FlareSolverr error has occurred while parsing sale page {page}. Reason: {ex}')
+        if not no_fail:
+            print('Aborting current sale refresh.')
+            exit(1)
+    #pylint: disable=broad-exception-caught
+    except Exception as ex:
+        journal.record(page, FAILED)
+        Metrics.inc('sale_pages_total', result='error')
+        print(f'Failed to parse sale page {page}. Reason: {ex}')
+    return None
+
+def retry_failed_sales(journal: SaleJournal, no_fail: bool) -> int:
+    """Download the sale pages again that have failed in this or in previous runs
+
+    Returns:
+        int: The number of games saved
+    """
+    failed = journal.failed
+    if len(failed) == 0:
+        return 0
+    print(f'Retrying {len(failed)} sale pages that have failed previously')
+    games_num = 0
+    for i, sale_id in enumerate(failed):
+        if Deadline.expired():
+            print(f'Deadline reached. {len(failed) - i} failed sale pages are left to the next run')
+            Deadline.shed('failed_sale_page', len(failed) - i)
+            break
+        games_added = download_sale_page(sale_id, journal, no_fail, force=True)
+        if games_added is not None and games_added > 0:
+            games_num += games_added
+    return games_num
+
+def find_last_sale(
+        first_missing: int,
+        max_not_found_pages: int,
+        probed: Dict[int, ItchSale],
+        attempt: int = 0,
+    ) -> Optional[int]:
+    """Find the ID of the last sale after a sale page returned 404 without URL redirection.
+    Every ID of the first max_not_found_pages after first_missing is probed, so no sales
+    are missed there. If one of them exists, one sale ID is probed from each of the intervals
+    [1, 2), [2, 4), [4, 8)... after that window, until an ID returns 404 further than
+    max_not_found_pages from the last existing sale. The last sale is then found with a binary
+    search between the last existing and the first missing probe. This takes O(log n) requests
+    after the window, instead of downloading each page of the tail.
+
+    Sales hidden in a gap past the window may be skipped by the search, so get_all_sales()
+    calls this again after the last sale, until a whole window is empty. A different ID is
+    probed from each interval on every attempt.
+
+    Args:
+        first_missing (int): the ID of the sale page that returned 404
+        max_not_found_pages (int): the maximum number of consecutive missing IDs between two sales
+        probed (Dict[int, ItchSale]): the downloaded sale pages are saved here, so they don't
+            have to be downloaded again
+        attempt (int): the number of previous runs that have stopped at the same sale
+
+    Returns:
+        Optional[int]: the ID of the last sale, or None if no sales were found after first_missing
+    """
+    def exists(sale_id: int) -> bool:
+        if sale_id not in probed:
+            probed[sale_id] = ItchSale(sale_id)
+        try:
+            return probed[sale_id].err != 'NO_MORE_SALES_AVAILABLE'
+        #pylint: disable=broad-exception-caught
+        except Exception:
+            # Assume that the sale exists, so it will be downloaded (and retried) by get_all_sales()
+            del probed[sale_id]
+            return True
+
+    last_found = None
+    window_end = first_missing + max_not_found_pages
+    for sale_id in range(first_missing + 1, window_end + 1):
+        if exists(sale_id):
+            last_found = sale_id
+    if last_found is None:
+        return None
+
+    interval = 1
+    while True:
+        sale_id = window_end + interval + attempt % interval
+        if exists(sale_id):
+            last_found = sale_id
+        elif sale_id - last_found > max_not_found_pages:
+            break
+        interval *= 2
+
+    low, high = last_found, sale_id
+    while high - low > 1:
+        middle = (low + high) // 2
+        if exists(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+def load_sale_frontier() -> dict:
+    """Load the ID of the last sale found by the previous run, after which no more sales
+    were available, and the number of runs that have stopped at the same sale"""
+    try:
+        with open(os.path.join(ItchGame.games_dir, 'sale_frontier.json'), 'r', encoding='utf-8') as f:
+            frontier = json.load(f)
+        return {'last_sale': frontier['last_sale'], 'attempts': frontier.get('attempts', 0)}
+    except (FileNotFoundError, KeyError, ValueError):
+        return {'last_sale': None, 'attempts': 0}
+
+def save_sale_frontier(last_sale: int, previous: dict):
+    """Remember that no more sales are available after last_sale at the moment"""
+    attempts = previous['attempts'] + 1 if previous['last_sale'] == last_sale else 0
+    with open(os.path.join(ItchGame.games_dir, 'sale_frontier.json'), 'w', encoding='utf-8') as f:
+        json.dump({'last_sale': last_sale, 'attempts': attempts, 'checked': int(time())}, f)
+
+def get_one_sale(page: int, force: bool = True, sale: ItchSale = None) -> int:
     """"Downloads one sale page, and saves the results to the disk
 
     Args:
         page (int): the sale_id  to be downloaded
         force (bool): set to True if method is not called from refresh_sale_cache.
             Makes sure that the sales array in the game is sorted and doesn't contain duplicate elements.
+        sale (ItchSale): the sale page, if it has already been downloaded
 
     Returns:
         int: The number of games saved
     """
     games_num = 0
-    current_sale = ItchSale(page)
+    current_sale = sale if sale is not None else ItchSale(page)
+    if not current_sale.err and not hasattr(current_sale, 'soup'):
+        # The dates of the sale have been reused from an earlier download of this run
+        current_sale.get_data_online()
     if current_sale.err == 'NO_MORE_SALES_AVAILABLE' and current_sale.id > 90000:
         # Return -1 if it seems like we have reached the last sale
+        Metrics.inc('sale_pages_total', result='not_found')
         return -1
     elif current_sale.err:
+        Metrics.inc('sale_pages_total', result='deleted')
         return 0
 
     games_raw = current_sale.soup.find_all('div', class_="game_cell")
 
     if len(games_raw) == 0:
+        Metrics.inc('sale_pages_total', result='empty')
         print(f'Sale page #{page}: empty page')
         return 0
 
@@ -129,6 +321,7 @@ def get_one_sale(page: int, force: bool = True) -> int:
         game: ItchGame = ItchGame.from_div(div, price_needed=True)
 
         if game.price != 0:
+            Metrics.inc('sale_pages_total', result='not_free')
             print(f'Sale page #{page}: games are not discounted by 100%')
             break
 
@@ -137,7 +330,7 @@ def get_one_sale(page: int, force: bool = True) -> int:
             game.claimable = None
 
         # load previously saved sales
-        if os.path.exists(game.get_default_game_filename()):
+        if game.is_saved():
             disk_game: ItchGame = ItchGame.load_from_disk(game.get_default_game_filename(), refresh_claimable=True)
             game.sales = disk_game.sales
             if game.sales[-1].id == page and not force:
@@ -161,21 +354,39 @@ def get_one_sale(page: int, force: bool = True) -> int:
         games_num += 1
         game.save_to_disk()
 
+    # Break the reference cycles of the parsed page, so it's freed right away
+    # instead of waiting for the garbage collector
+    current_sale.soup.decompose()
+    del current_sale.soup
+
     if game.price == 0:
+        Metrics.inc('sale_pages_total', result='saved')
         expired_str = '(inactive)' if not current_sale.is_active else ''
         print(f'Sale page #{page}: added {len(games_raw)} games', expired_str)
     return games_num
 
-def get_all_sale_pages(category: str = 'games', no_fail: bool =False) -> List[ItchGame]:
+def get_all_sale_pages(category: str = 'games', no_fail: bool = False, max_idle_pages: int = -1) -> int:
     """Gets all the pages of the sales feed from itch.io, and saves the missing games
 
     Args:
         category (str): the category of the items
             Possible values: games, tools, game-assets, comics, books, physical-games,
-            soundtracks, game-mods, misc"""
+            soundtracks, game-mods, misc
+        no_fail (bool): Continue even if a page fails to load
+        max_idle_pages (int): Stop after this many consecutive pages without new or updated
+            games. The feed is sorted by date, so the rest of it is already known.
+            Default is -1, which means every page is downloaded
+
+    Returns:
+        int: The number of games added or updated"""
     page = 0
     games_num = 0
+    idle_pages = 0
     while True:
+        if Deadline.expired():
+            print(f'Deadline reached. The rest of the {category} list is left to the next run')
+            Deadline.shed('sale_feed')
+            break
         page += 1
         try:
             games_added = get_online_sale_page(page, category=category)
@@ -183,6 +394,14 @@ def get_all_sale_pages(category: str = 'games', no_fail: bool =False) -> List[It
                 break
             else:
                 games_num += games_added
+            idle_pages = idle_pages + 1 if games_added == 0 else 0
+            if max_idle_pages != -1 and idle_pages >= max_idle_pages:
+                print(f'No new {category} found on the last {idle_pages} pages, skipping the rest of the list.')
+                break
+        except CircuitOpenError as ex:
+            # The rest of the list is processed by the next run
+            print(f'Stopped collecting sales from category {category} at page {page}. Reason: {ex}')
+            break
         except ConnectionError as ex:
             print(f'A connection error has occurred while parsing {category} sale page {page}. Reason: {ex}')
             if not no_fail:
@@ -199,6 +418,22 @@ def get_all_sale_pages(category: str = 'games', no_fail: bool =False) -> List[It
 
     print(f'Collecting sales from category {category} finished.',
           f'Added a total of {games_num} {category}')
+    return games_num
+
+def get_all_categories_sale_pages(no_fail: bool = False, max_idle_pages: int = -1):
+    """Run get_all_sale_pages() for every category concurrently
+
+    Args:
+        no_fail (bool): Continue even if a page fails to load
+        max_idle_pages (int): See get_all_sale_pages()"""
+    with ThreadPoolExecutor(max_workers=len(SALE_CATEGORIES)) as executor:
+        futures = []
+        for category in SALE_CATEGORIES:
+            print(f'Collecting sales from {category} list')
+            futures.append(executor.submit(get_all_sale_pages, category, no_fail, max_idle_pages))
+        # Raises the first exception (including exit() calls) of the workers
+        for future in as_completed(futures):
+            future.result()
 
 def get_online_sale_page(page: int, category: str = 'games') -> int:
     """Get a page of the sales feed from itch.io, and save the missing ones to the disk.
@@ -216,23 +451,26 @@ def get_online_sale_page(page: int, category: str = 'games') -> int:
     print(f'Processing {category} sale page #{page}')
     r = requests.get(f"https://itch.io/{category}/newest/on-sale?page={page}&format=json",
                     timeout=32,)
+    Metrics.inc('sale_feed_pages_total', category=category)
     if r.status_code == 404:
         print('Page returned 404.')
         return -1
-    html = json.loads(r.text)['content']
-    soup = BeautifulSoup(html, 'html.parser')
+    with Profiler.phase('json'):
+        html = json.loads(r.text)['content']
+    with Profiler.phase('html_parse'):
+        soup = BeautifulSoup(html, 'html.parser')
     games_raw = soup.find_all('div', class_="game_cell")
     games = []
     games_added = 0
+    # (game loaded from the disk or None if it's new, game returned by the API)
+    updates: List[Tuple[Optional[ItchGame], ItchGame]] = []
     for div in games_raw:
         game = ItchGame.from_div(div, price_needed=True)
         if game.price == 0:
             # Save game if it's new to us
-            if not os.path.exists(game.get_default_game_filename()):
+            if not game.is_saved():
                 # Call API to get active sale
-                ItchGame.from_api(game.url).save_to_disk()
-                print(f'Saved new {category} {game.name} ({game.url})')
-                games_added += 1
+                updates.append((None, ItchGame.from_api(game.url)))
                 continue
 
             # load previously saved sales
@@ -242,36 +480,243 @@ def get_online_sale_page(page: int, category: str = 'games') -> int:
                 continue
 
             # Call API to get active sale
-            sale = ItchGame.from_api(game.url).active_sale
-            game.sales.append(sale)
-            game.sales.sort(key=lambda a: a.id)
-            game.save_to_disk()
-            print(f'Updated values for {category} {game.name} ({game.url})')
+            updates.append((game, ItchGame.from_api(game.url)))
+
+    # from_api() returns None (and prints the reason) if the game couldn't be loaded
+    updates = [ (game, api_game) for game, api_game in updates if api_game is not None ]
+    # Download the pages of the sales found by the API concurrently
+    ItchSale.resolve_all([ sale for _, api_game in updates for sale in api_game.sales ])
+
+    for game, api_game in updates:
+        if game is None:
+            api_game.save_to_disk()
+            print(f'Saved new {category} {api_game.name} ({api_game.url})')
             games_added += 1
+            continue
+
+        sale = api_game.active_sale
+        game.sales.append(sale)
+        game.sales.sort(key=lambda a: a.id)
+        game.save_to_disk()
+        print(f'Updated values for {category} {game.name} ({game.url})')
+        games_added += 1
     if len(games) == 0 and json.loads(r.text)["num_items"] == 0:
         return -1
     return games_added
 
-def load_all_games():
-    """Load all games cached on the disk"""
-    l: List[ItchGame] = []
+def game_files() -> Dict[int, str]:
+    """Returns the path of every game file in the games directory, by ID"""
+    files: Dict[int, str] = {}
     for file in os.listdir(ItchGame.games_dir):
-        if not file.endswith('.json'):
+        # Skip the other files of the directory (e.g. sale_frontier.json)
+        match = Snapshot.GAME_FILENAME_RE.match(file)
+        if match is None:
             continue
         path = os.path.join(ItchGame.games_dir, file)
         if os.path.getsize(path) == 0:
             continue
+        files[int(match.group(1))] = path
+    return files
+
+def load_all_games():
+    """Load all games cached on the disk, including the ones in the snapshot"""
+    WriteBuffer.flush()
+    l: List[ItchGame] = []
+    files = game_files()
+    for path in files.values():
         l.append(ItchGame.load_from_disk(path))
+        if len(l) % 1000 == 0:
+            MemoryReport.check('while loading games')
+    snapshot = Snapshot.for_directory(ItchGame.games_dir)
+    if snapshot is not None:
+        for game_id, raw in snapshot.games():
+            # Individual files are newer than the snapshot
+            if game_id in files:
+                continue
+            with Profiler.phase('json'):
+                data = json.loads(raw)
+            l.append(ItchGame.from_dict(data))
+            if len(l) % 1000 == 0:
+                MemoryReport.check('while loading games')
+    MemoryReport.checkpoint('after load')
+    return l
+
+def iter_serialized_games() -> Iterator[dict]:
+    """Iterate over the serialized form of every game on the disk (see ItchGame.serialize()),
+    including the ones in the snapshot, without loading all of them into the memory.
+    Claimability isn't checked online."""
+    WriteBuffer.flush()
+    files = game_files()
+    for path in files.values():
+        raw = WriteBuffer.read(path)
+        with Profiler.phase('json'):
+            yield json.loads(raw)
+    snapshot = Snapshot.for_directory(ItchGame.games_dir)
+    if snapshot is not None:
+        for game_id, raw in snapshot.games():
+            # Individual files are newer than the snapshot
+            if game_id in files:
+                continue
+            with Profiler.phase('json'):
+                yield json.loads(raw)
+
+def build_sale_index() -> SaleIndex.SaleIndex:
+    """Build the sale index of the games directory from every game, including the ones
+    in the snapshot. Claimability isn't checked online."""
+    WriteBuffer.flush()
+    # Games saved from now on are logged again
+    log_path = os.path.join(ItchGame.games_dir, SaleIndex.LOG_FILENAME)
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    records = ( SaleIndex.to_record(game) for game in iter_serialized_games() )
+    index = SaleIndex.SaleIndex.build(ItchGame.games_dir, records)
+    index.load_log()
+    return index
+
+def export_snapshot(path: str, remove_files: bool = False) -> int:
+    """Pack every game of the games directory into a snapshot
+
+    Args:
+        path (str): The location of the snapshot
+        remove_files (bool): Delete the game files after they have been packed
+
+    Returns:
+        int: The number of games packed"""
+    WriteBuffer.flush()
+    files = game_files()
+    snapshot = Snapshot.for_directory(ItchGame.games_dir)
+    ids = set(files.keys())
+    if snapshot is not None:
+        ids.update(snapshot.ids)
+
+    def games():
+        for game_id in sorted(ids):
+            if game_id in files:
+                with open(files[game_id], 'r', encoding='utf-8') as f:
+                    yield game_id, f.read()
+            else:
+                yield game_id, snapshot.read_game(game_id)
+
+    state_files: Dict[str, str] = {}
+    for name in Snapshot.STATE_FILES:
+        try:
+            with open(os.path.join(ItchGame.games_dir, name), 'r', encoding='utf-8') as f:
+                state_files[name] = f.read()
+        except FileNotFoundError:
+            pass
+
+    with Profiler.phase('disk_io'):
+        games_num = Snapshot.write(path, games(), state_files)
+    if remove_files:
+        for file in files.values():
+            os.remove(file)
+    return games_num
+
+def import_snapshot(path: str) -> int:
+    """Unpack every file of a snapshot into the games directory
+
+    Returns:
+        int: The number of games unpacked"""
+    snapshot = Snapshot.Snapshot(path)
+    games_num = 0
+    for game_id, content in snapshot.games():
+        WriteBuffer.put(os.path.join(ItchGame.games_dir, f'{game_id}.json'), content)
+        games_num += 1
+    for name in snapshot.files:
+        WriteBuffer.put(os.path.join(ItchGame.games_dir, name), snapshot.read_file(name))
+    WriteBuffer.flush()
+    snapshot.close()
+    return games_num
+
+def load_games(ids: Iterable[int]) -> List[ItchGame]:
+    """Load the given games from the disk. Missing games are skipped."""
+    l: List[ItchGame] = []
+    for game_id in ids:
+        game = ItchGame(game_id)
+        if game.is_saved():
+            l.append(ItchGame.load_from_disk(game.get_default_game_filename()))
     return l
 
+def load_games_from_feed(all_json_path: str) -> Optional[List[ItchGame]]:
+    """Load the games from the previously generated all.json, and replace the ones
+    listed in the change feed with their current version on the disk.
+
+    Returns:
+        List[ItchGame]: Every game, or None if the feed doesn't contain every
+            change since all.json was generated"""
+    header, entries = ChangeFeed.read(ItchGame.games_dir)
+    if header is None or header.get('since') is None:
+        return None
+    if header.get('base') is None or ChangeFeed.file_hash(all_json_path) != header['base']:
+        return None
+    with Profiler.phase('disk_io'):
+        with open(all_json_path, 'r', encoding='utf-8') as f:
+            raw = f.read()
+    with Profiler.phase('json'):
+        records = json.loads(raw)
+    games: Dict[int, ItchGame] = { record['id']: ItchGame.from_dict(record) for record in records }
+    changed = { entry['id'] for entry in entries }
+    for game in load_games(changed):
+        games[game.id] = game
+    print(f'Loaded {len(records)} games from {all_json_path}, updated {len(changed)} changed games')
+    MemoryReport.checkpoint('after load')
+    return list(games.values())
+
 def download_from_remote_cache(url: str) -> List[ItchGame]:
-    r = requests.get(url, timeout=32)
-    games_raw = json.loads(r.text)
+    games_raw, _ = download_remote_list(url)
+    return games_from_remote_list(games_raw)
+
+def download_remote_list(url: str, validators: dict = None, full: bool = False) -> Tuple[Optional[list], dict]:
+    """Download a list of games from the remote cache, unless it hasn't changed.
+    The active and upcoming lists are taken from the local copy of the remote cache,
+    which is updated with the change feed, if the remote cache has one.
+
+    Args:
+        url (str): The URL of the list
+        validators (dict): The validators returned by the previous download of the list
+        full (bool): Download the whole list, even if the local copy of the remote cache is up to date
+
+    Returns:
+        Tuple[Optional[list], dict]: The list (None if it hasn't changed), and the validators
+            to send with the next download"""
+    api_url, list_name = url.rsplit('/', 1)
+    if list_name in RemoteCatalog.LISTS:
+        try:
+            state = RemoteCatalog.sync(api_url, full)
+        except (RequestException, ValueError, KeyError) as e:
+            print(f'Failed to follow the change feed of the remote cache: {e}')
+            state = None
+        if state is not None:
+            # The games in the lists change over time even if the feed doesn't,
+            # so there are no validators to skip the next download with
+            return RemoteCatalog.select(state, list_name), {}
+
+    headers = {}
+    if validators:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+    r = requests.get(url, headers=headers, timeout=32)
+    if r.status_code == 304:
+        return None, validators
+    r.raise_for_status()
+    with Profiler.phase('json'):
+        games_raw = json.loads(r.text)
+    validators = {}
+    if 'ETag' in r.headers:
+        validators['etag'] = r.headers['ETag']
+    if 'Last-Modified' in r.headers:
+        validators['last_modified'] = r.headers['Last-Modified']
+    return games_raw, validators
+
+def games_from_remote_list(games_raw: list) -> List[ItchGame]:
     games = []
     for game_json in games_raw:
         game = ItchGame(game_json['id'])
         game.url = game_json['url']
         game.name = game_json['name']
         game.claimable = game_json['claimable']
+        game.sales = [ ItchSale.from_dict(sale) for sale in game_json.get('sales', []) ]
         games.append(game)
     return games
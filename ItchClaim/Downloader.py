@@ -0,0 +1,441 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Downloads the files of games (see ItchGame.downloadable_files()) to the disk.
+
+Files are downloaded in chunks of CHUNK_SIZE with HTTP range requests, several chunks of a
+file at the same time. The completed chunks of every file are saved in the manifest
+(manifest.json in the output directory), so an interrupted download continues where it
+stopped. A file is downloaded again from the start if its size or its ETag has changed.
+Completed files are checked against their size, and the MD5 hash sent by the server, if any.
+Files whose upload date hasn't changed since they were downloaded are skipped, without
+resolving their CDN URL. CDN URLs expire, so they are resolved by every run instead of being saved.
+
+In content addressed mode (used by the mirror command) every file is stored once, in
+objects/<sha256> of the output directory, and the files of the games (games/<game>/<file>)
+are hard links to them. Files with the same content are only downloaded once if the server
+sends their MD5 hash."""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from requests.exceptions import RequestException
+
+from .CfWrapper import CfWrapper
+from .ItchGame import ItchGame
+
+CHUNK_SIZE = 8 * 1024 * 1024
+READ_SIZE = 64 * 1024
+MAX_CHUNK_ATTEMPTS = 3
+MANIFEST_FILENAME = 'manifest.json'
+RESULTS = ('downloaded', 'linked', 'skipped', 'failed')
+
+requests = CfWrapper()
+
+class BandwidthLimiter:
+    def __init__(self, bytes_per_second: Optional[float]):
+        """A token bucket shared by every download
+
+        Args:
+            bytes_per_second (Optional[float]): The maximum download speed, None if unlimited"""
+        self.rate = bytes_per_second
+        self.lock = threading.Lock()
+        self.allowance = 0.0
+        self.last = monotonic()
+
+    def take(self, size: int):
+        """Wait until size bytes can be downloaded"""
+        if self.rate is None:
+            return
+        with self.lock:
+            now = monotonic()
+            # Allow bursts of at most one second
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= size
+            wait = -self.allowance / self.rate
+        if wait > 0:
+            sleep(wait)
+
+class HostLimiter:
+    def __init__(self, limit: int):
+        """Limits the number of requests sent to each host at the same time"""
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.slots: Dict[str, threading.BoundedSemaphore] = {}
+
+    def slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).hostname
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.limit)
+            return self.slots[host]
+
+class Manifest:
+    def __init__(self, output_dir: str):
+        """The state of the downloads in output_dir, by upload ID"""
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.files: Dict[str, dict] = json.load(f)
+        except FileNotFoundError:
+            self.files = {}
+
+    def update(self, upload_id: int, entry: Optional[dict]):
+        """Replace the entry of an upload (None removes it), and save the manifest"""
+        with self.lock:
+            if entry is None:
+                self.files.pop(str(upload_id), None)
+            else:
+                self.files[str(upload_id)] = entry
+            self.save()
+
+    def chunk_done(self, upload_id: int, chunk: int):
+        with self.lock:
+            self.files[str(upload_id)]['chunks'].append(chunk)
+            self.save()
+
+    def save(self):
+        content = json.dumps(self.files, indent=1)
+        with open(f'{self.path}.tmp', 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(f'{self.path}.tmp', self.path)
+
+def safe_filename(name: str) -> str:
+    """Replace the characters that aren't allowed in file names on some systems"""
+    name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', '_', name).strip(' .')
+    return name or '_'
+
+def file_hashes(path: str) -> Tuple[str, str]:
+    """Returns the MD5 and SHA-256 hash of a file"""
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(data)
+            sha256.update(data)
+    return md5.hexdigest(), sha256.hexdigest()
+
+def expected_md5(headers) -> Optional[str]:
+    """The MD5 hash of the file, if the server has sent it (Google Cloud Storage and S3 do)"""
+    for part in headers.get('X-Goog-Hash', '').split(','):
+        key, _, value = part.strip().partition('=')
+        if key == 'md5':
+            return base64.b64decode(value).hex()
+    etag = headers.get('ETag', '').strip('"')
+    if re.fullmatch(r'[0-9a-f]{32}', etag):
+        return etag
+    return None
+
+class Downloader:
+    def __init__(self, output_dir: str, workers: int = 4, chunk_workers: int = 4,
+            max_bandwidth: Optional[float] = None, verify: bool = False, per_host: int = 4,
+            content_addressed: bool = False):
+        """Download the files of games
+
+        Args:
+            output_dir (str): The files of each game are saved to a subdirectory of this
+            workers (int): The number of files downloaded at the same time
+            chunk_workers (int): The number of chunks of a file downloaded at the same time
+            max_bandwidth (Optional[float]): The maximum total download speed in bytes/s
+            verify (bool): Check the hash of the files that have been downloaded by a
+                previous run, instead of only their size
+            per_host (int): The maximum number of requests sent to a host at the same time
+            content_addressed (bool): Store each file once in the objects directory, and
+                link the files of the games to them"""
+        self.output_dir = output_dir
+        self.content_addressed = content_addressed
+        self.hosts = HostLimiter(per_host)
+        # MD5 hashes of the files being downloaded, the other files with the same content wait for them
+        self.in_flight: Dict[str, threading.Event] = {}
+        self.in_flight_lock = threading.Lock()
+        self.workers = workers
+        self.chunk_workers = chunk_workers
+        self.verify = verify
+        self.limiter = BandwidthLimiter(max_bandwidth)
+        # Set when the command is interrupted, the downloads in progress stop at the next read
+        self.stop = threading.Event()
+        os.makedirs(output_dir, exist_ok=True)
+        self.manifest = Manifest(output_dir)
+
+    def download_games(self, games: List[ItchGame]) -> Dict[str, int]:
+        """Download every file of the games
+
+        Returns:
+            Dict[str, int]: The number of files downloaded, linked (to a stored file with the same
+                content), skipped (already downloaded) and failed"""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            uploads_by_game = list(executor.map(self.list_uploads, games))
+            uploads = [ (game, upload) for game, game_uploads in zip(games, uploads_by_game)
+                for upload in game_uploads or [] ]
+            if self.content_addressed:
+                self.remove_deleted_uploads({ game.id: { upload['id'] for upload in game_uploads }
+                    for game, game_uploads in zip(games, uploads_by_game) if game_uploads is not None })
+            print(f'Found {len(uploads)} files in {len(games)} games')
+            try:
+                results = list(executor.map(lambda item: self.download_upload(*item), uploads))
+            except BaseException:
+                # Otherwise the executor would wait for every queued download
+                self.stop.set()
+                raise
+        return { result: results.count(result) for result in RESULTS }
+
+    def list_uploads(self, game: ItchGame) -> Optional[List[dict]]:
+        """Returns None if the files of the game couldn't be listed"""
+        try:
+            with self.hosts.slot(game.url):
+                return game.downloadable_files(resolve_urls=False)
+        except (RequestException, ValueError) as e:
+            print(f'Failed to get the files of {game.name} (ID {game.id}): {e}')
+            return None
+
+    def game_dir(self, game: ItchGame) -> str:
+        games_dir = os.path.join(self.output_dir, 'games') if self.content_addressed else self.output_dir
+        return os.path.join(games_dir, safe_filename(f'{game.id}-{game.name}'))
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.output_dir, 'objects', sha256[:2], sha256)
+
+    def download_upload(self, game: ItchGame, upload: dict) -> str:
+        """Download a file, continuing the download of the previous run if possible.
+        Returns downloaded, linked, skipped or failed."""
+        path = os.path.join(self.game_dir(game), safe_filename(upload['name']))
+        if self.stop.is_set():
+            return 'failed'
+        entry = self.manifest.files.get(str(upload['id']))
+        if (entry is not None and entry['complete'] and entry.get('upload_date') == upload['upload_date']
+                and self.is_intact(entry)):
+            return 'skipped'
+
+        try:
+            with self.hosts.slot(game.url):
+                url = game.file_url(upload['id'])
+            with self.hosts.slot(url):
+                r = requests.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=32)
+                r.close()
+        except (RequestException, ValueError, KeyError) as e:
+            print(f'Failed to start downloading {upload["name"]} of {game.name}: {e}')
+            return 'failed'
+        if r.status_code == 206:
+            size = int(r.headers['Content-Range'].rsplit('/', 1)[1])
+            chunk_size = CHUNK_SIZE
+        elif r.status_code == 200:
+            # Range requests aren't supported, so the file is downloaded in one piece.
+            # Without Content-Length (chunked encoding) the size is unknown until it's downloaded.
+            size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+            chunk_size = None
+        else:
+            print(f'Failed to start downloading {upload["name"]} of {game.name}: HTTP {r.status_code}')
+            return 'failed'
+        etag = r.headers.get('ETag')
+        md5 = expected_md5(r.headers)
+
+        if not self.content_addressed or md5 is None:
+            return self.download_file(game, upload, url, path, size, chunk_size, etag, md5)
+        with self.in_flight_lock:
+            downloading = self.in_flight.get(md5)
+            if downloading is None:
+                self.in_flight[md5] = threading.Event()
+        if downloading is not None:
+            downloading.wait()
+        else:
+            try:
+                # Another file with the same content may have been downloaded by a previous run
+                if self.find_object(md5, size) is None:
+                    return self.download_file(game, upload, url, path, size, chunk_size, etag, md5)
+            finally:
+                self.in_flight[md5].set()
+
+        stored = self.find_object(md5, size)
+        if stored is None:
+            # The download of the other file has failed
+            return self.download_file(game, upload, url, path, size, chunk_size, etag, md5)
+        self.link(stored['sha256'], path)
+        self.manifest.update(upload['id'], {**stored, 'game_id': game.id, 'game': game.name,
+            'name': upload['name'], 'upload_date': upload['upload_date'],
+            'path': os.path.relpath(path, self.output_dir), 'chunks': []})
+        print(f'Linked {os.path.relpath(path, self.output_dir)} to a stored file with the same content')
+        return 'linked'
+
+    def download_file(self, game: ItchGame, upload: dict, url: str, path: str, size: Optional[int],
+            chunk_size: Optional[int], etag: Optional[str], md5: Optional[str]) -> str:
+        """Download a file to path, continuing the download of the previous run if possible
+
+        Args:
+            size (Optional[int]): The size of the file, None if it's unknown
+            chunk_size (Optional[int]): The size of the chunks, None if range requests aren't supported
+            etag (Optional[str]): The ETag of the file, if any
+            md5 (Optional[str]): The MD5 hash of the file sent by the server, if any"""
+        entry = self.manifest.files.get(str(upload['id']))
+        part_path = f'{path}.part'
+        if (entry is None or entry['complete'] or entry['size'] != size or entry['etag'] != etag
+                or entry['chunk_size'] != chunk_size or chunk_size is None or not os.path.exists(part_path)):
+            entry = {
+                'game_id': game.id,
+                'game': game.name,
+                'name': upload['name'],
+                'path': os.path.relpath(path, self.output_dir),
+                'upload_date': upload['upload_date'],
+                'size': size,
+                'etag': etag,
+                'md5': md5,
+                'chunk_size': chunk_size,
+                'chunks': [],
+                'complete': False,
+            }
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(part_path, 'wb') as f:
+                f.truncate(size or 0)
+            self.manifest.update(upload['id'], entry)
+        else:
+            print(f'Resuming {entry["path"]} ({len(entry["chunks"])} chunks done)')
+
+        chunks = [ (0, None if size is None else size - 1) ] if chunk_size is None else \
+            [ (start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size) ]
+        pending = [ i for i in range(len(chunks)) if i not in entry['chunks'] ]
+        with ThreadPoolExecutor(max_workers=self.chunk_workers) as executor:
+            done = list(executor.map(lambda i: self.download_chunk(
+                url, part_path, chunks[i], chunk_size is not None, upload['id'], i), pending))
+        if not all(done):
+            print(f'Failed to download {entry["path"]}, the next run continues it')
+            return 'failed'
+
+        md5, sha256 = file_hashes(part_path)
+        if ((size is not None and os.path.getsize(part_path) != size)
+                or (entry['md5'] is not None and entry['md5'] != md5)):
+            print(f'Downloaded file {entry["path"]} is corrupted, the next run downloads it again')
+            os.remove(part_path)
+            self.manifest.update(upload['id'], None)
+            return 'failed'
+        if self.content_addressed:
+            object_path = self.object_path(sha256)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            if os.path.exists(object_path):
+                os.remove(part_path)
+            else:
+                os.replace(part_path, object_path)
+            self.link(sha256, path)
+        else:
+            os.replace(part_path, path)
+        size = os.path.getsize(object_path if self.content_addressed else path)
+        self.manifest.update(upload['id'], {**entry, 'size': size, 'md5': md5, 'sha256': sha256, 'complete': True})
+        print(f'Downloaded {entry["path"]} ({size / 1024 / 1024:.1f} MiB)')
+        return 'downloaded'
+
+    def download_chunk(self, url: str, part_path: str, chunk: Tuple[int, int], ranged: bool,
+            upload_id: int, index: int) -> bool:
+        """Download the bytes of a file between the bounds of chunk (inclusive), and
+        write them to the same position of part_path. If the end is None, the file is
+        downloaded until the end of the response."""
+        start, end = chunk
+        headers = {'Range': f'bytes={start}-{end}'} if ranged else {}
+        for attempt in range(1, MAX_CHUNK_ATTEMPTS + 1):
+            if self.stop.is_set():
+                return False
+            try:
+                with self.hosts.slot(url), requests.get(url, headers=headers, stream=True, timeout=32) as r:
+                    if r.status_code != (206 if ranged else 200):
+                        raise IOError(f'HTTP {r.status_code}')
+                    position = start
+                    with open(part_path, 'r+b') as f:
+                        f.seek(start)
+                        for data in r.iter_content(READ_SIZE):
+                            if self.stop.is_set():
+                                return False
+                            self.limiter.take(len(data))
+                            f.write(data)
+                            position += len(data)
+                        if not ranged:
+                            # Drop the leftover of a longer failed attempt
+                            f.truncate(position)
+                if end is not None and position != end + 1:
+                    raise IOError(f'received {position - start} of {end - start + 1} bytes')
+            except (RequestException, IOError) as e:
+                print(f'Failed to download bytes {start}-{end} of {part_path} (attempt {attempt}): {e}')
+                continue
+            self.manifest.chunk_done(upload_id, index)
+            return True
+        return False
+
+    def is_intact(self, entry: dict) -> bool:
+        """Check a file downloaded by a previous run"""
+        path = os.path.join(self.output_dir, entry['path'])
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return False
+        return not self.verify or file_hashes(path)[1] == entry['sha256']
+
+    def find_object(self, md5: str, size: Optional[int]) -> Optional[dict]:
+        """Returns the manifest entry of a stored file with the given content, if any.
+        Only the MD5 hash is compared if the size is unknown."""
+        for entry in list(self.manifest.files.values()):
+            if (entry['complete'] and entry['md5'] == md5 and size in (None, entry['size'])
+                    and os.path.exists(self.object_path(entry['sha256']))):
+                return entry
+        return None
+
+    def link(self, sha256: str, path: str):
+        """Make path a hard link to a stored file, or a symbolic link if hard links aren't supported"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+        try:
+            os.link(self.object_path(sha256), path)
+        except OSError:
+            os.symlink(os.path.relpath(self.object_path(sha256), os.path.dirname(path)), path)
+
+    def remove_unreferenced_objects(self) -> int:
+        """Delete the stored files that aren't in the manifest anymore, e.g. the previous
+        versions of updated files. Returns the number of files deleted."""
+        referenced = { entry['sha256'] for entry in self.manifest.files.values() if entry['complete'] }
+        removed = 0
+        objects_dir = os.path.join(self.output_dir, 'objects')
+        for root, _, files in os.walk(objects_dir):
+            for file in files:
+                if file not in referenced:
+                    os.remove(os.path.join(root, file))
+                    removed += 1
+        return removed
+
+    def remove_deleted_uploads(self, uploads_by_game: Dict[int, set]):
+        """Delete the files of uploads that have been removed from their games
+
+        Args:
+            uploads_by_game (Dict[int, set]): The IDs of the uploads of the games that have been listed"""
+        for upload_id, entry in list(self.manifest.files.items()):
+            uploads = uploads_by_game.get(entry['game_id'])
+            if uploads is None or int(upload_id) in uploads:
+                continue
+            print(f'Removing {entry["path"]}, it has been deleted from the game')
+            path = os.path.join(self.output_dir, entry['path'])
+            for stale in (path, f'{path}.part'):
+                if os.path.lexists(stale):
+                    os.remove(stale)
+            self.manifest.update(int(upload_id), None)
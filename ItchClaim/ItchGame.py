@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Optional
 from functools import cached_property
@@ -27,8 +28,14 @@ import json, re, urllib, os
 from bs4.element import Tag
 from bs4 import BeautifulSoup
 from .ItchSale import ItchSale
-from . import __version__
+from . import __version__, ChangeFeed, Metrics, Profiler, SaleIndex, WriteBuffer
 from .CfWrapper import CfWrapper
+from .SingleFlight import SingleFlight
+
+# The number of CDN URLs resolved at the same time by downloadable_files()
+MAX_URL_RESOLVERS = 8
+# data.json of the games downloaded recently, by URL
+_api_responses = SingleFlight('game_data', max_results=2000)
 
 class ItchGame:
     games_dir: str = 'web/data/'
@@ -82,10 +89,25 @@ class ItchGame:
         return self
 
     def save_to_disk(self):
-        """Save the details of game to the disk"""
-        os.makedirs(ItchGame.games_dir, exist_ok=True)
-        with open(self.get_default_game_filename(), 'w', encoding='utf-8') as f:
-            f.write(json.dumps(self.serialize()))
+        """Save the details of game to the disk.
+        The file is written in a batch by WriteBuffer, repeated saves are merged.
+        Nothing is written if the content hasn't changed, otherwise the change is
+        recorded in the change feed and the sale index."""
+        path = self.get_default_game_filename()
+        ItchSale.resolve_all(self.sales)
+        serialized = self.serialize()
+        with Profiler.phase('json'):
+            data = json.dumps(serialized)
+        if WriteBuffer.unchanged(path, data):
+            Metrics.inc('game_saves_skipped_total')
+            return
+        previous = WriteBuffer.read(path)
+        if previous is not None:
+            with Profiler.phase('json'):
+                previous = json.loads(previous)
+        WriteBuffer.put(path, data)
+        ChangeFeed.record(ItchGame.games_dir, self.id, ChangeFeed.classify(previous, serialized))
+        SaleIndex.record(ItchGame.games_dir, serialized)
 
     @classmethod
     def load_from_disk(cls, path: str, refresh_claimable: bool = False):
@@ -96,8 +118,22 @@ class ItchGame:
             refresh_claimable (bool): Check claimability online again
                 Defaults to False
             """
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.loads(f.read())
+        raw = WriteBuffer.read(path)
+        if raw is None:
+            raise FileNotFoundError(path)
+        with Profiler.phase('json'):
+            data = json.loads(raw)
+        return cls.from_dict(data, refresh_claimable)
+
+    @classmethod
+    def from_dict(cls, data: dict, refresh_claimable: bool = False):
+        """Load a game from its serialized form (see serialize())
+
+        Args:
+            data (dict): The serialized game
+            refresh_claimable (bool): Check claimability online again
+                Defaults to False
+            """
         id = data['id']
         self = ItchGame(id)
         self.name = data['name']
@@ -124,11 +160,7 @@ class ItchGame:
             url = url[:-1]
 
         s = CfWrapper()
-        r = s.get(url + '/data.json',
-                        headers={'User-Agent': f'ItchClaim {__version__}'},
-                        timeout=32,)
-        r.encoding = 'utf-8'
-        resp = json.loads(r.text)
+        resp, redirect_url = _api_responses.do(url, lambda: ItchGame._download_api_data(url))
 
         if 'errors' in resp:
             if resp['errors'][0] in ('invalid game', 'invalid user'):
@@ -152,8 +184,8 @@ class ItchGame:
         # https://web.archive.org/web/20231107063207/https://daions-studio.itch.io/hp-bar-assets-pack/data.json
         # Without redirect example: https://polygon-sphere.itch.io/rogue-ai/data.json
         # https://web.archive.org/web/20231107063001/https://polygon-sphere.itch.io/rogue-ai/data.json
-        if len(r.history) > 0 and r.history[0].is_redirect:
-            game.url = r.history[0].headers['Location'].replace('/data.json', '')
+        if redirect_url is not None:
+            game.url = redirect_url
         try:
             game.price = float(resp['price'][1:])
         except KeyError:
@@ -163,23 +195,42 @@ class ItchGame:
 
         if 'sale' in resp and resp['sale']['rate'] == 100:
             # Don't even bother with parsing the end date, because the JSON we have doesn't have the start date of the sale,
-            # so ItchSale will update both dates regardless of what data we pass it here.
+            # so ItchSale will download both dates when they are needed.
             game.sales = [ItchSale(resp['sale']['id'])]
 
         return game
 
+    @staticmethod
+    def _download_api_data(url: str):
+        """Returns the parsed data.json of a game, and the URL it has been redirected to"""
+        r = CfWrapper().get(url + '/data.json',
+                        headers={'User-Agent': f'ItchClaim {__version__}'},
+                        timeout=32,)
+        r.encoding = 'utf-8'
+        with Profiler.phase('json'):
+            resp = json.loads(r.text)
+        redirect_url = None
+        if len(r.history) > 0 and r.history[0].is_redirect:
+            redirect_url = r.history[0].headers['Location'].replace('/data.json', '')
+        return resp, redirect_url
+
     def get_default_game_filename(self) -> str:
         """Get the default path of the game's cache file"""
         sessionfilename = f'{self.id}.json'
         return os.path.join(ItchGame.games_dir, sessionfilename)
 
+    def is_saved(self) -> bool:
+        """Check if the game has been saved to the disk, or is waiting to be written"""
+        return WriteBuffer.exists(self.get_default_game_filename())
+
     @cached_property
     def claimable(self) -> Optional[bool]:
         if not self.active_sale:
             return None
         r = self.s.get(self.url, timeout=32)
         r.encoding = 'utf-8'
-        soup = BeautifulSoup(r.text, 'html.parser')
+        with Profiler.phase('html_parse'):
+            soup = BeautifulSoup(r.text, 'html.parser')
         buy_row = soup.find('div', class_='buy_row')
         if buy_row is None:
             # Game is probably WebGL or HTML5 only
@@ -211,8 +262,17 @@ class ItchGame:
     def is_first_sale(self) -> bool:
         return len(self.sales) == 1
 
-    def downloadable_files(self) -> List:
-        """Get details about a game, including it's CDN URls"""
+    def downloadable_files(self, resolve_urls: bool = True) -> Optional[List[dict]]:
+        """Get details about the files of a game, including their CDN URLs.
+        The URLs of the files are resolved concurrently.
+
+        Args:
+            resolve_urls (bool): Get the CDN URLs of the files. Otherwise they can be
+                resolved later with file_url(), e.g. only for the files that are needed.
+
+        Returns:
+            Optional[List[dict]]: Details about the files (see parse_download_div()),
+                None if the download page isn't available"""
 
         r = self.s.post(self.url + '/download_url', json={'csrf_token': self.s.csrf_token})
         r.encoding = 'utf-8'
@@ -220,22 +280,23 @@ class ItchGame:
         if 'errors' in resp:
             print(f"ERROR: Failed to get download links for game {self.name} (url: {self.url})")
             print(f"\t{resp['errors'][0]}")
-            return
-        download_page = json.loads(r.text)['url']
+            return None
+        download_page = resp['url']
         r = self.s.get(download_page)
         r.encoding = 'utf-8'
         soup = BeautifulSoup(r.text, 'html.parser')
         uploads_div = soup.find_all('div', class_='upload')
-        uploads = []
-        for upload_div in uploads_div:
-            uploads.append(self.parse_download_div(upload_div, s))
-        return uploads
+        if not resolve_urls or len(uploads_div) == 0:
+            return [ self.parse_download_div(div, False) for div in uploads_div ]
+        with ThreadPoolExecutor(max_workers=min(MAX_URL_RESOLVERS, len(uploads_div))) as executor:
+            return list(executor.map(lambda div: self.parse_download_div(div, True), uploads_div))
 
-    def parse_download_div(self, div: Tag):
+    def parse_download_div(self, div: Tag, resolve_url: bool = True):
         """Extract details about a game. 
         
         Args:
             div (Tag): A div containing download information
+            resolve_url (bool): Get the CDN URL of the file. Otherwise url is None.
 
         Returns:
             dict: Details about the game's files"""
@@ -256,22 +317,23 @@ class ItchGame:
                 if platforms_span.find('span', class_ = f'icon icon-{platform}'):
                     platforms.append(platform)
 
-        # Get download url
-        r = self.s.post(self.url + f'/file/{id}',
-                    json={'csrf_token': self.s.csrf_token},
-                    params={'source': 'game_download'})
-        r.encoding = 'utf-8'
-        download_url= json.loads(r.text)['url']
-
         return {
             'id': id,
             'name': div.find('strong', class_ = 'name').text,
             'file_size': div.find('span', class_ = 'file_size').next.text,
             'upload_date': upload_date.timestamp(),
             'platforms': platforms,
-            'url': download_url,
+            'url': self.file_url(id) if resolve_url else None,
         }
 
+    def file_url(self, upload_id: int) -> str:
+        """Get the CDN URL of a file of the game. The URL expires after a while."""
+        r = self.s.post(self.url + f'/file/{upload_id}',
+                    json={'csrf_token': self.s.csrf_token},
+                    params={'source': 'game_download'})
+        r.encoding = 'utf-8'
+        return json.loads(r.text)['url']
+
     def serialize(self):
         """Returns a serialized object containing all information about the object"""
         return {
@@ -286,13 +348,12 @@ class ItchGame:
 
     def serialize_min(self):
         """Returns a serialized object containing minimal information about the object"""
-        return {
-            'id': self.id,
-            'name': self.name,
-            'url': self.url,
-            'claimable': self.claimable,
-            'sales': ItchSale.serialize_list(self.sales),
-        }
+        return ItchGame.minimize(self.serialize())
+
+    @staticmethod
+    def minimize(serialized: dict) -> dict:
+        """Returns the fields of serialize_min() from the output of serialize()"""
+        return { key: serialized[key] for key in ('id', 'name', 'url', 'claimable', 'sales') }
 
     def check_redirect_url(self):
         """Checks if a new URL is available for the game, and updates the current one
@@ -22,22 +22,114 @@
 
 import json
 import re
-from typing import List
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List
 from datetime import datetime
+from time import time
 from bs4 import BeautifulSoup
-from . import __version__
+from . import __version__, Profiler
 from .CfWrapper import CfWrapper
+from .SingleFlight import SingleFlight
+
+# start, end and err of the sale pages downloaded recently, by sale ID
+_sale_pages = SingleFlight('sale_page', max_results=20000)
+# Sales whose page hasn't been downloaded yet
+_unresolved = weakref.WeakSet()
+
+# The rules that decide which sales are listed as active and upcoming. Used for serialized
+# sales (see ItchSale.serialize()) by the website, the serve command and the local copy of
+# the remote cache, and by the properties of ItchSale.
+
+def is_active(sales: Iterable[dict], now: float) -> bool:
+    """Check if one of the serialized sales has started, but not ended at the given time"""
+    return any(sale['start'] <= now < sale['end'] for sale in sales)
+
+def is_upcoming(sales: Iterable[dict], now: float) -> bool:
+    """Check if one of the serialized sales (i.e. the last one) starts after the given time"""
+    return any(sale['start'] > now for sale in sales)
 
 
 class ItchSale:
+    # The number of sale pages downloaded at the same time by resolve_all()
+    resolver_workers: int = 8
+
     def __init__(self, id: int, end: datetime = None, start: datetime = None) -> None:
+        """The dates of the sale are downloaded from its page when they are first needed,
+        or by resolve_all(). Creating an instance never sends a request."""
         self.id: int = id
-        self.end: datetime = end
-        self.start: datetime = start
-        self.err: str = None
+        self._end: datetime = end
+        self._start: datetime = start
+        self._err: str = None
+        self.resolved: bool = bool(start and end)
+
+        if not self.resolved:
+            _unresolved.add(self)
+
+
+    @property
+    def start(self) -> datetime:
+        self.resolve()
+        return self._start
+
+    @start.setter
+    def start(self, value: datetime):
+        self._start = value
+
+
+    @property
+    def end(self) -> datetime:
+        self.resolve()
+        return self._end
+
+    @end.setter
+    def end(self, value: datetime):
+        self._end = value
 
-        if not start or not end:
-            self.get_data_online()
+
+    @property
+    def err(self) -> str:
+        self.resolve()
+        return self._err
+
+    @err.setter
+    def err(self, value: str):
+        self._err = value
+
+
+    def resolve(self):
+        """Download the page of the sale if its dates are unknown.
+        Each sale page is downloaded at most once per run."""
+        if self.resolved:
+            return
+        self._start, self._end, self._err = _sale_pages.do(self.id, self._download)
+        self.resolved = True
+        _unresolved.discard(self)
+
+
+    def _download(self):
+        self.get_data_online()
+        return self._start, self._end, self._err
+
+
+    @staticmethod
+    def resolve_all(sales: Iterable['ItchSale'] = None):
+        """Download the pages of multiple sales concurrently
+
+        Args:
+            sales (Iterable[ItchSale]): The sales to resolve.
+                Defaults to every sale of the run that hasn't been resolved yet"""
+        if sales is None:
+            sales = list(_unresolved)
+        pending = [ sale for sale in sales if not sale.resolved ]
+        if len(pending) == 0:
+            return
+        if len(pending) == 1:
+            pending[0].resolve()
+            return
+        with ThreadPoolExecutor(max_workers=ItchSale.resolver_workers) as executor:
+            # Consume the results to raise the exceptions of the workers
+            list(executor.map(ItchSale.resolve, pending))
 
 
     def get_data_online(self):
@@ -59,10 +151,12 @@ class ItchSale:
             return
 
         # Used by DiskManager.get_one_sale()
-        self.soup = BeautifulSoup(r.text, 'html.parser')
+        with Profiler.phase('html_parse'):
+            self.soup = BeautifulSoup(r.text, 'html.parser')
 
         date_format = '%Y-%m-%dT%H:%M:%SZ'
-        sale_data = json.loads(re.findall(r'init_Sale.+, (.+)\);i', r.text)[0])
+        with Profiler.phase('json'):
+            sale_data = json.loads(re.findall(r'init_Sale.+, (.+)\);i', r.text)[0])
         self.start = datetime.strptime(sale_data['start_date'], date_format)
         self.end = datetime.strptime(sale_data['end_date'], date_format)
 
@@ -93,11 +187,9 @@ class ItchSale:
 
     @property
     def is_active(self):
-        if datetime.now() < self.end and datetime.now() > self.start:
-            return True
-        return False
+        return is_active([self.serialize()], time())
 
 
     @property
     def is_upcoming(self):
-        return datetime.now() < self.start
+        return is_upcoming([self.serialize()], time())
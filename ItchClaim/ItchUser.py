@@ -26,17 +26,36 @@ import re
 import tempfile
 import os
 import json
-from typing import List, Optional
+from time import time
+from typing import Dict, List, Optional
 import pyotp
 from bs4 import BeautifulSoup
+from . import Profiler
 from .CfWrapper import CfWrapper
 from .ItchGame import ItchGame
+from .ItchSale import ItchSale
+
+# A validated session isn't checked again on startup for this many seconds.
+# If it expires in the meantime, the first rejected request triggers a new login.
+VALIDATION_TTL = 12 * 60 * 60
+# The home page is read in chunks of this size, until the end of its header
+VALIDATION_CHUNK_SIZE = 4096
+LOGIN_LINK = re.compile(rb'<a\b[^>]*\bhref=["\']/login["\']')
 
 class ItchUser:
     def __init__(self, username):
         self.s = CfWrapper()
         self.username = username
         self.owned_games: List[ItchGame] = []
+        # The end of the sales whose games have already been claimed or found not claimable,
+        # by "<game ID>:<sale ID>"
+        self.handled_sales: Dict[str, int] = {}
+        # ETag and Last-Modified headers of the downloaded lists of free games, by URL
+        self.remote_lists: Dict[str, dict] = {}
+        # The time of the last successful validation of the session
+        self.validated_at: float = 0
+        # The password and TOTP used to log in again if the session expires during a run
+        self.credentials = (None, None)
 
     def login(self, password: str, totp: Optional[str]):
         """Create a new session on itch.io"""
@@ -70,6 +89,8 @@ class ItchUser:
                 totp = input('Enter 2FA code: ')
             
             self.send_top(totp, r.url)
+        self.credentials = (password, totp)
+        self.validated_at = time()
         self.save_session()
 
     def send_top(self, totp: str, url: str) -> None:
@@ -101,6 +122,9 @@ class ItchUser:
             'csrf_token': self.s.csrf_token,
             'itchio': self.s.cookies['itchio'],
             'owned_games': [game.id for game in self.owned_games],
+            'handled_sales': { key: end for key, end in self.handled_sales.items() if end > time() },
+            'remote_lists': self.remote_lists,
+            'validated_at': self.validated_at,
         }
         with open(self.get_default_session_filename(), 'w') as f:
             f.write(json.dumps(data))
@@ -115,16 +139,67 @@ class ItchUser:
             self.owned_games  = [ItchGame(id) for id in data['owned_games']]
         except KeyError:
             pass
-    
+        self.handled_sales = data.get('handled_sales', {})
+        self.remote_lists = data.get('remote_lists', {})
+        self.validated_at = data.get('validated_at', 0)
+
+    def validation_due(self) -> bool:
+        """Check if the session hasn't been validated recently"""
+        return not 0 <= time() - self.validated_at < VALIDATION_TTL
+
     def validate_session(self) -> bool:
         """Validate wther the current session is valid"""
         # Itch.io has placed most of the user content behind Cloudflare
-        # So whe validate the user session by checking if a login button is present on the home page
-        r = self.s.get('https://itch.io/')
-        r.encoding = 'utf-8'
-        soup = BeautifulSoup(r.text, 'html.parser')
-        login_box = (soup.find('a', href='/login'))
-        return login_box is None
+        # So whe validate the user session by checking if a login button is present on the home page.
+        # The login button is in the header, so the rest of the page isn't downloaded.
+        r = self.s.get('https://itch.io/', stream=True)
+        head = bytearray()
+        try:
+            for chunk in r.iter_content(VALIDATION_CHUNK_SIZE):
+                head += chunk
+                # The closing tag may be split between two chunks
+                if b'</header>' in head[-len(chunk) - 8:]:
+                    break
+        finally:
+            r.close()
+        if r.status_code == 401 or self.is_login_page(r):
+            return False
+        valid = LOGIN_LINK.search(head) is None
+        if valid:
+            self.validated_at = time()
+        return valid
+
+    @staticmethod
+    def is_login_page(r) -> bool:
+        """Check if a request has been redirected to the login page"""
+        return r.url.split('?')[0] == 'https://itch.io/login'
+
+    def request(self, method: str, url: str, **kwargs):
+        """Send a request that requires a logged in user.
+        If the session turns out to be expired, log in again and resend the request."""
+        r = getattr(self.s, method.lower())(url, **kwargs)
+        if r.status_code != 401 and not self.is_login_page(r):
+            return r
+        self.login_again()
+        if 'json' in kwargs and 'csrf_token' in kwargs['json']:
+            kwargs['json'] = {**kwargs['json'], 'csrf_token': self.s.csrf_token}
+        if 'data' in kwargs and 'csrf_token' in kwargs['data']:
+            kwargs['data'] = {**kwargs['data'], 'csrf_token': self.s.csrf_token}
+        r = getattr(self.s, method.lower())(url, **kwargs)
+        if r.status_code == 401 or self.is_login_page(r):
+            print(f'ERROR: The new session has been rejected too (url: {url})')
+            exit(1)
+        return r
+
+    def login_again(self):
+        """Replace a session that has been found expired during a run"""
+        print('Session is invalid or expired. Logging in again.')
+        # Drop the rejected session cookies, so they don't conflict with the new ones
+        for cookie in list(self.s.cookies):
+            if cookie.name in ('itchio', 'itchio_token'):
+                self.s.cookies.clear(cookie.domain, cookie.path, cookie.name)
+        self.validated_at = 0
+        self.login(*self.credentials)
 
     def get_default_session_filename(self) -> str:
         """Get the default session path"""
@@ -138,6 +213,14 @@ class ItchUser:
                 return True
         return False
 
+    def is_handled(self, game_id: int, sale_id: int) -> bool:
+        """Check if the game has already been claimed or found not claimable during the sale"""
+        return f'{game_id}:{sale_id}' in self.handled_sales
+
+    def mark_handled(self, game_id: int, sale: ItchSale):
+        """Skip the game for the rest of the sale. Saved with the session."""
+        self.handled_sales[f'{game_id}:{sale.id}'] = int(sale.end.timestamp())
+
     def owns_game_online(self, game: ItchGame):
         """Check on itch.io if the user own's a game"""
         r = self.s.get(game.url, json={'csrf_token': self.s.csrf_token})
@@ -146,28 +229,39 @@ class ItchUser:
         owned_box = soup.find('span', class_='ownership_reason')
         return owned_box != None
 
-    def claim_game(self, game: ItchGame):
-        r = self.s.post(game.url + '/download_url', json={'csrf_token': self.s.csrf_token})
+    def claim_game(self, game: ItchGame) -> bool:
+        """Claim a game
+
+        Returns:
+            bool: False if claiming the game has failed, and it should be tried again"""
+        r = self.request('POST', game.url + '/download_url', json={'csrf_token': self.s.csrf_token})
         r.encoding = 'utf-8'
         resp = json.loads(r.text)
         if 'errors' in resp:
             if resp['errors'][0] in ('invalid game', 'invalid user'):
                 if game.check_redirect_url():
-                    self.claim_game(game)
-                    return
+                    return self.claim_game(game)
             print(f"ERROR: Failed to claim game {game.name} (url: {game.url})")
             print(f"\t{resp['errors'][0]}")
-            return
+            return False
         download_url = json.loads(r.text)['url']
         r = self.s.get(download_url)
         r.encoding = 'utf-8'
         soup = BeautifulSoup(r.text, 'html.parser')
         claim_box = soup.find('div', class_='claim_to_download_box warning_box')
         if claim_box == None:
+            # Logged out users get the same page without the claim box, and the sale would be
+            # skipped for good, so the session is checked before believing it
+            if not self.validate_session():
+                self.login_again()
+                if not self.validate_session():
+                    print('ERROR: The new session is invalid too')
+                    exit(1)
+                return self.claim_game(game)
             print(f"Game {game.name} is not claimable (url: {game.url})")
-            return
+            return True
         claim_url = claim_box.find('form')['action']
-        r = self.s.post(claim_url,
+        r = self.request('POST', claim_url,
                         data={'csrf_token': self.s.csrf_token},
                         headers={ 'Content-Type': 'application/x-www-form-urlencoded'}
                         )
@@ -176,17 +270,21 @@ class ItchUser:
             if self.owns_game_online(game):
                 self.owned_games.append(game)
                 print(f"Game {game.name} has already been claimed (url: {game.url})")
+                return True
             print(f"ERROR: Failed to claim game {game.name} (url: {game.url})")
-        else:
-            self.owned_games.append(game)
-            print(f"Successfully claimed game {game.name} (url: {game.url})")
+            return False
+        self.owned_games.append(game)
+        print(f"Successfully claimed game {game.name} (url: {game.url})")
+        return True
 
     def get_one_library_page(self, page: int):
         """Get one page of the user's library"""
-        r = self.s.get(f"https://itch.io/my-purchases?page={page}&format=json")
+        r = self.request('GET', f"https://itch.io/my-purchases?page={page}&format=json")
         r.encoding = 'utf-8'
-        html = json.loads(r.text)['content']
-        soup = BeautifulSoup(html, 'html.parser')
+        with Profiler.phase('json'):
+            html = json.loads(r.text)['content']
+        with Profiler.phase('html_parse'):
+            soup = BeautifulSoup(html, 'html.parser')
         games_raw = soup.find_all('div', class_="game_cell")
         games = []
         for div in games_raw:
@@ -0,0 +1,126 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Memory usage reports based on tracemalloc snapshots taken at phase boundaries.
+Only memory allocated by Python is traced."""
+
+import atexit
+import threading
+import tracemalloc
+from typing import List, Optional, Tuple
+
+TOP_SITES = 10
+
+enabled = False
+# Take a snapshot after this many calls to tick()
+interval = 25
+# Abort the run when the traced memory exceeds this limit (in bytes)
+max_bytes: Optional[int] = None
+
+_lock = threading.Lock()
+_ticks = 0
+# label, current, peak
+_checkpoints: List[Tuple[str, int, int]] = []
+# The snapshot with the most memory allocated
+_largest: Optional[Tuple[str, int, tracemalloc.Snapshot]] = None
+
+class MemoryBudgetExceeded(SystemExit):
+    """Raised when the traced memory exceeds --max_memory.
+    Subclass of SystemExit, so it isn't swallowed by the error handling of the crawlers."""
+
+def start(snapshot_interval: int = 25, max_memory: float = None):
+    """Start tracing memory allocations
+
+    Args:
+        snapshot_interval (int): Take a snapshot after this many sale pages
+        max_memory (float): Abort if the traced memory exceeds this limit (in MiB)"""
+    global enabled, interval, max_bytes
+    enabled = True
+    interval = max(snapshot_interval, 1)
+    if max_memory is not None:
+        max_bytes = int(max_memory * 1024 * 1024)
+    tracemalloc.start()
+    atexit.register(print_report)
+
+def mib(size: int) -> str:
+    return f'{size / 1024 / 1024:.1f} MiB'
+
+def checkpoint(label: str):
+    """Take a snapshot at a phase boundary"""
+    global _largest
+    if not enabled:
+        return
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    with _lock:
+        _checkpoints.append((label, current, peak))
+        if _largest is None or current > _largest[1]:
+            _largest = (label, current, snapshot)
+    print(f'Memory {label}: {mib(current)} (peak: {mib(peak)})')
+    check(label)
+
+def tick(label: str):
+    """Called after each unit of work (e.g. a sale page).
+    Takes a snapshot every `interval` calls, checks the memory limit otherwise."""
+    global _ticks
+    if not enabled:
+        return
+    with _lock:
+        _ticks += 1
+        due = _ticks % interval == 0
+    if due:
+        checkpoint(label)
+    else:
+        check(label)
+
+def check(label: str):
+    """Abort the run if the memory limit has been exceeded"""
+    if not enabled or max_bytes is None:
+        return
+    current, _ = tracemalloc.get_traced_memory()
+    if current <= max_bytes:
+        return
+    print(f'Memory limit of {mib(max_bytes)} exceeded {label}: {mib(current)} is in use.')
+    print_top_sites(tracemalloc.take_snapshot())
+    raise MemoryBudgetExceeded(1)
+
+def print_top_sites(snapshot: tracemalloc.Snapshot):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+    print(f'Top {TOP_SITES} allocation sites:')
+    for stat in snapshot.statistics('lineno')[:TOP_SITES]:
+        frame = stat.traceback[0]
+        print(f'  {mib(stat.size):>12} {stat.count:>9} blocks  {frame.filename}:{frame.lineno}')
+
+def print_report():
+    if not enabled:
+        return
+    _, peak = tracemalloc.get_traced_memory()
+    print('\nMemory usage at checkpoints:')
+    for label, current, checkpoint_peak in _checkpoints:
+        print(f'  {label}: {mib(current)} (peak so far: {mib(checkpoint_peak)})')
+    print(f'Peak traced memory: {mib(peak)}')
+    if _largest is not None:
+        print(f'Largest snapshot was taken {_largest[0]}.')
+        print_top_sites(_largest[2])
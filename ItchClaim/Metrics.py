@@ -0,0 +1,187 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Counters and histograms collected during a run.
+Exported as a JSON summary and as a Prometheus textfile collector file."""
+
+import atexit
+import bisect
+import json
+import os
+import threading
+from time import time
+from typing import Dict, List, Tuple
+
+# name: (type, help text)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests sent, by endpoint class and status code'),
+    'http_request_duration_seconds': ('histogram', 'Latency of HTTP requests, by endpoint class'),
+    'http_response_bytes_total': ('counter', 'Bytes received in response bodies, by endpoint class'),
+    'http_retries_total': ('counter', 'Requests retried after a connection error or a 429/5xx response, by endpoint class'),
+    'circuit_breaker_opened_total': ('counter', 'Circuit breakers opened after consecutive failures, by host class'),
+    'sale_pages_deferred_total': ('counter', 'Sale pages deferred to a later retry, because their hosts were failing'),
+    'http_not_found_total': ('counter', 'Responses with HTTP 404, by endpoint class'),
+    'cloudflare_challenges_total': ('counter', 'Cloudflare challenges solved using FlareSolverr'),
+    'cloudflare_solve_duration_seconds': ('histogram', 'Time spent solving Cloudflare challenges'),
+    'sale_pages_total': ('counter', 'Sale pages processed, by result'),
+    'sale_feed_pages_total': ('counter', 'Pages of the sale feeds processed, by category'),
+    'coalesced_requests_total': ('counter', 'Sale page and data.json fetches served by another call of the same run, by kind'),
+    'work_shed_total': ('counter', 'Units of work left to the next run because of --deadline, by kind'),
+    'games_saved_total': ('counter', 'Game files written to the disk'),
+    'game_saves_skipped_total': ('counter', 'Saves of games skipped, because their content has not changed'),
+    'run_duration_seconds': ('gauge', 'Wall-clock duration of the command'),
+    'run_finished_timestamp_seconds': ('gauge', 'Unix timestamp of the end of the command'),
+}
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf')]
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    def __init__(self):
+        self.counts: List[int] = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating linearly inside the matching bucket
+        (the same way as Prometheus' histogram_quantile())"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if BUCKETS[i] != float('inf') else lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-2]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = {}
+_histograms: Dict[Tuple[str, Labels], Histogram] = {}
+_started = time()
+
+def inc(name: str, value: float = 1, **labels):
+    """Increment a counter"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name: str, value: float, **labels):
+    """Add an observation to a histogram"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(value)
+
+def summary() -> dict:
+    """Returns every metric collected so far in a JSON serializable form"""
+    with _lock:
+        counters = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(_counters.items()) ]
+        histograms = [
+            {
+                'name': name,
+                'labels': dict(labels),
+                'count': hist.count,
+                'sum': round(hist.sum, 3),
+                'p50': round(hist.quantile(0.5), 3),
+                'p90': round(hist.quantile(0.9), 3),
+                'p99': round(hist.quantile(0.99), 3),
+            } for (name, labels), hist in sorted(_histograms.items()) ]
+    return {
+        'started': int(_started),
+        'duration': round(time() - _started, 3),
+        'counters': counters,
+        'histograms': histograms,
+    }
+
+def format_labels(labels: Labels, **extra) -> str:
+    labels = [*labels, *extra.items()]
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join([ f'{key}="{value}"' for key, value in labels ]) + '}'
+
+def prometheus(command: str) -> str:
+    """Returns every metric in the Prometheus text exposition format"""
+    common = (('command', command),)
+    gauges = {
+        ('run_duration_seconds', ()): time() - _started,
+        ('run_finished_timestamp_seconds', ()): time(),
+    }
+    lines = []
+    with _lock:
+        for metric, (metric_type, help_text) in METRICS.items():
+            full_name = f'itchclaim_{metric}'
+            if metric_type == 'histogram':
+                series = [ (labels, hist) for (name, labels), hist in sorted(_histograms.items())
+                          if name == metric ]
+            else:
+                values = _counters if metric_type == 'counter' else gauges
+                series = [ (labels, value) for (name, labels), value in sorted(values.items())
+                          if name == metric ]
+            if len(series) == 0:
+                continue
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            for labels, value in series:
+                labels = common + labels
+                if metric_type != 'histogram':
+                    lines.append(f'{full_name}{format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, value.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f'{full_name}_bucket{format_labels(labels, le=le)} {cumulative}')
+                lines.append(f'{full_name}_sum{format_labels(labels)} {value.sum}')
+                lines.append(f'{full_name}_count{format_labels(labels)} {value.count}')
+    return '\n'.join(lines) + '\n'
+
+def write_atomic(path: str, content: str):
+    """Write a file by renaming a temporary file, so readers never see partial content"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def export(metrics_dir: str, command: str):
+    """Write the collected metrics to itchclaim_<command>.json and itchclaim_<command>.prom"""
+    os.makedirs(metrics_dir, exist_ok=True)
+    basename = os.path.join(metrics_dir, f'itchclaim_{command}')
+    write_atomic(f'{basename}.json', json.dumps({'command': command, **summary()}, indent=2))
+    write_atomic(f'{basename}.prom', prometheus(command))
+    print(f'Metrics written to {basename}.json and {basename}.prom')
+
+def export_at_exit(metrics_dir: str, command: str):
+    """Export the metrics when the command finishes, even if it's aborted with exit()"""
+    atexit.register(export, metrics_dir, command)
@@ -0,0 +1,136 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""cProfile integration and wall-clock timers for the phases of a run.
+
+Phases are timed exclusively: time spent in a nested phase (for example solving a
+Cloudflare challenge while waiting for the network) only counts towards the inner one.
+Phases of different threads are added together, so they may exceed the wall-clock time."""
+
+import atexit
+import cProfile
+import pstats
+import sys
+import threading
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Dict
+
+PHASE_NAMES = {
+    'network': 'Network wait',
+    'flaresolverr': 'FlareSolverr',
+    'html_parse': 'HTML parse',
+    'json': 'JSON encode/decode',
+    'disk_io': 'Disk I/O',
+    'generate_web': 'Website generation',
+}
+
+enabled = False
+_lock = threading.Lock()
+_totals: Dict[str, float] = {}
+_local = threading.local()
+_started = perf_counter()
+# The profiles of the threads started after start(), merged into the main one at exit
+_thread_profiles = []
+
+@contextmanager
+def _timed_phase(name: str):
+    stack = _local.__dict__.setdefault('stack', [])
+    now = perf_counter()
+    if stack:
+        _add(stack[-1][0], now - stack[-1][1])
+    stack.append([name, now])
+    try:
+        yield
+    finally:
+        now = perf_counter()
+        _add(name, now - stack.pop()[1])
+        if stack:
+            # Resume the timer of the outer phase
+            stack[-1][1] = now
+
+def _add(name: str, seconds: float):
+    with _lock:
+        _totals[name] = _totals.get(name, 0) + seconds
+
+def phase(name: str):
+    """Time a block of code as part of a phase. Does nothing if profiling is disabled.
+
+    Usage:
+        with Profiler.phase('disk_io'):
+            f.write(data)"""
+    if not enabled:
+        return nullcontext()
+    return _timed_phase(name)
+
+def report() -> str:
+    """Returns a table of the time spent in each phase"""
+    wall = perf_counter() - _started
+    with _lock:
+        totals = dict(_totals)
+    lines = [f'{"Phase":<22}{"Seconds":>10}{"Share":>8}']
+    for name, seconds in sorted(totals.items(), key=lambda a: -a[1]):
+        label = PHASE_NAMES.get(name, name)
+        lines.append(f'{label:<22}{seconds:>10.2f}{seconds / wall:>8.1%}')
+    other = wall - sum(totals.values())
+    lines.append(f'{"Other":<22}{other:>10.2f}{other / wall:>8.1%}')
+    lines.append(f'{"Total (wall-clock)":<22}{wall:>10.2f}')
+    return '\n'.join(lines)
+
+def _profile_thread(frame, event, arg):
+    """Called by the first event of every new thread: profiles the thread on its own.
+    Enabling the profile replaces this hook for the rest of the thread."""
+    profile = cProfile.Profile()
+    with _lock:
+        _thread_profiles.append(profile)
+    profile.enable()
+
+def start(pstats_path: str):
+    """Profile the rest of the run with cProfile, including the worker threads, and enable
+    phase timers. The profile is written to the disk and the phase breakdown is printed at exit."""
+    global enabled, _started
+    enabled = True
+    _started = perf_counter()
+    profile = cProfile.Profile()
+    # Before Python 3.12, cProfile only sees the thread that has enabled it
+    if sys.version_info < (3, 12):
+        threading.setprofile(_profile_thread)
+
+    def stop():
+        profile.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(profile)
+        with _lock:
+            thread_profiles = list(_thread_profiles)
+        for thread_profile in thread_profiles:
+            try:
+                stats.add(thread_profile)
+            except TypeError:
+                # The thread hasn't called any functions
+                pass
+        stats.dump_stats(pstats_path)
+        print('\nTime spent in each phase:')
+        print(report())
+        print(f'cProfile statistics written to {pstats_path}')
+
+    atexit.register(stop)
+    profile.enable()
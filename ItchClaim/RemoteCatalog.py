@@ -0,0 +1,144 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Local copy of the active and upcoming sales of the remote cache.
+
+The copy is kept up to date with the change feed published by generate_web
+(api/changes/latest.json and api/changes/<seq>.json), so only the changes since the
+last run are downloaded. The whole lists are only downloaded the first time, or when
+the copy is too far behind the feed."""
+
+import hashlib
+import json
+import os
+from time import time
+from typing import List, Optional
+
+from . import Profiler
+from .CfWrapper import CfWrapper
+from .ItchSale import is_active, is_upcoming
+from .ItchUser import ItchUser
+
+LISTS = ('active.json', 'upcoming.json')
+# Download the whole lists instead, if more changes are needed to catch up
+MAX_CHANGES_TO_FOLLOW = 20
+
+requests = CfWrapper()
+
+def cache_path(api_url: str) -> str:
+    """The location of the local copy of the remote cache at api_url"""
+    # Under the users directory, so it's kept in the volume of the Docker image
+    cache_dir = os.path.join(ItchUser.get_users_dir(), 'remote_cache')
+    return os.path.join(cache_dir, hashlib.sha1(api_url.encode('utf-8')).hexdigest()[:16] + '.json')
+
+def load(api_url: str) -> Optional[dict]:
+    try:
+        with open(cache_path(api_url), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save(api_url: str, state: dict):
+    path = cache_path(api_url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
+
+def download_json(url: str):
+    """Returns None if the file doesn't exist"""
+    r = requests.get(url, timeout=32)
+    if r.status_code == 404:
+        return None
+    r.raise_for_status()
+    with Profiler.phase('json'):
+        return json.loads(r.text)
+
+def sync(api_url: str, full: bool = False) -> Optional[dict]:
+    """Update the local copy of the remote cache
+
+    Args:
+        api_url (str): The URL of the api directory of the remote cache
+        full (bool): Discard the local copy and download the whole lists
+
+    Returns:
+        Optional[dict]: The local copy, None if the remote cache has no change feed"""
+    state = None if full else load(api_url)
+    headers = {}
+    if state is not None and 'etag' in state:
+        headers['If-None-Match'] = state['etag']
+    r = requests.get(f'{api_url}/changes/latest.json', headers=headers, timeout=32)
+    if r.status_code == 404:
+        return None
+    r.raise_for_status()
+    if r.status_code == 304:
+        return state
+    with Profiler.phase('json'):
+        latest = json.loads(r.text)
+
+    if state is not None and state.get('feed') != latest['feed']:
+        state = None
+    elif state is not None and state['seq'] != latest['seq']:
+        seq = state['seq']
+        if latest['oldest'] <= seq + 1 and latest['seq'] - seq <= MAX_CHANGES_TO_FOLLOW:
+            state = follow_changes(api_url, state, latest['seq'])
+        else:
+            state = None
+    if state is None:
+        print('Downloading the lists of the remote cache')
+        state = {'games': {}}
+        for list_name in LISTS:
+            for game in download_json(f'{api_url}/{list_name}') or []:
+                state['games'][str(game['id'])] = game
+
+    # Forget the games without active or upcoming sales
+    now = time()
+    state['games'] = { id: game for id, game in state['games'].items()
+        if any(sale['end'] > now for sale in game['sales']) }
+    state['feed'] = latest['feed']
+    state['seq'] = latest['seq']
+    if 'ETag' in r.headers:
+        state['etag'] = r.headers['ETag']
+    save(api_url, state)
+    return state
+
+def follow_changes(api_url: str, state: dict, latest_seq: int) -> Optional[dict]:
+    """Apply the changes after the sequence number of the local copy.
+    Returns None if a change is missing."""
+    print(f'Downloading {latest_seq - state["seq"]} changes of the remote cache')
+    for seq in range(state['seq'] + 1, latest_seq + 1):
+        changes = download_json(f'{api_url}/changes/{seq}.json')
+        if changes is None:
+            # Deleted since latest.json was downloaded
+            return None
+        for game in changes['upserted']:
+            state['games'][str(game['id'])] = game
+        for game_id in changes['removed']:
+            state['games'].pop(str(game_id), None)
+    return state
+
+def select(state: dict, list_name: str) -> List[dict]:
+    """Returns the games of the local copy that would be in the given list now"""
+    now = time()
+    if list_name == 'active.json':
+        return [ game for game in state['games'].values() if is_active(game['sales'], now) ]
+    return [ game for game in state['games'].values() if is_upcoming(game['sales'], now) ]
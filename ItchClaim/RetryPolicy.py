@@ -0,0 +1,171 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Retry policy of the HTTP requests: a deadline for each request (including its retries),
+a retry budget for the whole run, and a circuit breaker for each class of hosts.
+
+A circuit breaker opens after several consecutive failures of its hosts. While it's open,
+requests to those hosts fail immediately with CircuitOpenError, so their work can be
+deferred without slowing down the requests sent to the healthy hosts. After a cooldown
+one request is let through: if it succeeds, the breaker closes again."""
+
+import threading
+from time import monotonic
+from typing import Dict
+from urllib.parse import urlparse
+
+import requests
+
+from . import Metrics
+
+# Responses with these status codes are retried
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Methods that are safe to send again after the server has received them
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# Give up retrying a request after this many seconds
+request_deadline = 120.0
+# Requests sent near the end of the run's --deadline still get this much time
+min_request_deadline = 10.0
+max_retries = 5
+backoff_factor = 2
+max_backoff = 30
+
+def host_class(url: str) -> str:
+    """Returns the class of the host of an itch.io URL:
+    main (itch.io), game (subdomains of itch.io) or cdn (everything else, e.g. file downloads)"""
+    host = urlparse(url).hostname or ''
+    if host in ('itch.io', 'www.itch.io'):
+        return 'main'
+    if host.endswith('.itch.io') and not host.startswith('cdn.'):
+        return 'game'
+    return 'cdn'
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit breaker is open"""
+    def __init__(self, breaker: 'CircuitBreaker'):
+        super().__init__(f'Too many failed requests to {breaker.name} hosts, '
+                         + f'retrying in {max(breaker.retry_at - monotonic(), 0):.0f} seconds')
+        self.breaker = breaker
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 10, cooldown: float = 30, max_cooldown: float = 600):
+        """
+        Args:
+            name (str): The class of the hosts
+            failure_threshold (int): Open the breaker after this many consecutive failures
+            cooldown (float): Let a request through after this many seconds
+            max_cooldown (float): The cooldown is doubled after each failed trial, up to this limit"""
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open = False
+        self.retry_at = 0.0
+        self.trial_running = False
+
+    def before_request(self):
+        """Raises CircuitOpenError if the request can't be sent now"""
+        with self.lock:
+            if not self.open:
+                return
+            if monotonic() < self.retry_at or self.trial_running:
+                raise CircuitOpenError(self)
+            # Half-open: let this request through as a trial
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            if self.open:
+                print(f'Requests to {self.name} hosts are succeeding again')
+            self.failures = 0
+            self.open = False
+            self.trial_running = False
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running:
+                self.trial_running = False
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.open or self.failures < self.failure_threshold:
+                return
+            else:
+                print(f'{self.failures} requests to {self.name} hosts have failed in a row, '
+                      + f'pausing requests to them for {self.cooldown:.0f} seconds')
+                Metrics.inc('circuit_breaker_opened_total', host=self.name)
+            self.open = True
+            self.retry_at = monotonic() + self.cooldown
+
+    def wait_time(self) -> float:
+        """Seconds until a trial request can be sent"""
+        with self.lock:
+            return max(self.retry_at - monotonic(), 0) if self.open else 0
+
+class RetryBudget:
+    def __init__(self, retries: int):
+        """Limits the number of retries in a run, so a failing site can't stall the whole run
+
+        Args:
+            retries (int): The number of retries allowed. -1 means unlimited"""
+        self.remaining = retries
+        self.lock = threading.Lock()
+        self.exhausted_reported = False
+
+    def take(self) -> bool:
+        """Returns True if a retry can be sent"""
+        with self.lock:
+            if self.remaining == -1:
+                return True
+            if self.remaining == 0:
+                if not self.exhausted_reported:
+                    print('The retry budget of the run has been exhausted. Failed requests are not retried anymore.')
+                    self.exhausted_reported = True
+                return False
+            self.remaining -= 1
+            return True
+
+breakers: Dict[str, CircuitBreaker] = { name: CircuitBreaker(name) for name in ('main', 'game', 'cdn') }
+budget = RetryBudget(500)
+
+def breaker_for(url: str) -> CircuitBreaker:
+    return breakers[host_class(url)]
+
+def backoff(attempt: int, response: requests.Response = None) -> float:
+    """Seconds to wait before the given retry. Honors the Retry-After header."""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), max_backoff)
+    return min(backoff_factor * 2 ** (attempt - 1), max_backoff)
+
+def is_retryable(method: str, response: requests.Response = None, error: Exception = None) -> bool:
+    if error is not None:
+        if method.upper() in IDEMPOTENT_METHODS:
+            return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        # The server may have received the request already, unless the connection has failed
+        return isinstance(error, requests.exceptions.ConnectionError)
+    return response.status_code in RETRY_STATUSES and method.upper() in IDEMPOTENT_METHODS
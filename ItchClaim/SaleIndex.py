@@ -0,0 +1,377 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Secondary indexes of the games directory, used by the query command.
+
+The index file (sale_index.bin) contains:
+ - the sales as sorted arrays by their start, and a permutation of them sorted by their end
+ - an inverted index of the normalized tokens of the names of games
+ - bitmaps of the claimable and not claimable games
+
+Once the index file exists, save_to_disk() appends every saved game to a log (sale_index.log),
+which is applied on top of the index file when it's opened. The log is merged into the index file once it's long.
+
+File format: MAGIC, the sections, then a JSON table of the sections, and a footer
+(offset and length of the table, MAGIC)."""
+
+import array
+import bisect
+import json
+import os
+import re
+import struct
+import threading
+import unicodedata
+from datetime import datetime
+from time import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+INDEX_FILENAME = 'sale_index.bin'
+LOG_FILENAME = 'sale_index.log'
+# Merge the log into the index file when it has more lines than this
+MAX_LOG_LINES = 2000
+
+MAGIC = b'ITCHIDX1'
+FOOTER = struct.Struct('<QQ8s')
+
+_lock = threading.Lock()
+
+def tokenize(name: Optional[str]) -> List[str]:
+    """Split a name into lowercase tokens, without accents"""
+    if not name:
+        return []
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return re.findall(r'\w+', name.lower())
+
+def parse_time(value) -> Optional[float]:
+    """Parse a time given on the command line: a unix timestamp, an ISO 8601 date
+    (local time if it has no timezone), 'now', or relative to now (e.g. +6h, -30d)"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = str(value).strip()
+    if value == 'now':
+        return time()
+    match = re.fullmatch(r'([+-]\d+(?:\.\d+)?)([smhd])', value)
+    if match is not None:
+        return time() + float(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+    return datetime.fromisoformat(value).timestamp()
+
+def to_record(serialized: dict) -> dict:
+    """The part of a serialized game (see ItchGame.serialize()) that is indexed"""
+    return {
+        'id': serialized['id'],
+        'name': serialized['name'],
+        'claimable': serialized['claimable'],
+        'sales': [ [sale['id'], sale['start'], sale['end']] for sale in serialized['sales'] ],
+    }
+
+def record(games_dir: str, serialized: dict):
+    """Append a saved game to the log of the index. Nothing is logged until the index
+    has been built, since building it reads every game anyway."""
+    if not os.path.exists(os.path.join(games_dir, INDEX_FILENAME)):
+        return
+    line = json.dumps(to_record(serialized)) + '\n'
+    with _lock:
+        with open(os.path.join(games_dir, LOG_FILENAME), 'a', encoding='utf-8') as f:
+            f.write(line)
+
+class SaleIndex:
+    def __init__(self, games_dir: str):
+        """An empty index. Use open() to load the index of a directory."""
+        self.games_dir = games_dir
+        # Games, ordered by ID
+        self.game_ids = array.array('q')
+        self.names: Optional[List[str]] = None
+        self.names_raw = b'[]'
+        # Bitmaps of the games, by their position in game_ids
+        self.claimable = bytearray()
+        self.not_claimable = bytearray()
+        # Sales, ordered by start
+        self.sale_starts = array.array('q')
+        self.sale_ends = array.array('q')
+        self.sale_ids = array.array('q')
+        self.sale_games = array.array('i')
+        # Positions of the sales, ordered by end, and their ends in the same order
+        self.end_order = array.array('i')
+        self.ends_sorted = array.array('q')
+        # Positions of the sales, grouped by game
+        self.game_sale_offsets = array.array('i')
+        self.game_sales = array.array('i')
+        # Sorted tokens, and the positions of the games containing them
+        self.tokens: List[str] = []
+        self.posting_offsets = array.array('i')
+        self.postings = array.array('i')
+        # Games saved since the index file was written, by ID
+        self.overlay: Dict[int, dict] = {}
+        self.log_lines = 0
+
+    # ======= Loading and saving =======
+
+    @classmethod
+    def open(cls, games_dir: str) -> Optional['SaleIndex']:
+        """Load the index of a directory, None if it hasn't been built yet"""
+        self = SaleIndex(games_dir)
+        try:
+            with open(os.path.join(games_dir, INDEX_FILENAME), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        table_offset, table_length, magic = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+        if magic != MAGIC or data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{INDEX_FILENAME} is not an index file')
+        table = json.loads(data[table_offset:table_offset + table_length])
+        for name, (typecode, offset, length) in table['arrays'].items():
+            values = array.array(typecode)
+            values.frombytes(data[offset:offset + length])
+            setattr(self, name, values)
+        self.tokens = table['tokens']
+        offset, length = table['names']
+        self.names_raw = data[offset:offset + length]
+        self.claimable = data[slice(*table['claimable'])]
+        self.not_claimable = data[slice(*table['not_claimable'])]
+        self.load_log()
+        return self
+
+    def load_log(self):
+        """Apply the log on top of the index file. The log being merged by another
+        process (see compact()) is applied first."""
+        for filename in (f'{LOG_FILENAME}.merging', LOG_FILENAME):
+            try:
+                with open(os.path.join(self.games_dir, filename), 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                continue
+            for line in lines:
+                try:
+                    game = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete, if it's still being written
+                    continue
+                self.overlay[game['id']] = game
+            self.log_lines += len(lines)
+
+    @staticmethod
+    def build(games_dir: str, records: Iterable[dict]) -> 'SaleIndex':
+        """Write the index file of a directory
+
+        Args:
+            games_dir (str): The games directory
+            records (Iterable[dict]): Every game, see to_record()"""
+        self = SaleIndex(games_dir)
+        games = sorted(records, key=lambda game: game['id'])
+        self.game_ids = array.array('q', (game['id'] for game in games))
+        names = [ game['name'] or '' for game in games ]
+        self.names_raw = json.dumps(names).encode('utf-8')
+
+        self.claimable = bytearray((len(games) + 7) // 8)
+        self.not_claimable = bytearray((len(games) + 7) // 8)
+        sales: List[Tuple[int, int, int, int]] = []
+        postings: Dict[str, List[int]] = {}
+        for row, game in enumerate(games):
+            if game['claimable'] is True:
+                self.claimable[row >> 3] |= 1 << (row & 7)
+            elif game['claimable'] is False:
+                self.not_claimable[row >> 3] |= 1 << (row & 7)
+            for sale_id, start, end in game['sales']:
+                sales.append((start, end, sale_id, row))
+            for token in set(tokenize(game['name'])):
+                postings.setdefault(token, []).append(row)
+
+        sales.sort()
+        self.sale_starts = array.array('q', (sale[0] for sale in sales))
+        self.sale_ends = array.array('q', (sale[1] for sale in sales))
+        self.sale_ids = array.array('q', (sale[2] for sale in sales))
+        self.sale_games = array.array('i', (sale[3] for sale in sales))
+        self.end_order = array.array('i', sorted(range(len(sales)), key=lambda i: sales[i][1]))
+        self.ends_sorted = array.array('q', (sales[i][1] for i in self.end_order))
+        sales_by_row: List[List[int]] = [ [] for _ in games ]
+        for i, sale in enumerate(sales):
+            sales_by_row[sale[3]].append(i)
+        for positions in sales_by_row:
+            self.game_sale_offsets.append(len(self.game_sales))
+            self.game_sales.extend(positions)
+        self.game_sale_offsets.append(len(self.game_sales))
+
+        self.tokens = sorted(postings.keys())
+        for token in self.tokens:
+            self.posting_offsets.append(len(self.postings))
+            self.postings.extend(postings[token])
+        self.posting_offsets.append(len(self.postings))
+        self.write()
+        return self
+
+    def write(self):
+        sections = [MAGIC]
+        offset = len(MAGIC)
+        def add(content: bytes) -> List[int]:
+            nonlocal offset
+            sections.append(content)
+            offset += len(content)
+            return [offset - len(content), offset]
+
+        table = {'arrays': {}, 'tokens': self.tokens}
+        for name in ('game_ids', 'sale_starts', 'sale_ends', 'sale_ids', 'sale_games',
+                     'end_order', 'ends_sorted', 'game_sale_offsets', 'game_sales',
+                     'posting_offsets', 'postings'):
+            values: array.array = getattr(self, name)
+            start, end = add(values.tobytes())
+            table['arrays'][name] = [values.typecode, start, end - start]
+        start, end = add(self.names_raw)
+        table['names'] = [start, end - start]
+        table['claimable'] = add(bytes(self.claimable))
+        table['not_claimable'] = add(bytes(self.not_claimable))
+        table_raw = json.dumps(table).encode('utf-8')
+        table_offset = offset
+        add(table_raw)
+        sections.append(FOOTER.pack(table_offset, len(table_raw), MAGIC))
+
+        path = os.path.join(self.games_dir, INDEX_FILENAME)
+        with open(f'{path}.tmp', 'wb') as f:
+            f.writelines(sections)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{path}.tmp', path)
+
+    def compact(self) -> 'SaleIndex':
+        """Merge the log into the index file. Games saved meanwhile are written to a new log."""
+        log_path = os.path.join(self.games_dir, LOG_FILENAME)
+        merging_path = f'{log_path}.merging'
+        with _lock:
+            if os.path.exists(log_path):
+                os.replace(log_path, merging_path)
+        # Read again, in case the log has been extended since it was opened
+        self.overlay.clear()
+        self.load_log()
+        index = SaleIndex.build(self.games_dir, self.records())
+        if os.path.exists(merging_path):
+            os.remove(merging_path)
+        index.load_log()
+        return index
+
+    def records(self) -> Iterable[dict]:
+        """Every game of the index, see to_record()"""
+        for row, game_id in enumerate(self.game_ids):
+            if game_id in self.overlay:
+                continue
+            positions = self.game_sales[self.game_sale_offsets[row]:self.game_sale_offsets[row + 1]]
+            yield {
+                'id': game_id,
+                'name': self.name(row),
+                'claimable': self.claimability(row),
+                'sales': [ [self.sale_ids[i], self.sale_starts[i], self.sale_ends[i]] for i in positions ],
+            }
+        yield from self.overlay.values()
+
+    # ======= Queries =======
+
+    def name(self, row: int) -> str:
+        if self.names is None:
+            self.names = json.loads(self.names_raw)
+        return self.names[row]
+
+    def claimability(self, row: int) -> Optional[bool]:
+        if self.claimable[row >> 3] >> (row & 7) & 1:
+            return True
+        if self.not_claimable[row >> 3] >> (row & 7) & 1:
+            return False
+        return None
+
+    def rows_with_name(self, name: str) -> Set[int]:
+        """Positions of the games that have a token starting with every token of name"""
+        rows: Optional[Set[int]] = None
+        for token in tokenize(name):
+            matches = set()
+            i = bisect.bisect_left(self.tokens, token)
+            while i < len(self.tokens) and self.tokens[i].startswith(token):
+                matches.update(self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]])
+                i += 1
+            rows = matches if rows is None else rows & matches
+        return rows if rows is not None else set(range(len(self.game_ids)))
+
+    def query(self,
+            starts_after: float = None,
+            starts_before: float = None,
+            ends_after: float = None,
+            ends_before: float = None,
+            name: str = None,
+            claimable: Optional[bool] = ...) -> List[Tuple[int, str, Optional[bool], list]]:
+        """Find sales
+
+        Args:
+            starts_after, starts_before, ends_after, ends_before (float): Bounds of the start
+                and the end of the sales (unix timestamps), None if unbounded
+            name (str): Only games that have a word starting with each word of this
+            claimable (Optional[bool]): Only games with this claimability (None is unknown),
+                every game if not given
+
+        Returns:
+            List[Tuple[int, str, Optional[bool], list]]: The ID, name and claimability of the
+                games, and their matching sales ([id, start, end]), ordered by the first sale"""
+        def in_range(value: int, after: Optional[float], before: Optional[float]) -> bool:
+            return (after is None or value >= after) and (before is None or value < before)
+
+        # Sales in the index file. Only the smallest set of candidates is iterated, the
+        # other conditions are checked for each of them.
+        first = 0 if starts_after is None else bisect.bisect_left(self.sale_starts, starts_after)
+        last = len(self.sale_starts) if starts_before is None else bisect.bisect_left(self.sale_starts, starts_before)
+        positions: Iterable[int] = range(first, last)
+        first = 0 if ends_after is None else bisect.bisect_left(self.ends_sorted, ends_after)
+        last = len(self.ends_sorted) if ends_before is None else bisect.bisect_left(self.ends_sorted, ends_before)
+        if last - first < len(positions):
+            positions = self.end_order[first:last]
+        rows = None if name is None else self.rows_with_name(name)
+        if rows is not None and len(rows) < len(positions):
+            positions = [ i for row in rows
+                for i in self.game_sales[self.game_sale_offsets[row]:self.game_sale_offsets[row + 1]] ]
+
+        results: Dict[int, Tuple[int, str, Optional[bool], list]] = {}
+        for i in positions:
+            row = self.sale_games[i]
+            end = self.sale_ends[i]
+            if not in_range(self.sale_starts[i], starts_after, starts_before) or not in_range(end, ends_after, ends_before):
+                continue
+            if rows is not None and row not in rows:
+                continue
+            game_id = self.game_ids[row]
+            if game_id in self.overlay:
+                continue
+            if claimable is not ... and self.claimability(row) is not claimable:
+                continue
+            if game_id not in results:
+                results[game_id] = (game_id, self.name(row), self.claimability(row), [])
+            results[game_id][3].append([self.sale_ids[i], self.sale_starts[i], end])
+
+        # Games saved since the index file was written
+        name_tokens = tokenize(name)
+        for game in self.overlay.values():
+            if claimable is not ... and game['claimable'] is not claimable:
+                continue
+            game_tokens = tokenize(game['name'])
+            if not all(any(t.startswith(token) for t in game_tokens) for token in name_tokens):
+                continue
+            sales = [ sale for sale in game['sales']
+                if in_range(sale[1], starts_after, starts_before) and in_range(sale[2], ends_after, ends_before) ]
+            if len(sales) > 0:
+                results[game['id']] = (game['id'], game['name'], game['claimable'], sales)
+
+        return sorted(results.values(), key=lambda result: (result[3][0][1], result[0]))
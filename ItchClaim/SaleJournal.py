@@ -0,0 +1,202 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Crash-safe journal of the sale pages processed by get_all_sales().
+
+Each processed sale ID is appended to the journal as a line, prefixed by its state:
+ - C: completed (the sale page has been saved, or it was deleted on itch.io)
+ - N: not found (404 without redirection, the sale doesn't exist yet)
+ - F: failed (an error has occurred, the page has to be downloaded again)
+The last line of an ID overrides the previous ones. Consecutive IDs with the same state
+are written as ranges (e.g. "C 100-200") when the journal is compacted.
+
+New lines are kept in memory until the next sync, which flushes the pending game files
+first. This way a sale is never marked as completed before its games are on the disk."""
+
+import bisect
+import os
+import threading
+from time import monotonic
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import WriteBuffer
+
+JOURNAL_FILENAME = 'sale_journal.log'
+
+COMPLETED = 'C'
+NOT_FOUND = 'N'
+FAILED = 'F'
+
+class IdRanges:
+    """A set of integers, stored as sorted, non-overlapping ranges"""
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect.bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return iter(zip(self.starts, self.ends))
+
+    def add(self, start: int, end: int = None):
+        end = start if end is None else end
+        i = bisect.bisect_left(self.ends, start - 1)
+        j = bisect.bisect_right(self.starts, end + 1)
+        if i < j:
+            # Merge with the overlapping or adjacent ranges
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def discard(self, start: int, end: float = None):
+        """Remove every value between start and end (inclusive)"""
+        end = start if end is None else end
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        if i >= j:
+            return
+        pieces = []
+        if self.starts[i] < start:
+            pieces.append((self.starts[i], start - 1))
+        if self.ends[j - 1] > end:
+            pieces.append((end + 1, self.ends[j - 1]))
+        self.starts[i:j] = [ a for a, _ in pieces ]
+        self.ends[i:j] = [ b for _, b in pieces ]
+
+    def max(self) -> Optional[int]:
+        return self.ends[-1] if self.ends else None
+
+class SaleJournal:
+    def __init__(self,
+            directory: str,
+            fsync_entries: int = 50,
+            fsync_seconds: float = 5,
+            compact_entries: int = 5000):
+        """Open the journal of a games directory, and replay its content
+
+        Args:
+            directory (str): The games directory
+            fsync_entries (int): Sync the journal to the disk after this many entries
+            fsync_seconds (float): Sync the journal to the disk at least this often
+            compact_entries (int): Compact the journal after this many entries"""
+        self.directory = directory
+        self.path = os.path.join(directory, JOURNAL_FILENAME)
+        self.fsync_entries = fsync_entries
+        self.fsync_seconds = fsync_seconds
+        self.compact_entries = compact_entries
+        self.lock = threading.Lock()
+        self.states: Dict[str, IdRanges] = {
+            COMPLETED: IdRanges(),
+            NOT_FOUND: IdRanges(),
+            FAILED: IdRanges(),
+        }
+        self._replay()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.unsynced: List[str] = []
+        self.last_sync = monotonic()
+        self.uncompacted = 0
+
+    def _replay(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                state, ids = line.split()
+                start, _, end = ids.partition('-')
+                self._set(state, int(start), int(end or start))
+            except (ValueError, KeyError):
+                # The last line may be incomplete, if the process was killed while writing it
+                continue
+
+    def _set(self, state: str, start: int, end: int):
+        for other_state, ranges in self.states.items():
+            if other_state != state:
+                ranges.discard(start, end)
+        self.states[state].add(start, end)
+
+    def record(self, sale_id: int, state: str):
+        """Append the state of a sale page to the journal"""
+        with self.lock:
+            self._set(state, sale_id, sale_id)
+            self.unsynced.append(f'{state} {sale_id}\n')
+            self.uncompacted += 1
+            due = (len(self.unsynced) >= self.fsync_entries
+                   or monotonic() - self.last_sync >= self.fsync_seconds)
+        if due:
+            self.sync()
+        if self.uncompacted >= self.compact_entries:
+            self.compact()
+
+    def is_completed(self, sale_id: int) -> bool:
+        with self.lock:
+            return sale_id in self.states[COMPLETED]
+
+    @property
+    def failed(self) -> List[int]:
+        with self.lock:
+            return [ sale_id for start, end in self.states[FAILED] for sale_id in range(start, end + 1) ]
+
+    @property
+    def last_completed(self) -> Optional[int]:
+        with self.lock:
+            return self.states[COMPLETED].max()
+
+    def sync(self):
+        """Flush the journal to the disk, and update the legacy resume index"""
+        WriteBuffer.flush()
+        with self.lock:
+            self.file.writelines(self.unsynced)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = []
+            self.last_sync = monotonic()
+            last_completed = self.states[COMPLETED].max()
+        if last_completed is not None:
+            # Used by generate_web to display the last checked sale
+            with open(os.path.join(self.directory, 'resume_index.txt'), 'w', encoding='utf-8') as f:
+                f.write(str(last_completed))
+
+    def compact(self):
+        """Rewrite the journal, keeping only the current state of each sale as ranges"""
+        self.sync()
+        with self.lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for state, ranges in self.states.items():
+                    for start, end in ranges:
+                        f.write(f'{state} {start}-{end}\n' if start != end else f'{state} {start}\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, 'a', encoding='utf-8')
+            self.uncompacted = 0
+
+    def close(self):
+        self.compact()
+        self.file.close()
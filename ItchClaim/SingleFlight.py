@@ -0,0 +1,104 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Memo that calls a function at most once per key, even with concurrent callers.
+
+Callers asking for a key that is being computed by another thread wait for that result,
+instead of sending the same request again. Exceptions are passed to the waiting callers,
+but they are not remembered, so the next call tries again.
+
+Only the most recent results are remembered, and clear_all() forgets every result at the
+end of a crawl or a claim run, so long-lived processes don't serve stale data."""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List
+
+from . import Metrics
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+_instances: List['SingleFlight'] = []
+
+def clear_all():
+    """Forget the results of every memo"""
+    for instance in _instances:
+        instance.clear()
+
+class SingleFlight:
+    def __init__(self, name: str, max_results: int):
+        """
+        Args:
+            name (str): Used as the label of the metrics
+            max_results (int): The number of results remembered. The least recently used
+                ones are forgotten first."""
+        self.name = name
+        self.max_results = max_results
+        self.lock = threading.Lock()
+        self.results: OrderedDict = OrderedDict()
+        self.calls: Dict[Hashable, _Call] = {}
+        _instances.append(self)
+
+    def clear(self):
+        """Forget every result. Calls in progress are still shared."""
+        with self.lock:
+            self.results.clear()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Returns the result of fn() for the key, calling it only if it hasn't been called yet"""
+        with self.lock:
+            if key in self.results:
+                Metrics.inc('coalesced_requests_total', kind=self.name)
+                self.results.move_to_end(key)
+                return self.results[key]
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+        if not leader:
+            Metrics.inc('coalesced_requests_total', kind=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as ex:
+            call.error = ex
+            raise
+        else:
+            with self.lock:
+                self.results[key] = call.result
+                if len(self.results) > self.max_results:
+                    self.results.popitem(last=False)
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
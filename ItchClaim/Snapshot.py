@@ -0,0 +1,172 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Single-file packed snapshot of the games directory.
+
+Layout of the file:
+ - the magic bytes
+ - the zlib compressed content of each file, one after the other
+ - the offset table: zlib compressed JSON, {"games": [[id, offset, length], ...],
+   "files": {name: [offset, length]}}
+ - footer: the offset and the length of the table, followed by the magic bytes again
+
+A snapshot named catalog.snap inside the games directory is used as a read-only fallback
+for the game files that aren't on the disk, so the catalog doesn't need to be unpacked."""
+
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'ITCHSNP1'
+FOOTER = struct.Struct('<QQ8s')
+SNAPSHOT_FILENAME = 'catalog.snap'
+GAME_FILENAME_RE = re.compile(r'^(\d+)\.json$')
+# Files of the games directory packed along with the games
+STATE_FILES = ['resume_index.txt', 'sale_journal.log', 'sale_frontier.json', 'changes.jsonl']
+
+class SnapshotError(Exception):
+    pass
+
+class Snapshot:
+    def __init__(self, path: str):
+        """Open a snapshot for reading
+
+        Args:
+            path (str): The location of the snapshot"""
+        self.path = path
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            if self.stat.st_size < len(MAGIC) + FOOTER.size:
+                raise SnapshotError(f'{path} is not a snapshot')
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        table_offset, table_length, magic = FOOTER.unpack(self.map[-FOOTER.size:])
+        if magic != MAGIC or self.map[:len(MAGIC)] != MAGIC:
+            self.map.close()
+            raise SnapshotError(f'{path} is not a snapshot')
+        table = json.loads(zlib.decompress(self.map[table_offset:table_offset + table_length]))
+        # Sorted by ID, for binary search
+        games = sorted(table['games'])
+        self.ids: List[int] = [ game[0] for game in games ]
+        self.locations: List[Tuple[int, int]] = [ (game[1], game[2]) for game in games ]
+        self.files: Dict[str, Tuple[int, int]] = { name: tuple(location) for name, location in table['files'].items() }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, game_id: int) -> bool:
+        i = bisect.bisect_left(self.ids, game_id)
+        return i < len(self.ids) and self.ids[i] == game_id
+
+    def _read(self, location: Tuple[int, int]) -> str:
+        offset, length = location
+        return zlib.decompress(self.map[offset:offset + length]).decode('utf-8')
+
+    def read_game(self, game_id: int) -> Optional[str]:
+        """Returns the JSON content of a game, or None if it's not in the snapshot"""
+        i = bisect.bisect_left(self.ids, game_id)
+        if i == len(self.ids) or self.ids[i] != game_id:
+            return None
+        return self._read(self.locations[i])
+
+    def read_file(self, name: str) -> Optional[str]:
+        """Returns the content of a packed file by its name (e.g. `123.json` or `resume_index.txt`)"""
+        match = GAME_FILENAME_RE.match(name)
+        if match:
+            return self.read_game(int(match.group(1)))
+        if name in self.files:
+            return self._read(self.files[name])
+        return None
+
+    def games(self) -> Iterator[Tuple[int, str]]:
+        """Iterate over the games in the order they are stored in the file"""
+        for game_id, location in sorted(zip(self.ids, self.locations), key=lambda a: a[1][0]):
+            yield game_id, self._read(location)
+
+    def close(self):
+        self.map.close()
+
+_lock = threading.Lock()
+_open: Dict[str, Snapshot] = {}
+
+def for_directory(games_dir: str) -> Optional[Snapshot]:
+    """Returns the snapshot of a games directory, or None if it doesn't have one.
+    The snapshot is reopened if the file has been replaced."""
+    path = os.path.join(games_dir, SNAPSHOT_FILENAME)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    with _lock:
+        snapshot = _open.get(path)
+        if snapshot is not None and (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns):
+            return snapshot
+        if snapshot is not None:
+            snapshot.close()
+        snapshot = Snapshot(path)
+        _open[path] = snapshot
+        return snapshot
+
+def close_all():
+    with _lock:
+        for snapshot in _open.values():
+            snapshot.close()
+        _open.clear()
+
+def write(path: str, games: Iterator[Tuple[int, str]], files: Dict[str, str]) -> int:
+    """Write a snapshot. The file is replaced atomically.
+
+    Args:
+        path (str): The location of the snapshot
+        games (Iterator[Tuple[int, str]]): The ID and the JSON content of each game
+        files (Dict[str, str]): Other files to pack, by name
+
+    Returns:
+        int: The number of games written"""
+    table = {'games': [], 'files': {}}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        for game_id, content in games:
+            data = zlib.compress(content.encode('utf-8'))
+            f.write(data)
+            table['games'].append([game_id, offset, len(data)])
+            offset += len(data)
+        for name, content in files.items():
+            data = zlib.compress(content.encode('utf-8'))
+            f.write(data)
+            table['files'][name] = [offset, len(data)]
+            offset += len(data)
+        data = zlib.compress(json.dumps(table).encode('utf-8'))
+        f.write(data)
+        f.write(FOOTER.pack(offset, len(data), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    close_all()
+    os.replace(tmp_path, path)
+    return len(table['games'])
@@ -0,0 +1,458 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""A local stand-in for the parts of itch.io that are used by ItchClaim.
+
+Every sale and game is generated deterministically from a seed, so crawls can be
+benchmarked and load tested end-to-end without sending a single request to itch.io.
+Point ItchClaim to the server using the `--base_url` flag. Subdomains of itch.io
+are served under /~<subdomain>/, see CfWrapper._to_base_url()."""
+
+import hashlib
+import json
+import random
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+CATEGORIES = ['games', 'tools', 'game-assets', 'comics', 'books', 'physical-games',
+              'soundtracks', 'game-mods', 'misc']
+SALE_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+UPLOAD_DATE_FORMAT = '%d %B %Y @ %H:%M'
+FEED_PAGE_SIZE = 30
+LIBRARY_PAGE_SIZE = 50
+
+CF_CHALLENGE_PAGE = '<!DOCTYPE html><html><head><title>Just a moment...</title></head></html>'
+
+class StandInSale:
+    def __init__(self, id: int, start: datetime, end: datetime, rate: int, game_ids: List[int]):
+        self.id = id
+        self.start = start
+        self.end = end
+        self.rate = rate
+        self.game_ids = game_ids
+
+class StandInGame:
+    def __init__(self, id: int, rng: random.Random):
+        self.id = id
+        self.author = f'dev{id % 997}'
+        self.slug = f'game-{id}'
+        self.name = f'Stand-in Game {id}'
+        self.category = CATEGORIES[id % len(CATEGORIES)]
+        self.price = rng.choice([0.99, 1.99, 4.99, 9.99, 14.99])
+        # Some games have no price defined at all, see ItchGame.from_div()
+        self.has_price = rng.random() > 0.05
+        self.claimable = rng.random() > 0.3
+        self.uploads = [rng.randint(1, 10**7) for _ in range(rng.randint(1, 3))]
+        self.sale_ids: List[int] = []
+
+    @property
+    def url(self) -> str:
+        return f'https://{self.author}.itch.io/{self.slug}'
+
+    @property
+    def path(self) -> str:
+        return f'/~{self.author}/{self.slug}'
+
+class StandInCatalog:
+    """Deterministically generated sales and games"""
+    def __init__(self,
+            first_sale: int,
+            sales: int,
+            seed: int,
+            free_rate: float,
+            gap_rate: float,
+            max_games_per_sale: int):
+        self.first_sale = first_sale
+        self.last_sale = first_sale + sales - 1
+        self.sales: Dict[int, StandInSale] = {}
+        self.games: Dict[int, StandInGame] = {}
+        # Sale IDs that have been deleted on the stand-in itch.io (redirected 404)
+        self.deleted_sales = set()
+
+        now = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+        catalog_size = max(sales * 2, 100)
+        for sale_id in range(self.first_sale, self.last_sale + 1):
+            rng = random.Random(f'{seed}-sale-{sale_id}')
+            if rng.random() < gap_rate:
+                self.deleted_sales.add(sale_id)
+                continue
+            # The newest few sales are upcoming, everything else is active or expired
+            start = now + timedelta(hours=(sale_id - self.last_sale + 5) * 2, minutes=rng.randint(0, 59))
+            end = start + timedelta(days=rng.randint(1, 14))
+            rate = 100 if rng.random() < free_rate else rng.choice([10, 25, 50, 75])
+            if rng.random() < 0.02:
+                # bundle sales
+                games_num = rng.randint(50, 200)
+            else:
+                games_num = rng.randint(1, max_games_per_sale)
+            game_ids = sorted({rng.randint(1, catalog_size) for _ in range(games_num)})
+            self.sales[sale_id] = StandInSale(sale_id, start, end, rate, game_ids)
+            for game_id in game_ids:
+                if game_id not in self.games:
+                    self.games[game_id] = StandInGame(game_id, random.Random(f'{seed}-game-{game_id}'))
+                self.games[game_id].sale_ids.append(sale_id)
+
+        self.games_by_path = { game.path: game for game in self.games.values() }
+
+    def active_sale(self, game: StandInGame) -> Optional[StandInSale]:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        for sale_id in reversed(game.sale_ids):
+            sale = self.sales[sale_id]
+            if sale.start < now < sale.end:
+                return sale
+        return None
+
+    def current_price(self, game: StandInGame) -> float:
+        sale = self.active_sale(game)
+        if sale is None:
+            return game.price
+        return round(game.price * (100 - sale.rate) / 100, 2)
+
+    def on_sale_feed(self, category: str) -> List[StandInGame]:
+        """Games of a category with an active sale, newest sale first"""
+        games = [ game for game in self.games.values()
+                 if game.category == category and self.active_sale(game) is not None ]
+        games.sort(key=lambda a: -self.active_sale(a).id)
+        return games
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self,
+            address,
+            catalog: StandInCatalog,
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            challenge_rate: float = 0.0,
+            seed: int = 0):
+        super().__init__(address, StandInRequestHandler)
+        self.catalog = catalog
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.challenge_rate = challenge_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.owned_games: List[int] = []
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return self.rng.random() < rate
+
+    def delay(self) -> float:
+        with self.lock:
+            return self.rng.expovariate(1 / self.latency) if self.latency > 0 else 0
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        ('GET', re.compile(r'^/$'), 'home'),
+        ('GET', re.compile(r'^/login$'), 'login_page'),
+        ('POST', re.compile(r'^/login$'), 'login'),
+        ('GET', re.compile(r'^/s/(\d+)$'), 'sale'),
+        ('GET', re.compile(r'^/s/(\d+)/deleted$'), 'deleted_sale'),
+        ('GET', re.compile(r'^/([\w-]+)/newest/on-sale$'), 'on_sale_feed'),
+        ('GET', re.compile(r'^/my-purchases$'), 'my_purchases'),
+        ('GET', re.compile(r'^/~cdn/uploads/(\d+)/[\w.-]+$'), 'cdn_file'),
+        ('GET', re.compile(r'^(/~[\w-]+/[\w-]+)/data\.json$'), 'game_data'),
+        ('POST', re.compile(r'^(/~[\w-]+/[\w-]+)/download_url$'), 'download_url'),
+        ('GET', re.compile(r'^(/~[\w-]+/[\w-]+)/download/\w+$'), 'download_page'),
+        ('POST', re.compile(r'^(/~[\w-]+/[\w-]+)/download/\w+/claim$'), 'claim'),
+        ('POST', re.compile(r'^(/~[\w-]+/[\w-]+)/file/(\d+)$'), 'file_url'),
+        ('GET', re.compile(r'^(/~[\w-]+/[\w-]+)$'), 'game_page'),
+    ]
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_HEAD(self):
+        self.dispatch('GET', send_body=False)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.dispatch('POST')
+
+    def log_message(self, format, *args):
+        # Keep the console quiet, the server is expected to receive a lot of requests
+        pass
+
+    def dispatch(self, method: str, send_body: bool = True):
+        self.send_body = send_body
+        url = urlsplit(self.path)
+        self.query = { key: values[0] for key, values in parse_qs(url.query).items() }
+        sleep(self.server.delay())
+
+        if self.server.roll(self.server.rate_limit_rate):
+            return self.respond(429, 'Too Many Requests', headers={'Retry-After': '1'})
+        if self.server.roll(self.server.error_rate):
+            return self.respond(500, 'Internal Server Error')
+
+        for route_method, pattern, handler in self.ROUTES:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                return getattr(self, f'handle_{handler}')(*match.groups())
+        self.respond(404, 'Not Found')
+
+    def respond(self, status: int, body, content_type: str = 'text/html; charset=utf-8',
+            headers: Dict[str, str] = None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            content_type = 'application/json'
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.send_body:
+            self.wfile.write(body)
+
+    def redirect(self, path: str, headers: Dict[str, str] = None):
+        self.respond(302, '', headers={'Location': self.server.base_url + path, **(headers or {})})
+
+    def game_or_404(self, path: str) -> Optional[StandInGame]:
+        game = self.server.catalog.games_by_path.get(path)
+        if game is None:
+            self.respond(404, {'errors': ['invalid game']})
+        return game
+
+    # ======= Rendering =======
+
+    def render_game_cell(self, game: StandInGame, sale: StandInSale = None) -> str:
+        """Render a game the way it's listed on sale pages and feeds.
+        The price shown is the discounted price of the given sale, or the current price."""
+        price = ''
+        if game.has_price:
+            if sale is None:
+                price_value = self.server.catalog.current_price(game)
+            else:
+                price_value = round(game.price * (100 - sale.rate) / 100, 2)
+            price = f'<div class="price_value">${price_value:.2f}</div>'
+        return (f'<div class="game_cell" data-game_id="{game.id}">'
+                f'<div class="game_thumb"><img data-lazy_src="https://img.itch.zone/{game.id}.png"></div>'
+                f'<div class="game_cell_data"><a class="title game_link" href="{game.url}">{game.name}</a>'
+                f'{price}</div></div>')
+
+    # ======= Handlers =======
+
+    def handle_home(self):
+        # Sessions aren't tracked, every saved session is considered to be valid.
+        # Cookies saved for .itch.io wouldn't be sent to the stand-in server anyway.
+        self.respond(200, '<html><body><header><a href="/my-purchases">My library</a></header></body></html>',
+                headers={'Set-Cookie': 'itchio_token=stand-in-csrf; Path=/'})
+
+    def handle_login_page(self):
+        if self.server.roll(self.server.challenge_rate):
+            return self.respond(403, CF_CHALLENGE_PAGE)
+        self.respond(200, '<html><body><form method="post"></form></body></html>',
+                headers={'Set-Cookie': 'itchio_token=stand-in-csrf; Path=/'})
+
+    def handle_login(self):
+        self.redirect('/', headers={'Set-Cookie': 'itchio=stand-in-session; Path=/'})
+
+    def handle_sale(self, sale_id: str):
+        catalog = self.server.catalog
+        sale_id = int(sale_id)
+        if sale_id in catalog.deleted_sales:
+            return self.redirect(f'/s/{sale_id}/deleted')
+        sale = catalog.sales.get(sale_id)
+        if sale is None:
+            # The tail after the last sale returns 404 without redirection
+            return self.respond(404, 'Not Found')
+        sale_data = json.dumps({
+            'id': sale.id,
+            'start_date': sale.start.strftime(SALE_DATE_FORMAT),
+            'end_date': sale.end.strftime(SALE_DATE_FORMAT),
+        }, separators=(',', ':'))
+        cells = ''.join([ self.render_game_cell(catalog.games[game_id], sale) for game_id in sale.game_ids ])
+        self.respond(200, '<html><body>'
+                f'<h1>{sale.rate}% off</h1><div class="game_grid_widget">{cells}</div>'
+                f'<script>I.init_Sale(\'#sale_{sale.id}\', {sale_data});init_ViewSale();</script>'
+                '</body></html>')
+
+    def handle_deleted_sale(self, _sale_id: str):
+        self.respond(404, 'Not Found')
+
+    def handle_on_sale_feed(self, category: str):
+        if category not in CATEGORIES or self.query.get('format') != 'json':
+            return self.respond(404, 'Not Found')
+        page = int(self.query.get('page', 1))
+        games = self.server.catalog.on_sale_feed(category)
+        games = games[(page - 1) * FEED_PAGE_SIZE:page * FEED_PAGE_SIZE]
+        self.respond(200, {
+            'page': page,
+            'num_items': len(games),
+            'content': ''.join([ self.render_game_cell(game) for game in games ]),
+        })
+
+    def handle_my_purchases(self):
+        page = int(self.query.get('page', 1))
+        with self.server.lock:
+            owned = self.server.owned_games[(page - 1) * LIBRARY_PAGE_SIZE:page * LIBRARY_PAGE_SIZE]
+        games = [ self.server.catalog.games[game_id] for game_id in owned ]
+        self.respond(200, {
+            'page': page,
+            'num_items': len(games),
+            'content': ''.join([ self.render_game_cell(game) for game in games ]),
+        })
+
+    def handle_game_data(self, path: str):
+        game = self.game_or_404(path)
+        if game is None:
+            return
+        catalog = self.server.catalog
+        data = {
+            'id': game.id,
+            'title': game.name,
+            'cover_image': f'https://img.itch.zone/{game.id}.png',
+        }
+        if game.has_price:
+            data['price'] = f'${catalog.current_price(game):.2f}'
+        sale = catalog.active_sale(game)
+        if sale is not None:
+            data['sale'] = { 'id': sale.id, 'rate': sale.rate, 'end_date': sale.end.strftime('%Y-%m-%d %H:%M:%S') }
+        self.respond(200, data)
+
+    def handle_game_page(self, path: str):
+        game = self.game_or_404(path)
+        if game is None:
+            return
+        with self.server.lock:
+            owned = game.id in self.server.owned_games
+        if owned:
+            body = '<span class="ownership_reason">You own this game</span>'
+        elif self.server.catalog.current_price(game) != 0:
+            body = '<div class="buy_row"><a class="button buy_btn">Buy Now</a></div>'
+        elif game.claimable:
+            body = '<div class="buy_row"><a class="button buy_btn">Download or claim</a></div>'
+        else:
+            body = '<div class="buy_row"><a class="button buy_btn">Download</a></div>'
+        self.respond(200, f'<html><body><h1>{game.name}</h1>{body}</body></html>')
+
+    def handle_download_url(self, path: str):
+        game = self.game_or_404(path)
+        if game is None:
+            return
+        self.respond(200, { 'url': f'{game.url}/download/k{game.id}' })
+
+    def handle_download_page(self, path: str):
+        game = self.game_or_404(path)
+        if game is None:
+            return
+        with self.server.lock:
+            owned = game.id in self.server.owned_games
+        if not owned and game.claimable:
+            return self.respond(200, '<div class="claim_to_download_box warning_box">'
+                f'<form action="{game.url}/download/k{game.id}/claim" method="post"></form></div>')
+
+        uploads = []
+        for upload_id in game.uploads:
+            rng = random.Random(upload_id)
+            upload_date = datetime(2020, 1, 1) + timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60))
+            uploads.append('<div class="upload">'
+                f'<a class="button download_btn" data-upload_id="{upload_id}">Download</a>'
+                f'<strong class="name">upload-{upload_id}.zip</strong>'
+                f'<span class="file_size"><span>{upload_size(upload_id) // 1024} kB</span></span>'
+                '<span class="download_platforms"><span class="icon icon-windows8"></span></span>'
+                f'<div class="upload_date"><abbr title="{upload_date.strftime(UPLOAD_DATE_FORMAT)}"></abbr></div>'
+                '</div>')
+        self.respond(200, f'<html><body>{"".join(uploads)}</body></html>')
+
+    def handle_claim(self, path: str):
+        game = self.game_or_404(path)
+        if game is None:
+            return
+        with self.server.lock:
+            if game.id not in self.server.owned_games:
+                self.server.owned_games.append(game.id)
+        self.redirect(game.path)
+
+    def handle_file_url(self, path: str, upload_id: str):
+        game = self.game_or_404(path)
+        if game is None:
+            return
+        self.respond(200, { 'url': f'https://cdn.itch.io/uploads/{upload_id}/upload-{upload_id}.zip' })
+
+    def handle_cdn_file(self, upload_id: str):
+        size = upload_size(int(upload_id))
+        body = random.Random(int(upload_id)).getrandbits(size * 8).to_bytes(size, 'little')
+        headers = {'Accept-Ranges': 'bytes', 'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None:
+            return self.respond(200, body, content_type='application/octet-stream', headers=headers)
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start > end:
+            return self.respond(416, b'', content_type='application/octet-stream',
+                    headers={'Content-Range': f'bytes */{size}'})
+        self.respond(206, body[start:end + 1], content_type='application/octet-stream',
+                headers={**headers, 'Content-Range': f'bytes {start}-{end}/{size}'})
+
+def upload_size(upload_id: int) -> int:
+    """Size of a stand-in upload in bytes"""
+    return random.Random(upload_id).randint(64, 4096) * 1024
+
+def serve(host: str = '127.0.0.1',
+        port: int = 8080,
+        first_sale: int = 100000,
+        sales: int = 500,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        challenge_rate: float = 0.0,
+        free_rate: float = 0.5,
+        gap_rate: float = 0.05,
+        max_games_per_sale: int = 5,
+        seed: int = 0):
+    """Start a stand-in server, and serve requests until interrupted.
+    See ItchClaim.stand_in_server() for the description of the arguments."""
+    catalog = StandInCatalog(first_sale, sales, seed, free_rate, gap_rate, max_games_per_sale)
+    server = StandInServer((host, port), catalog,
+        latency=latency,
+        error_rate=error_rate,
+        rate_limit_rate=rate_limit_rate,
+        challenge_rate=challenge_rate,
+        seed=seed)
+    print(f'Stand-in itch.io server listening on {server.base_url}')
+    print(f'Serving sales {catalog.first_sale}-{catalog.last_sale} with {len(catalog.games)} games')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,159 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2022-2025 Péter Tombor.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Write-behind buffer for the files of games.
+
+Repeated saves of the same game are merged, and the files are written in batches,
+when the buffer is full or it hasn't been flushed for a while. Every file is written to a
+temporary file first and then renamed, so a crash never leaves a partially written file.
+The buffer is flushed at exit (including SIGTERM) and before the sale journal is synced.
+The lines recorded in the change feed are written by the same flush, before the files.
+
+The hash of every file read or written is remembered, so saving identical content
+again can be skipped without touching the disk. Files missing from the disk are read
+from the snapshot of their directory, if there's one."""
+
+import atexit
+import hashlib
+import os
+import signal
+import sys
+import threading
+from time import monotonic
+from typing import Dict, Optional
+
+from . import ChangeFeed, Metrics, Profiler, Snapshot
+
+# Flush when this many files are waiting to be written
+max_entries = 200
+# Flush when the oldest file has been waiting for this many seconds
+max_seconds = 10.0
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_pending: Dict[str, str] = {}
+_oldest: Optional[float] = None
+# Hash of the last known content of each file
+_hashes: Dict[str, bytes] = {}
+
+def content_hash(content: str) -> bytes:
+    return hashlib.sha1(content.encode('utf-8')).digest()
+
+def put(path: str, content: str):
+    """Schedule a file to be written. Replaces the pending content of the same file."""
+    global _oldest
+    with _lock:
+        _pending[path] = content
+        _hashes[path] = content_hash(content)
+        if _oldest is None:
+            _oldest = monotonic()
+        due = len(_pending) >= max_entries or monotonic() - _oldest >= max_seconds
+    if due:
+        flush()
+
+def get(path: str) -> Optional[str]:
+    """Returns the content of a file that's waiting to be written"""
+    with _lock:
+        return _pending.get(path)
+
+def read(path: str) -> Optional[str]:
+    """Returns the content of a file, from the buffer if it's waiting to be written.
+    Returns None if the file doesn't exist."""
+    content = get(path)
+    if content is None:
+        try:
+            with Profiler.phase('disk_io'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+        except FileNotFoundError:
+            snapshot = Snapshot.for_directory(os.path.dirname(path))
+            content = snapshot.read_file(os.path.basename(path)) if snapshot is not None else None
+            if content is None:
+                return None
+    with _lock:
+        _hashes[path] = content_hash(content)
+    return content
+
+def unchanged(path: str, content: str) -> bool:
+    """Check if the file already has the given content"""
+    with _lock:
+        known_hash = _hashes.get(path)
+    if known_hash is None:
+        if read(path) is None:
+            return False
+        with _lock:
+            known_hash = _hashes.get(path)
+    return known_hash == content_hash(content)
+
+def exists(path: str) -> bool:
+    """Check if a file exists, is waiting to be written, or is in the snapshot"""
+    with _lock:
+        if path in _pending:
+            return True
+    if os.path.exists(path):
+        return True
+    snapshot = Snapshot.for_directory(os.path.dirname(path))
+    match = Snapshot.GAME_FILENAME_RE.match(os.path.basename(path))
+    return snapshot is not None and match is not None and int(match.group(1)) in snapshot
+
+def flush():
+    """Write every pending file to the disk.
+    Files stay in the buffer until they have been written, so read() never misses them."""
+    global _oldest
+    # Only one thread writes at a time, so an older content can't be written last
+    with _flush_lock:
+        with _lock:
+            pending = dict(_pending)
+        with Profiler.phase('disk_io'):
+            # The feed lists a game before its file changes, so readers of the feed
+            # (e.g. the serve command) never miss a change
+            ChangeFeed.flush()
+        if len(pending) == 0:
+            return
+        with Profiler.phase('disk_io'):
+            for path, content in pending.items():
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # Unique, in case another process writes the same file
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+        with _lock:
+            for path, content in pending.items():
+                # Files saved again while flushing are written by the next flush
+                if _pending.get(path) is content:
+                    del _pending[path]
+            _oldest = monotonic() if _pending else None
+    Metrics.inc('games_saved_total', len(pending))
+
+def _exit_on_sigterm(signum, frame):
+    # Raising SystemExit runs the atexit handlers, which flush the buffer
+    sys.exit(128 + signum)
+
+def install_exit_handlers():
+    """Flush the buffer when the process exits, or when it's terminated with SIGTERM.
+    Must be called from the main thread."""
+    atexit.register(flush)
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
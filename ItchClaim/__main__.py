@@ -24,18 +24,24 @@ import logging
 import os
 import signal
 import sys
-from time import sleep
+from datetime import datetime
+from time import sleep, time
 from typing import List
 
 import pycron
 from fire import Fire
 from requests.exceptions import ReadTimeout
 
-from . import DiskManager, __version__
+from . import CatalogExport, CatalogServer, ChangeFeed, Deadline, DiskManager, MemoryReport, Metrics, Profiler, RetryPolicy, SaleIndex, SingleFlight, Snapshot, StandInServer, WriteBuffer, __version__
 from .ItchGame import ItchGame
+from .ItchSale import is_active
 from .ItchUser import ItchUser
 from .web import generate_web
 from .CfWrapper import CfWrapper
+from .Cassette import Cassette
+from .ClaimDaemon import ClaimDaemon
+from .Downloader import Downloader
+from .RetryPolicy import CircuitOpenError
 
 
 # pylint: disable=missing-class-docstring
@@ -46,7 +52,17 @@ class ItchClaim:
                 password: str = None,
                 totp: str = None,
                 flaresolverr_log_level: str = 'ERROR',
-                flaresolverr_max_timeout: int = 120):
+                flaresolverr_max_timeout: int = 120,
+                base_url: str = None,
+                record: str = None,
+                replay: str = None,
+                metrics_dir: str = None,
+                profile: str = None,
+                memory_report: int = None,
+                max_memory: float = None,
+                request_deadline: float = 120,
+                retry_budget: int = 500,
+                deadline: float = None):
         """Automatically claim free games from itch.io
 
         Args:
@@ -58,6 +74,25 @@ class ItchClaim:
                 Default is 'ERROR'. Other options are: 'DEBUG', 'INFO', 'WARNING'
             flaresolverr_max_timeout (int): The maximum timeout for FlareSolverr in seconds
                 Default is 120
+            base_url (str): Send every itch.io request to this server instead,
+                for example a stand-in server started with the stand_in_server command
+            record (str): Record every request and response to this directory
+            replay (str): Serve responses recorded with --record from this directory,
+                without accessing the network
+            metrics_dir (str): Write a JSON summary and a Prometheus textfile collector file
+                of the request and crawl metrics to this directory when the command finishes
+            profile (str): Profile the command with cProfile, and save the statistics to this
+                file (default: itchclaim.pstats). Prints the time spent in each phase at exit.
+            memory_report (int): Trace memory allocations, take snapshots at phase boundaries
+                and after every N sale pages, and print the top allocation sites at exit
+            max_memory (float): Abort with a memory report if the memory allocated by Python
+                exceeds this limit (in MiB). Enables memory tracing.
+            request_deadline (float): Stop retrying a request after this many seconds
+                Default is 120
+            retry_budget (int): The maximum number of retried requests in the run
+                Default is 500, -1 means unlimited
+            deadline (float): Time budget of the command in seconds. The most valuable work is
+                done first, and the work left when the time runs out is done by the next run.
         """
 
         # Set up FlareSolverr logging
@@ -70,6 +105,27 @@ class ItchClaim:
         
         # CfWrapper is a singleton, so this sets the max timeout for all instances
         CfWrapper().max_timeout = flaresolverr_max_timeout
+        if base_url is not None:
+            CfWrapper().base_url = base_url.rstrip('/')
+        RetryPolicy.request_deadline = request_deadline
+        RetryPolicy.budget = RetryPolicy.RetryBudget(retry_budget)
+        if deadline is not None:
+            Deadline.start(deadline)
+        if metrics_dir is not None:
+            Metrics.export_at_exit(metrics_dir, command_name())
+        if profile:
+            Profiler.start(profile if isinstance(profile, str) else 'itchclaim.pstats')
+        if memory_report is not None or max_memory is not None:
+            MemoryReport.start(memory_report or 25, max_memory)
+        # Registered last, so the pending game files are written before the reports at exit
+        WriteBuffer.install_exit_handlers()
+        if record is not None and replay is not None:
+            print('--record and --replay can\'t be used at the same time')
+            exit(1)
+        if record is not None:
+            CfWrapper().cassette = Cassette(record, 'record')
+        elif replay is not None:
+            CfWrapper().cassette = Cassette(replay, 'replay')
 
         if version:
             self.version()
@@ -93,6 +149,7 @@ class ItchClaim:
             max_pages: int = -1,
             no_fail: bool = False,
             max_not_found_pages: int = 25,
+            max_idle_pages: int = 5,
         ):
         """Refresh the cache about game sales
         Opens itch.io and downloads sales posted after the last saved one.
@@ -103,8 +160,11 @@ class ItchClaim:
             max_pages (int): The maximum number of pages to download.
                 Default is -1, which means unlimited
             no_fail (bool): Continue downloading sales even if a page fails to load
-            max_not_found_pages (int): the maximum number of consecutive pages that return
-                404 before stopping the execution. Default is 25"""
+            max_not_found_pages (int): the maximum number of consecutive sale IDs that return
+                404 between two existing sales. Default is 25
+            max_idle_pages (int): Stop processing the list of a category after this many
+                consecutive pages without new or updated games. Default is 5,
+                -1 means every page is processed"""
         resume = 1
         ItchGame.games_dir = games_dir
         os.makedirs(games_dir, exist_ok=True)
@@ -130,11 +190,8 @@ class ItchClaim:
         )
 
         print('Updating games from sale lists, to catch updates of already known sales.')
-
-        for category in ['games', 'tools', 'game-assets', 'comics', 'books', 'physical-games',
-                'soundtracks', 'game-mods', 'misc']:
-            print(f'Collecting sales from {category} list')
-            DiskManager.get_all_sale_pages(category=category, no_fail=no_fail)
+        DiskManager.get_all_categories_sale_pages(no_fail=no_fail, max_idle_pages=max_idle_pages)
+        SingleFlight.clear_all()
 
     def refresh_library(self):
         """Refresh the list of owned games of an account. This is used to skip claiming already
@@ -145,31 +202,60 @@ class ItchClaim:
         self.user.reload_owned_games()
         self.user.save_session()
 
-    def claim(self, url: str = 'https://itchclaim.tmbpeter.com/api/active.json'):
+    def claim(self, url: str = 'https://itchclaim.tmbpeter.com/api/active.json', full: bool = False):
         """Claim all unowned games. Requires login.
+        Only the sales that are new since the previous run are processed, and the list isn't
+        downloaded again if it hasn't changed.
+
         Args:
-            url (str): The URL to download the file from"""
+            url (str): The URL to download the file from
+            full (bool): Download the list and process every sale, even the ones that have
+                already been processed"""
 
-        if self.user is None:
-            print('You must be logged in')
+        if not self._load_library():
             return
-        if len(self.user.owned_games) == 0:
-            print('User\'s library not found in cache. Downloading it now')
-            self.user.reload_owned_games()
-            self.user.save_session()
+        # Called repeatedly by schedule, so nothing is reused from the previous run
+        SingleFlight.clear_all()
 
         print(f'Downloading free games list from {url}')
-        games = DiskManager.download_from_remote_cache(url)
+        validators = None if full else self.user.remote_lists.get(url)
+        games_raw, validators = DiskManager.download_remote_list(url, validators, full)
+        if games_raw is None:
+            print('The list of free games hasn\'t changed since the last run.')
+            return
+
+        now = time()
+        if not full:
+            games_raw = [ game_json for game_json in games_raw
+                if any(is_active([sale], now) and not self.user.is_handled(game_json['id'], sale['id'])
+                    for sale in game_json['sales']) ]
+        games = DiskManager.games_from_remote_list(games_raw)
 
-        print('Claiming games')
+        print(f'Claiming games ({len(games)} new sales)')
         claimed_games = 0
+        failed = False
         for game in games:
+            if game.claimable is None:
+                # Processed again after the claimability has been checked
+                continue
             if not self.user.owns_game(game) and game.claimable:
-                self.user.claim_game(game)
-                self.user.save_session()
+                if not self.user.claim_game(game):
+                    failed = True
+                    continue
                 claimed_games += 1
+                self.user.save_session()
+            for sale in game.sales:
+                if sale.is_active:
+                    self.user.mark_handled(game.id, sale)
         if claimed_games == 0:
             print('No new games can be claimed.')
+        # Download the list again next time, to retry the failed games
+        if not failed:
+            if validators:
+                self.user.remote_lists[url] = validators
+            else:
+                self.user.remote_lists.pop(url, None)
+        self.user.save_session()
 
     def schedule(self, cron: str, url: str = 'https://itchclaim.tmbpeter.com/api/active.json'):
         """Start an infinite process of the script that claims games at a given schedule.
@@ -178,15 +264,7 @@ class ItchClaim:
                 See crontab.guru for syntax
             url (str): The URL to download the file from"""
         print(f'Starting cron job with schedule {cron}')
-
-        # Define the signal handler
-        def signal_handler(signum, frame):
-            print("Interrupt signal received. Exiting...")
-            exit(0)
-
-        # Register the signal handler
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
+        exit_on_interrupt()
 
         # Start the scheduler
         while True:
@@ -195,7 +273,43 @@ class ItchClaim:
                 continue
             self.claim(url)
             sleep(60)
-        
+
+    def daemon(self,
+            url: str = 'https://itchclaim.tmbpeter.com/api/active.json',
+            upcoming_url: str = None,
+            refresh_interval: float = 3600,
+            jitter: float = 30):
+        """Start an infinite process of the script that claims games as soon as their sales start.
+        Sleeps until the next sale starts or the list of sales is downloaded again,
+        so nothing is sent between these events. Requires login.
+
+        Args:
+            url (str): The URL of the list of active sales
+            upcoming_url (str): The URL of the list of upcoming sales. Defaults to
+                upcoming.json next to the list of active sales
+            refresh_interval (float): Download the lists of sales again after this many seconds
+                Default is 3600
+            jitter (float): Wait a random number of seconds (up to this value) after a sale
+                starts, before claiming its games. Default is 30"""
+        if not self._load_library():
+            return
+        if upcoming_url is None:
+            upcoming_url = url.rsplit('/', 1)[0] + '/upcoming.json'
+        print('Starting daemon')
+        exit_on_interrupt()
+        ClaimDaemon(self.user, url, upcoming_url, refresh_interval, jitter).run()
+
+    def _load_library(self) -> bool:
+        """Download the library of the user if it's not cached yet.
+        Returns False if the user isn't logged in."""
+        if self.user is None:
+            print('You must be logged in')
+            return False
+        if len(self.user.owned_games) == 0:
+            print('User\'s library not found in cache. Downloading it now')
+            self.user.reload_owned_games()
+            self.user.save_session()
+        return True
 
     def download_urls(self, game_url: int):
         """Get details about a game, including it's CDN download URLs.
@@ -203,37 +317,279 @@ class ItchClaim:
         Args:
             game_url (int): The url of the requested game."""
         game: ItchGame = ItchGame.from_api(game_url)
-        session = self.user.s if self.user is not None else None
-        print(game.downloadable_files(session))
+        print(game.downloadable_files())
+
+    def download(self,
+            output_dir: str = 'downloads',
+            games: List[int] = None,
+            workers: int = 4,
+            chunk_workers: int = 4,
+            per_host: int = 4,
+            max_bandwidth: float = None,
+            verify: bool = False):
+        """Download the files of the games in the library. Requires login.
+        Interrupted downloads are continued by the next run.
+
+        Args:
+            output_dir (str): The files of each game are saved to a subdirectory of this
+            games (List[int]): Only download the files of the games with these IDs
+            workers (int): The number of files downloaded at the same time. Default is 4
+            chunk_workers (int): The number of chunks of a file downloaded at the same time. Default is 4
+            per_host (int): The maximum number of requests sent to a host at the same time. Default is 4
+            max_bandwidth (float): The maximum total download speed in MiB/s
+            verify (bool): Check the hash of the files downloaded by previous runs, not just their size"""
+        if not self._load_library():
+            return
+        if any(game.url is None for game in self.user.owned_games):
+            # Only the IDs of games are saved in the session
+            print('Downloading the library to get the URLs of the games')
+            self.user.reload_owned_games()
+            self.user.save_session()
+        owned_games = self.user.owned_games
+        if games is not None:
+            game_ids = set(games) if isinstance(games, (list, tuple)) else {games}
+            owned_games = [ game for game in owned_games if game.id in game_ids ]
+
+        exit_on_interrupt()
+        downloader = Downloader(output_dir, workers, chunk_workers,
+            None if max_bandwidth is None else max_bandwidth * 1024 * 1024, verify, per_host)
+        results = downloader.download_games(owned_games)
+        print(f'Downloaded {results["downloaded"]} files, skipped {results["skipped"]} already downloaded, '
+              f'{results["failed"]} failed')
+
+    def mirror(self,
+            output_dir: str = 'mirror',
+            workers: int = 8,
+            chunk_workers: int = 4,
+            per_host: int = 4,
+            max_bandwidth: float = None,
+            verify: bool = False):
+        """Keep a copy of every file of the games in the library up to date. Requires login.
+        Files whose upload date hasn't changed are skipped, and files with the same content
+        are stored only once.
+
+        Args:
+            output_dir (str): The directory of the mirror. Default is mirror
+            workers (int): The number of games listed and files downloaded at the same time. Default is 8
+            chunk_workers (int): The number of chunks of a file downloaded at the same time. Default is 4
+            per_host (int): The maximum number of requests sent to a host at the same time. Default is 4
+            max_bandwidth (float): The maximum total download speed in MiB/s
+            verify (bool): Check the hash of the files downloaded by previous runs, not just their size"""
+        if self.user is None:
+            print('You must be logged in')
+            return
+        # Games added to the library since the previous run are mirrored too
+        self.user.reload_owned_games()
+        self.user.save_session()
 
-    def generate_web(self, web_dir: str = 'web'):
+        exit_on_interrupt()
+        downloader = Downloader(output_dir, workers, chunk_workers,
+            None if max_bandwidth is None else max_bandwidth * 1024 * 1024, verify, per_host,
+            content_addressed=True)
+        results = downloader.download_games(self.user.owned_games)
+        removed = downloader.remove_unreferenced_objects()
+        print(f'Downloaded {results["downloaded"]} files, linked {results["linked"]} duplicates, '
+              f'{results["skipped"]} unchanged, {results["failed"]} failed. '
+              f'Removed {removed} outdated files')
+
+    def generate_web(self, web_dir: str = 'web', full: bool = False):
         """Generates files that can be served as a static website
         
         Args:
-            web_dir (str): Output directory"""
+            web_dir (str): Output directory
+            full (bool): Load every game from the disk, even if the previous all.json
+                can be updated using the change feed"""
 
         ItchGame.games_dir = os.path.join(web_dir, 'data')
         os.makedirs(os.path.join(web_dir, 'api'), exist_ok=True)
         os.makedirs(ItchGame.games_dir, exist_ok=True)
 
-        games = DiskManager.load_all_games()
-        generate_web(games, web_dir)
+        all_json_path = os.path.join(web_dir, 'api', 'all.json')
+        games = None if full else DiskManager.load_games_from_feed(all_json_path)
+        if games is None:
+            games = DiskManager.load_all_games()
+        with Profiler.phase('generate_web'):
+            generate_web(games, web_dir)
+
+        # Games with unknown claimability are rechecked by the next run
+        unknown = [ game.id for game in games if game.claimable is None and game.active_sale ]
+        ChangeFeed.reset(ItchGame.games_dir, all_json_path, unknown)
 
-    def recheck_unknown_claimability(self, games_dir: str = 'web/data/'):
-        """Recheck games with unknown claimability"""
+    def recheck_unknown_claimability(self, games_dir: str = 'web/data/', full: bool = False):
+        """Recheck games with unknown claimability
+
+        Args:
+            games_dir (str): Output directory
+            full (bool): Check every game, not just the ones in the change feed"""
 
         ItchGame.games_dir = games_dir
-        games = DiskManager.load_all_games()
+        changed_ids = None if full else ChangeFeed.changed_ids(games_dir)
+        if changed_ids is None:
+            games = DiskManager.load_all_games()
+        else:
+            print(f'Checking {len(changed_ids)} games from the change feed')
+            games = DiskManager.load_games(changed_ids)
+
+        unknown = [ game for game in games if "claimable" not in game.__dict__ and game.active_sale ]
+        # Check the sales ending soon first, the others can be checked by the next run
+        unknown.sort(key=lambda game: game.active_sale.end)
+        for i, game in enumerate(unknown):
+            if Deadline.expired():
+                print(f'Deadline reached. {len(unknown) - i} games are left to the next run')
+                Deadline.shed('claimability', len(unknown) - i)
+                break
+            print(f'Rechecking claimability of {game.name} ({game.id})')
+            try:
+                print(f'Found claimable: {game.claimable} for {game.name} (ID {game.id})')
+            except ReadTimeout as e:
+                print(f'Timeout while checking claimability of {game.name} (ID {game.id}): {e}')
+                continue
+            except CircuitOpenError as e:
+                # Rechecked by the next run
+                print(f'Skipped checking claimability of {game.name} (ID {game.id}): {e}')
+                continue
+            game.save_to_disk()
 
-        for game in games:
-            if "claimable" not in game.__dict__ and game.active_sale:
-                print(f'Rechecking claimability of {game.name} ({game.id})')
-                try:
-                    print(f'Found claimable: {game.claimable} for {game.name} (ID {game.id})')
-                except ReadTimeout as e:
-                    print(f'Timeout while checking claimability of {game.name} (ID {game.id}): {e}')
-                    continue
-                game.save_to_disk()
+    def serve(self, games_dir: str = 'web/data/', host: str = '127.0.0.1', port: int = 8000, reload_interval: float = 2):
+        """Serve the website and the API from memory, instead of generating static files.
+        Games saved by a running refresh_sale_cache are picked up without reloading every game.
+
+        Args:
+            games_dir (str): The directory where game data is stored
+            host (str): The address to listen on. Default is 127.0.0.1
+            port (int): The port to listen on. Default is 8000
+            reload_interval (float): Check the change feed for saved games every this many seconds"""
+        CatalogServer.serve(games_dir, host, port, reload_interval)
+
+    def query(self,
+            games_dir: str = 'web/data/',
+            name: str = None,
+            starts_after = None,
+            starts_before = None,
+            ends_after = None,
+            ends_before = None,
+            active: bool = False,
+            claimable = None,
+            limit: int = 50,
+            rebuild: bool = False):
+        """Find sales in the games directory, using the sale index.
+        Times are unix timestamps, ISO 8601 dates, 'now' or relative to now (e.g. +6h, -30d).
+
+        Args:
+            games_dir (str): The directory where game data is stored
+            name (str): Only games that have a word starting with each word of this
+            starts_after, starts_before, ends_after, ends_before: Bounds of the start and the end of the sales
+            active (bool): Only sales that are active now
+            claimable: Only games that are claimable (true), not claimable (false) or unknown
+            limit (int): The maximum number of games printed
+            rebuild (bool): Build the index again from every game"""
+        claimability = ...
+        if claimable is not None:
+            choices = {'true': True, 'false': False, 'unknown': None}
+            if str(claimable).lower() not in choices:
+                print(f'Unknown claimability {claimable}, expected one of {", ".join(choices)}')
+                exit(1)
+            claimability = choices[str(claimable).lower()]
+
+        ItchGame.games_dir = games_dir
+        index = None if rebuild else SaleIndex.SaleIndex.open(games_dir)
+        if index is None:
+            print('Building the sale index')
+            index = DiskManager.build_sale_index()
+        elif index.log_lines > SaleIndex.MAX_LOG_LINES:
+            index = index.compact()
+
+        bounds = [ SaleIndex.parse_time(value) for value in (starts_after, starts_before, ends_after, ends_before) ]
+        if active:
+            now = time()
+            bounds[1] = now if bounds[1] is None else min(bounds[1], now)
+            bounds[2] = now if bounds[2] is None else max(bounds[2], now)
+
+        query_started = time()
+        results = index.query(*bounds, name=name, claimable=claimability)
+        elapsed = time() - query_started
+        for game_id, game_name, game_claimable, sales in results[:limit]:
+            claimable_text = {True: 'claimable', False: 'not claimable', None: 'unknown'}[game_claimable]
+            print(f'{game_name} (ID {game_id}, {claimable_text})')
+            for sale_id, start, end in sales:
+                print(f'    Sale {sale_id}: {datetime.fromtimestamp(start):%Y-%m-%d %H:%M} - {datetime.fromtimestamp(end):%Y-%m-%d %H:%M}')
+        print(f'Found {len(results)} games in {elapsed * 1000:.1f} ms' +
+            (f', printed the first {limit}' if len(results) > limit else ''))
+
+    def export(self, games_dir: str = 'web/data/', output_dir: str = 'export', format: str = 'auto'):
+        """Export the games and their sales as flat tables (games and sales), for analysing them
+        with other tools. The tables are written as NDJSON, and as Parquet or CSV.
+
+        Args:
+            games_dir (str): The directory where game data is stored
+            output_dir (str): The directory of the tables. Default is export
+            format (str): parquet, csv, or auto (parquet if pyarrow is installed, otherwise csv)"""
+        ItchGame.games_dir = games_dir
+        try:
+            rows = CatalogExport.export(DiskManager.iter_serialized_games(), output_dir, format)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        print(f'Exported {rows["games"]} games and {rows["sales"]} sales to {output_dir}')
+
+    def export_snapshot(self, games_dir: str = 'web/data/', path: str = None, remove_files: bool = False):
+        """Pack the games directory into a single compressed file with an index
+
+        Args:
+            games_dir (str): The directory where game data is stored
+            path (str): The location of the snapshot. Defaults to catalog.snap inside games_dir,
+                which is read directly by the other commands
+            remove_files (bool): Delete the game files after they have been packed"""
+        ItchGame.games_dir = games_dir
+        if path is None:
+            path = os.path.join(games_dir, Snapshot.SNAPSHOT_FILENAME)
+        games_num = DiskManager.export_snapshot(path, remove_files)
+        print(f'Packed {games_num} games into {path}')
+
+    def import_snapshot(self, path: str, games_dir: str = 'web/data/'):
+        """Unpack a snapshot created by export_snapshot into individual files
+
+        Args:
+            path (str): The location of the snapshot
+            games_dir (str): The directory where game data is stored"""
+        ItchGame.games_dir = games_dir
+        os.makedirs(games_dir, exist_ok=True)
+        games_num = DiskManager.import_snapshot(path)
+        print(f'Unpacked {games_num} games into {games_dir}')
+
+    def stand_in_server(self,
+            host: str = '127.0.0.1',
+            port: int = 8080,
+            first_sale: int = 100000,
+            sales: int = 500,
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            challenge_rate: float = 0.0,
+            free_rate: float = 0.5,
+            gap_rate: float = 0.05,
+            max_games_per_sale: int = 5,
+            seed: int = 0):
+        """Start a local server that emulates the parts of itch.io used by ItchClaim.
+        Useful for benchmarking and load testing without sending requests to itch.io.
+        Use the --base_url flag to point other commands to it.
+
+        Args:
+            host (str): The address to listen on. Default is 127.0.0.1
+            port (int): The port to listen on. Default is 8080
+            first_sale (int): The ID of the first sale. Default is 100000
+            sales (int): The number of sales after the first one. Every ID after them returns 404
+            latency (float): The average latency of responses in seconds (exponentially distributed)
+            error_rate (float): The ratio of requests that fail with HTTP 500
+            rate_limit_rate (float): The ratio of requests that fail with HTTP 429
+            challenge_rate (float): The ratio of login page requests that receive a
+                Cloudflare challenge
+            free_rate (float): The ratio of sales that are 100% discounts
+            gap_rate (float): The ratio of deleted sales (404 with redirection)
+            max_games_per_sale (int): The maximum number of games in a non-bundle sale
+            seed (int): The seed used to generate sales and games"""
+        StandInServer.serve(host, port, first_sale, sales, latency, error_rate, rate_limit_rate,
+                challenge_rate, free_rate, gap_rate, max_games_per_sale, seed)
 
     def login(self,
                 username: str = None,
@@ -254,24 +610,48 @@ class ItchClaim:
         if not isinstance(username, str):
             username = input('Enter username: ')
 
+        # Try loading password from environment variables if not provided as command line argument
+        if password is None:
+            password = os.getenv('ITCH_PASSWORD')
+        # Try loading TOTP from environment variables if not provided as command line argument
+        if totp is None:
+            totp = os.getenv('ITCH_TOTP')
+
         self.user = ItchUser(username)
+        # Used to log in again, if the session expires during the run
+        self.user.credentials = (password, totp)
         try:
             self.user.load_session()
             print(f'Session {username} loaded successfully')
 
-            if not self.user.validate_session():
-                print('Session is invalid or expired. Logging in again.')
-                raise FileNotFoundError()
+            # A recently validated session isn't checked again. If it has expired since then,
+            # it's detected from the first rejected request.
+            if self.user.validation_due():
+                if not self.user.validate_session():
+                    print('Session is invalid or expired. Logging in again.')
+                    raise FileNotFoundError()
+                self.user.save_session()
         except FileNotFoundError:
-            # Try loading password from environment variables if not provided as command line argument
-            if password is None:
-                password = os.getenv('ITCH_PASSWORD')
-            # Try loading TOTP from environment variables if not provided as command line argument
-            if totp is None:
-                totp = os.getenv('ITCH_TOTP')
             self.user.login(password, totp)
             print(f'Logged in as {username}')
 
+def exit_on_interrupt():
+    """Exit the never ending commands on SIGINT and SIGTERM"""
+    def signal_handler(signum, frame):
+        print("Interrupt signal received. Exiting...")
+        exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+def command_name() -> str:
+    """Find the name of the command that's going to be called by Fire"""
+    for arg in sys.argv[1:]:
+        name = arg.replace('-', '_')
+        if not name.startswith('_') and callable(getattr(ItchClaim, name, None)):
+            return name
+    return 'itchclaim'
+
 # pylint: disable=missing-function-docstring
 def main():
     Fire(ItchClaim)
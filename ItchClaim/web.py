@@ -20,14 +20,25 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from datetime import datetime
+from datetime import datetime, timezone
+import hashlib
 import json
 import os
 from string import Template
-from typing import List
+from time import time
+from typing import Dict, List, Optional
 import importlib.resources as pkg_resources
 
+from . import MemoryReport, Profiler
 from .ItchGame import ItchGame
+from .ItchSale import ItchSale, is_active, is_upcoming
+
+# The number of change files kept in api/changes
+MAX_CHANGES = 120
+# The number of rows in the tables of each page of index.html
+ROWS_PER_PAGE = 100
+# The range of last sale IDs covered by each page of the API (api/pages/<n>.json)
+SALES_PER_API_PAGE = 1000
 
 DATE_FORMAT = '<span>%Y-%m-%d</span> <span>%H:%M</span>'
 ROW_TEMPLATE = Template("""<tr>
@@ -40,53 +51,217 @@ ROW_TEMPLATE = Template("""<tr>
     </tr>""")
 
 def generate_web(games: List[ItchGame], web_dir: str):
-    template = Template(pkg_resources.read_text(__package__, 'index.template.html'))
     games.sort(key=lambda a: (-1*a.sales[-1].id, a.name))
+    MemoryReport.checkpoint('after sort')
 
     # Forcibly set claimable to None if not set yet to prevent cached_property from calling remote API
     for game in games:
         if "claimable" not in game.__dict__:
             game.claimable = None
 
-    # Load resume index
-    try:
-        with open(os.path.join(web_dir, 'data', 'resume_index.txt'), 'r', encoding='utf-8') as f:
-            resume_index = int(f.read())
-    except FileNotFoundError:
-        resume_index = 0
+    resume_index = read_resume_index(os.path.join(web_dir, 'data'))
 
     # ======= HTML =======
 
-    active_sales = list(filter(lambda game: game.active_sale, games))
-    active_sales_rows = generate_rows(active_sales, 'active')
-
-    upcoming_sales = list(filter(lambda game: game.last_upcoming_sale, games))
-    upcoming_sales_rows = generate_rows(upcoming_sales, 'upcoming')
-
-    html = template.substitute(
-            active_sales_rows = '\n'.join(active_sales_rows),
-            upcoming_sales_rows = '\n'.join(upcoming_sales_rows),
-            last_update = datetime.now().strftime(DATE_FORMAT),
-            last_sale = resume_index,
-        )
-
-    with open(os.path.join(web_dir, 'index.html'), 'w', encoding="utf-8") as f:
-        f.write(html)
+    now = time()
+    active_sales = [ game for game in games if is_active(ItchSale.serialize_list(game.sales), now) ]
+    upcoming_sales = [ game for game in games if is_upcoming(ItchSale.serialize_list(game.sales), now) ]
+    pages = render_index_pages(active_sales, upcoming_sales, resume_index)
+    for page, html in enumerate(pages, start=1):
+        write_file(os.path.join(web_dir, index_page_filename(page)), html)
+    # Remove the pages left over from previous runs
+    page = len(pages) + 1
+    while os.path.exists(os.path.join(web_dir, index_page_filename(page))):
+        os.remove(os.path.join(web_dir, index_page_filename(page)))
+        page += 1
 
     # ======= JSON (active sales) =======
     active_sales_min = [ game.serialize_min() for game in active_sales ]
-    with open(os.path.join(web_dir, 'api', 'active.json'), 'w', encoding="utf-8") as f:
-        f.write(json.dumps(active_sales_min))
+    write_json(os.path.join(web_dir, 'api', 'active.json'), active_sales_min)
 
     # ======= JSON (upcoming sales) =======
     upcoming_sales_min = [ game.serialize_min() for game in upcoming_sales ]
-    with open(os.path.join(web_dir, 'api', 'upcoming.json'), 'w', encoding="utf-8") as f:
-        f.write(json.dumps(upcoming_sales_min))
+    write_json(os.path.join(web_dir, 'api', 'upcoming.json'), upcoming_sales_min)
 
     # ======= JSON (all sales) =======
     all_sales = [ game.serialize() for game in games ]
-    with open(os.path.join(web_dir, 'api', 'all.json'), 'w', encoding="utf-8") as f:
-        f.write(json.dumps(all_sales))
+    MemoryReport.checkpoint('after serialization')
+    all_json_path = os.path.join(web_dir, 'api', 'all.json')
+    previous_sales = read_json(all_json_path)
+    write_json(all_json_path, all_sales)
+
+    # ======= JSON (changes) =======
+    publish_changes(previous_sales, all_sales, os.path.join(web_dir, 'api', 'changes'))
+    MemoryReport.checkpoint('after publishing changes')
+
+    # ======= JSON (shards) =======
+    publish_shards(all_sales, os.path.join(web_dir, 'api'))
+
+def publish_changes(previous_sales: Optional[list], all_sales: list, changes_dir: str):
+    """Publish the games changed since the previous run as changes/<seq>.json, and the
+    sequence number of the last change in changes/latest.json.
+    Clients can download the changes since the last sequence number they have seen,
+    instead of the whole lists. Only the last MAX_CHANGES files are kept."""
+    os.makedirs(changes_dir, exist_ok=True)
+    latest_path = os.path.join(changes_dir, 'latest.json')
+    # The sequence numbers of a new feed start again from 1, so clients recognize it by its ID
+    latest = read_json(latest_path) or {'feed': os.urandom(8).hex(), 'seq': 0, 'oldest': 1}
+    seq = latest['seq'] + 1
+    if previous_sales is None:
+        # Nothing to compare to, so every client has to download the whole lists again
+        oldest = seq + 1
+    else:
+        previous = { game['id']: game for game in previous_sales }
+        upserted = [ game for game in all_sales if previous.pop(game['id'], None) != game ]
+        removed = list(previous.keys())
+        if len(upserted) == 0 and len(removed) == 0:
+            return
+        write_json(os.path.join(changes_dir, f'{seq}.json'), {
+            'seq': seq,
+            'generated': int(time()),
+            'upserted': upserted,
+            'removed': removed,
+        })
+        oldest = max(latest['oldest'], seq - MAX_CHANGES + 1)
+    for old_seq in range(latest['oldest'], min(oldest, seq)):
+        try:
+            os.remove(os.path.join(changes_dir, f'{old_seq}.json'))
+        except FileNotFoundError:
+            pass
+    write_json(latest_path, {'feed': latest['feed'], 'seq': seq, 'oldest': oldest, 'generated': int(time())})
+
+def write_file(path: str, content: str):
+    with Profiler.phase('disk_io'):
+        with open(path, 'w', encoding="utf-8") as f:
+            f.write(content)
+
+def publish_shards(all_sales: list, api_dir: str):
+    """Publish the games in smaller files, listed in api/manifest.json with their hashes:
+     - pages/<n>.json: the games whose last sale ID is between n * SALES_PER_API_PAGE
+       and (n + 1) * SALES_PER_API_PAGE - 1, ordered by their last sale ID. A game that
+       gets a new sale only leaves its old page, the other pages stay the same.
+     - sales/<YYYY-MM>.json: the sales starting in the given month (UTC), with their games
+    Only the files whose content has changed are written."""
+    manifest_path = os.path.join(api_dir, 'manifest.json')
+    previous_manifest = read_json(manifest_path) or {'pages': [], 'months': []}
+    previous_hashes = { shard['path']: shard['sha1']
+        for shard in previous_manifest['pages'] + previous_manifest['months'] }
+    written = 0
+
+    def write_shard(path: str, data) -> str:
+        nonlocal written
+        with Profiler.phase('json'):
+            content = json.dumps(data)
+        sha1 = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        full_path = os.path.join(api_dir, path)
+        if previous_hashes.get(path) != sha1 or not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            write_file(full_path, content)
+            written += 1
+        return sha1
+
+    ordered = sorted(all_sales, key=lambda game: (game['sales'][-1]['id'], game['id']))
+    games_by_page: Dict[int, list] = {}
+    for game in ordered:
+        games_by_page.setdefault(game['sales'][-1]['id'] // SALES_PER_API_PAGE, []).append(game)
+    pages = []
+    for page, page_games in games_by_page.items():
+        path = f'pages/{page}.json'
+        pages.append({
+            'path': path,
+            'sha1': write_shard(path, page_games),
+            'games': len(page_games),
+            'first_sale': page_games[0]['sales'][-1]['id'],
+            'last_sale': page_games[-1]['sales'][-1]['id'],
+        })
+
+    sales_by_month: Dict[str, list] = {}
+    for game in ordered:
+        game_sales_by_month: Dict[str, list] = {}
+        for sale in game['sales']:
+            month = datetime.fromtimestamp(sale['start'], timezone.utc).strftime('%Y-%m')
+            game_sales_by_month.setdefault(month, []).append(sale)
+        for month, sales in game_sales_by_month.items():
+            sales_by_month.setdefault(month, []).append({**game, 'sales': sales})
+    months = []
+    for month in sorted(sales_by_month.keys()):
+        path = f'sales/{month}.json'
+        months.append({
+            'month': month,
+            'path': path,
+            'sha1': write_shard(path, sales_by_month[month]),
+            'games': len(sales_by_month[month]),
+        })
+
+    current_paths = { shard['path'] for shard in pages + months }
+    for path in previous_hashes.keys() - current_paths:
+        try:
+            os.remove(os.path.join(api_dir, path))
+        except FileNotFoundError:
+            pass
+    write_json(manifest_path, {
+        'generated': int(time()),
+        'games': len(all_sales),
+        'sales_per_page': SALES_PER_API_PAGE,
+        'pages': pages,
+        'months': months,
+    })
+    print(f'Wrote {written} of {len(current_paths)} API shards')
+
+def read_json(path: str):
+    """Returns None if the file doesn't exist"""
+    try:
+        with Profiler.phase('disk_io'):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+    except FileNotFoundError:
+        return None
+    with Profiler.phase('json'):
+        return json.loads(content)
+
+def write_json(path: str, data):
+    with Profiler.phase('json'):
+        content = json.dumps(data)
+    write_file(path, content)
+
+def read_resume_index(games_dir: str) -> int:
+    try:
+        with open(os.path.join(games_dir, 'resume_index.txt'), 'r', encoding='utf-8') as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0
+
+def render_index_pages(active_sales: List[ItchGame], upcoming_sales: List[ItchGame], resume_index: int) -> List[str]:
+    """Render index.html and the index-<n>.html pages"""
+    template = Template(pkg_resources.read_text(__package__, 'index.template.html'))
+    active_sales_rows = generate_rows(active_sales, 'active')
+    upcoming_sales_rows = generate_rows(upcoming_sales, 'upcoming')
+    pages_num = max(1, -(-max(len(active_sales_rows), len(upcoming_sales_rows)) // ROWS_PER_PAGE))
+    pages = []
+    for page in range(1, pages_num + 1):
+        rows = slice((page - 1) * ROWS_PER_PAGE, page * ROWS_PER_PAGE)
+        pages.append(template.substitute(
+                active_sales_rows = '\n'.join(active_sales_rows[rows]),
+                upcoming_sales_rows = '\n'.join(upcoming_sales_rows[rows]),
+                pagination = generate_pagination(page, pages_num),
+                last_update = datetime.now().strftime(DATE_FORMAT),
+                last_sale = resume_index,
+            ))
+    return pages
+
+def index_page_filename(page: int) -> str:
+    return 'index.html' if page == 1 else f'index-{page}.html'
+
+def generate_pagination(page: int, pages_num: int) -> str:
+    if pages_num == 1:
+        return ''
+    links = []
+    if page > 1:
+        links.append(f'<a href="./{index_page_filename(page - 1)}">Previous page</a>')
+    links.append(f'Page {page} of {pages_num}')
+    if page < pages_num:
+        links.append(f'<a href="./{index_page_filename(page + 1)}">Next page</a>')
+    return ' | '.join(links)
 
 def generate_rows(games: List[ItchGame], type: str) -> List[str]:
     rows: List[str] = []